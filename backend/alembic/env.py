@@ -5,6 +5,7 @@ from sqlalchemy import pool
 
 from alembic import context
 from database import Base
+from settings import settings
 import models
 import sys
 import os
@@ -13,6 +14,9 @@ sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..'
 
 config = context.config
 
+# 接続先はアプリケーションと同じく環境変数（DATABASE_URL）から読み込む
+config.set_main_option("sqlalchemy.url", settings.database_url.replace("%", "%%"))
+
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
@@ -0,0 +1,34 @@
+"""Add scheduler state
+
+Revision ID: 46906dd99d1b
+Revises: 84e9fec68058
+Create Date: 2026-10-18 21:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '46906dd99d1b'
+down_revision: Union[str, Sequence[str], None] = '84e9fec68058'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('scheduler_state',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('high_water_mark', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column('last_duration_seconds', sa.Float(), nullable=True),
+    sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('scheduler_state')
@@ -0,0 +1,33 @@
+"""Add cached streak columns to habits
+
+Revision ID: 77c0cb4e8990
+Revises: f01fc9117b19
+Create Date: 2026-10-18 20:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '77c0cb4e8990'
+down_revision: Union[str, Sequence[str], None] = 'f01fc9117b19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 既存の習慣の値は、マイグレーションの後に rebuild_habit_streaks.py で分割して埋める
+    op.add_column('habits', sa.Column('current_streak', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('habits', sa.Column('longest_streak', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('habits', sa.Column('last_completed_date', sa.Date(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('habits', 'last_completed_date')
+    op.drop_column('habits', 'longest_streak')
+    op.drop_column('habits', 'current_streak')
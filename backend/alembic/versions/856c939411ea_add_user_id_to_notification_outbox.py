@@ -0,0 +1,35 @@
+"""Add user_id to notification outbox for partitioned dispatch
+
+Revision ID: 856c939411ea
+Revises: 46906dd99d1b
+Create Date: 2026-10-18 22:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '856c939411ea'
+down_revision: Union[str, Sequence[str], None] = '46906dd99d1b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('notification_outbox', sa.Column('user_id', sa.Integer(), nullable=True))
+    op.execute("""
+        UPDATE notification_outbox AS o
+        SET user_id = n.user_id
+        FROM notifications AS n
+        WHERE n.id = o.notification_id
+    """)
+    op.alter_column('notification_outbox', 'user_id', nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('notification_outbox', 'user_id')
@@ -0,0 +1,48 @@
+"""Add goal progress counters
+
+Revision ID: 8b0704be3e70
+Revises: 9a9e66f70f57
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b0704be3e70'
+down_revision: Union[str, Sequence[str], None] = '9a9e66f70f57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('goals', sa.Column('current_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('goals', sa.Column('is_achieved', sa.Boolean(), server_default='false', nullable=False))
+    op.create_index(op.f('ix_goals_habit_id'), 'goals', ['habit_id'], unique=False)
+
+    # 既存の目標の達成数を habit_records から計算する
+    op.execute("""
+        UPDATE goals AS g
+        SET current_count = p.current_count,
+            is_achieved = p.current_count >= g.target_count
+        FROM (
+            SELECT g2.id AS goal_id,
+                   COUNT(DISTINCT r.date) FILTER (WHERE r.status) AS current_count
+            FROM goals AS g2
+            LEFT JOIN habit_records AS r
+                ON r.habit_id = g2.habit_id AND r.date BETWEEN g2.start_date AND g2.end_date
+            GROUP BY g2.id
+        ) AS p
+        WHERE g.id = p.goal_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_goals_habit_id'), table_name='goals')
+    op.drop_column('goals', 'is_achieved')
+    op.drop_column('goals', 'current_count')
@@ -0,0 +1,47 @@
+"""Add notification schedule and user timezone
+
+Revision ID: 9a9e66f70f57
+Revises: d6f17e12bd07
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a9e66f70f57'
+down_revision: Union[str, Sequence[str], None] = 'd6f17e12bd07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('timezone', sa.String(), server_default='Asia/Tokyo', nullable=False))
+    op.add_column('notifications', sa.Column('next_fire_at', sa.TIMESTAMP(timezone=True), nullable=True))
+    op.create_index(op.f('ix_notifications_next_fire_at'), 'notifications', ['next_fire_at'], unique=False)
+
+    # 既存の有効な通知について、ユーザーのタイムゾーンでの次回送信時刻を計算する
+    op.execute("""
+        UPDATE notifications AS n
+        SET next_fire_at = timezone(
+            u.timezone,
+            CASE
+                WHEN (timezone(u.timezone, now())::date + n.time) > timezone(u.timezone, now())
+                    THEN timezone(u.timezone, now())::date + n.time
+                ELSE timezone(u.timezone, now())::date + n.time + interval '1 day'
+            END
+        )
+        FROM users AS u
+        WHERE u.id = n.user_id AND n.enabled
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_notifications_next_fire_at'), table_name='notifications')
+    op.drop_column('notifications', 'next_fire_at')
+    op.drop_column('users', 'timezone')
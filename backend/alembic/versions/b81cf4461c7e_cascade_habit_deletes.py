@@ -0,0 +1,39 @@
+"""Cascade habit deletes to records, goals and notifications
+
+Revision ID: b81cf4461c7e
+Revises: 8b0704be3e70
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b81cf4461c7e'
+down_revision: Union[str, Sequence[str], None] = '8b0704be3e70'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# 習慣を参照している外部キー（PostgreSQL が自動で付けた制約名）
+HABIT_FOREIGN_KEYS = [
+    ('goals', 'goals_habit_id_fkey'),
+    ('habit_records', 'habit_records_habit_id_fkey'),
+    ('notifications', 'notifications_habit_id_fkey'),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table_name, constraint_name in HABIT_FOREIGN_KEYS:
+        op.drop_constraint(constraint_name, table_name, type_='foreignkey')
+        op.create_foreign_key(constraint_name, table_name, 'habits', ['habit_id'], ['id'], ondelete='CASCADE')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table_name, constraint_name in HABIT_FOREIGN_KEYS:
+        op.drop_constraint(constraint_name, table_name, type_='foreignkey')
+        op.create_foreign_key(constraint_name, table_name, 'habits', ['habit_id'], ['id'])
@@ -0,0 +1,28 @@
+"""Index habits.user_id
+
+Revision ID: f01fc9117b19
+Revises: b81cf4461c7e
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f01fc9117b19'
+down_revision: Union[str, Sequence[str], None] = 'b81cf4461c7e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_habits_user_id'), 'habits', ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_habits_user_id'), table_name='habits')
@@ -1,31 +1,78 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from jose import JWTError, jwt
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from datetime import timedelta, date
+from datetime import datetime, timedelta, timezone, date
 from contextlib import asynccontextmanager
+import logging
+
+import log_setup
+# firebase などが読み込み時に出すログも構造化ログとして出力されるよう、最初に設定する
+log_setup.configure()
 
 import firebase  
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from notification_sender import send_scheduled_notifications
-from database import SessionLocal, engine
-import models, crud, schemas, security
+from notification_sender import enqueue_scheduled_notifications_as_leader
+from notification_dispatcher import drain_outbox
+import email_sender
+from leader_election import scheduler_leader
+from settings import settings
+from database import SessionLocal, engine, async_engine
+import models, crud, crud_async, schemas, security, auth_cache, password_hashing
+import calendar_bitmap, habit_stats, scheduling
+import request_middleware
+import async_api
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import make_asgi_app
+
+logger = logging.getLogger(__name__)
 
 scheduler = AsyncIOScheduler(timezone="Asia/Tokyo")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """アプリケーションの起動時と終了時に処理を実行する"""
-    print("Starting up...")
-    scheduler.add_job(send_scheduled_notifications, 'interval', minutes=1, id="notification_job")
+    logger.info("Starting up")
+    # スケジューラはすべてのワーカーで動かし、アドバイザリロックを取得したリーダーだけが期限の来た通知をアウトボックスに積む
+    scheduler.add_job(
+        scheduler_leader.ensure, 'interval', seconds=settings.scheduler_leader_retry_seconds,
+        id="leader_election_job", next_run_time=datetime.now(timezone.utc)
+    )
+    # 前回のティックが終わっていなければ重ねて実行せず（max_instances=1）、遅れたティックは1回にまとめて
+    # 必ず実行する（coalesce / misfire_grace_time=None）。遅れた分の通知は next_fire_at から拾い直される
+    scheduler.add_job(
+        enqueue_scheduled_notifications_as_leader, 'interval', seconds=settings.scheduler_tick_interval_seconds,
+        id="notification_job", max_instances=1, coalesce=True, misfire_grace_time=None
+    )
+    # アウトボックスの送信は、リーダーかどうかに関係なくすべてのワーカーで行える（SKIP LOCKED で分担する）。
+    # user_id で分割したディスパッチャーを別に動かしている場合は、分割せずに確保する API のワーカーでは送信しない
+    if settings.notification_dispatcher_in_process and settings.notification_dispatcher_partitions > 1:
+        logger.warning(
+            "NOTIFICATION_DISPATCHER_IN_PROCESS is ignored because NOTIFICATION_DISPATCHER_PARTITIONS=%d; "
+            "run notification_dispatcher.py --partitions %d and set NOTIFICATION_DISPATCHER_IN_PROCESS=false",
+            settings.notification_dispatcher_partitions, settings.notification_dispatcher_partitions,
+        )
+    elif settings.notification_dispatcher_in_process:
+        scheduler.add_job(
+            drain_outbox, 'interval', seconds=settings.notification_dispatcher_poll_seconds, id="outbox_dispatch_job"
+        )
+    email_sender.warn_if_not_sending()
+    # 認証メールの送信も同じく、すべてのワーカーで行える
+    if settings.email_sender_in_process:
+        scheduler.add_job(
+            email_sender.drain_email_outbox, 'interval', seconds=settings.email_sender_poll_seconds, id="email_outbox_job"
+        )
     scheduler.start()
-    print("Scheduler started...")
+    logger.info("Scheduler started")
     yield
-    print("Shutting down...")
+    logger.info("Shutting down")
     scheduler.shutdown()
-    print("Scheduler shut down...")
+    scheduler_leader.release()
+    logger.info("Scheduler shut down")
+    email_sender.close_transport()
+    password_hashing.hasher.shutdown()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="Snoop - Habit Tracker API",
@@ -40,8 +87,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # すべてのHTTPメソッドを許可
     allow_headers=["*"],  # すべてのHTTPヘッダーを許可
+    expose_headers=request_middleware.EXPOSED_HEADERS,
 )
 
+# 相関ID・処理時間・SQL文の数をまとめて扱う（後から登録したミドルウェアほど外側で実行される）
+app.add_middleware(request_middleware.RequestMiddleware)
+
+# Prometheus用のメトリクスを公開する
+app.mount("/metrics", make_asgi_app())
+
+# 負荷の高いエンドポイントの非同期版（/async 以下）
+app.include_router(async_api.router)
+
 
 def get_db():
     """データベースセッションを取得する依存性関数"""
@@ -60,30 +117,39 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
+    # キャッシュにあれば、トークンのデコードとユーザーの取得を省略する
+    user = auth_cache.principal_cache.get(token)
+    if user is not None:
+        return user
+
+    payload = security.decode_access_token(token)
+    if payload is None:
         raise credentials_exception
-    
-    user = crud.get_user_by_email(db, email=email)
+
+    user = crud.get_user_by_email(db, email=payload["sub"])
     if user is None:
         raise credentials_exception
-    return user
+    return auth_cache.principal_cache.put(token, user, token_expires_at=payload.get("exp"))
 
 
 @app.post("/token", response_model=schemas.Token, tags=["Authentication"])
-def login_for_access_token(db: Session = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()):
+async def login_for_access_token(db: AsyncSession = Depends(async_api.get_async_db), form_data: OAuth2PasswordRequestForm = Depends()):
     """ユーザー名とパスワードでログインし、アクセストークンを取得する"""
-    user = crud.get_user_by_email(db, email=form_data.username)
-    if not user or not security.verify_password(form_data.password, user.password_hash):
+    user = await crud_async.get_user_by_email(db, email=form_data.username)
+    verified, new_password_hash = False, None
+    if user:
+        # bcrypt はリクエストを処理するワーカーではなく、ハッシュ化用のプロセスプールで実行する
+        verified, new_password_hash = await password_hashing.hasher.verify_and_update(form_data.password, user.password_hash)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_password_hash:
+        # 設定されたコストと異なるハッシュは、ログイン時に新しいコストで保存し直す
+        await crud_async.update_user_password_hash(db, user_id=user.id, password_hash=new_password_hash)
+
     access_token_expires = timedelta(minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = security.create_access_token(
         data={"sub": user.email}, expires_delta=access_token_expires
@@ -92,32 +158,30 @@ def login_for_access_token(db: Session = Depends(get_db), form_data: OAuth2Passw
 
 
 @app.post("/users", response_model=schemas.MessageResponse, status_code=status.HTTP_201_CREATED, tags=["Users"])
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(async_api.get_async_db)):
     """
     新しいユーザーを登録、または未認証ユーザーの認証コードを再送する
     """
     # 最初に、このメールアドレスを持つユーザーがすでに存在するか確認
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await crud_async.get_user_by_email(db, email=user.email)
 
     # もしユーザーが存在し、かつ「認証済み」である場合
     if db_user and db_user.is_verified:
         raise HTTPException(status_code=400, detail="このメールアドレスは既に使用されています。")
 
     # ユーザーが存在しないか、あるいは存在するが「未認証」の場合、
-    # crud.create_or_update_unverified_user を呼び出す
-    new_or_updated_user = crud.create_or_update_unverified_user(db=db, user_data=user)
+    # パスワードをハッシュ化用のプロセスプールでハッシュ化してから
+    # crud_async.create_or_update_unverified_user を呼び出す
+    password_hash = await password_hashing.hasher.hash(user.password)
+    new_or_updated_user = await crud_async.create_or_update_unverified_user(db=db, user_data=user, password_hash=password_hash)
 
     if not new_or_updated_user:
         # このケースは通常発生しないはず
         raise HTTPException(status_code=500, detail="ユーザーの作成または更新中にエラーが発生しました。")
 
-    # ★★★ メール送信シミュレーション ★★★
-    print("------------------------------------")
-    print(f"To: {new_or_updated_user.email}")
-    print(f"Subject: Snoop 認証コード")
-    print(f"あなたの認証コードは: {new_or_updated_user.verification_code} です。")
-    print("------------------------------------")
-    
+    # 認証メールは crud_async がユーザーと同じトランザクションで email_outbox に積み、email_sender が送信する
+    logger.info("Verification email queued", extra={"user_id": new_or_updated_user.id})
+
     return {"message": "認証コードをあなたのメールアドレスに送信しました。"}
 
 @app.post("/users/verify", response_model=schemas.Token, tags=["Users"])
@@ -146,6 +210,22 @@ def read_users_me(current_user: models.User = Depends(get_current_user)):
     """現在ログインしているユーザーの情報を取得する"""
     return current_user
 
+@app.get("/dashboard", response_model=schemas.DashboardResponse, tags=["Dashboard"])
+def read_dashboard(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    ダッシュボードの表示に必要なユーザー情報・習慣・今日の達成状況・期間中の目標・通知設定を1回で取得する
+    （習慣の数によらず、クエリの数は crud.DASHBOARD_QUERY_COUNT で一定）
+    """
+    today = scheduling.local_today(current_user.timezone)
+    return schemas.DashboardResponse(
+        user=schemas.UserResponse.model_validate(current_user),
+        as_of=today,
+        habits=crud.get_dashboard(db, user_id=current_user.id, today=today)
+    )
+
 @app.put("/users/me/fcm_token", response_model=schemas.UserResponse, tags=["Users"])
 def update_fcm_token_for_current_user(
     token_data: schemas.FCMTokenUpdate,
@@ -155,6 +235,15 @@ def update_fcm_token_for_current_user(
     """現在ログインしているユーザーのFCMトークンを更新する"""
     return crud.update_user_fcm_token(db=db, user_id=current_user.id, fcm_token=token_data.fcm_token)
 
+@app.put("/users/me/timezone", response_model=schemas.UserResponse, tags=["Users"])
+def update_timezone_for_current_user(
+    timezone_data: schemas.UserTimezoneUpdate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """現在ログインしているユーザーのタイムゾーンを更新する（通知はこのタイムゾーンの時刻で送信される）"""
+    return crud.update_user_timezone(db=db, user_id=current_user.id, tz_name=timezone_data.timezone)
+
 
 @app.post("/habits", response_model=schemas.HabitResponse, status_code=status.HTTP_201_CREATED, tags=["Habits"])
 def create_habit(
@@ -171,7 +260,8 @@ def read_habits_for_user(
     current_user: models.User = Depends(get_current_user)
 ):
     """ログインしているユーザーのすべての習慣を取得する"""
-    return crud.get_habits_by_user(db=db, user_id=current_user.id)
+    today = scheduling.local_today(current_user.timezone)
+    return [schemas.HabitResponse.as_of(habit, today) for habit in crud.get_habits_by_user(db=db, user_id=current_user.id)]
 
 @app.get("/habits/{habit_id}", response_model=schemas.HabitResponse, tags=["Habits"])
 def read_habit(
@@ -180,10 +270,10 @@ def read_habit(
     current_user: models.User = Depends(get_current_user)
 ):
     """IDで指定された単一の習慣を取得する"""
-    habit = crud.get_habit(db, habit_id=habit_id)
-    if not habit or habit.user_id != current_user.id:
+    habit = crud.get_habit_for_user(db, habit_id=habit_id, user_id=current_user.id)
+    if not habit:
         raise HTTPException(status_code=404, detail="Habit not found")
-    return habit
+    return schemas.HabitResponse.as_of(habit, scheduling.local_today(current_user.timezone))
 
 @app.put("/habits/{habit_id}", response_model=schemas.HabitResponse, tags=["Habits"])
 def update_habit(
@@ -193,10 +283,10 @@ def update_habit(
     current_user: models.User = Depends(get_current_user)
 ):
     """IDで指定された習慣を更新する"""
-    db_habit = crud.get_habit(db, habit_id=habit_id)
-    if not db_habit or db_habit.user_id != current_user.id:
+    db_habit = crud.update_habit(db, habit_id=habit_id, user_id=current_user.id, habit_data=habit)
+    if not db_habit:
         raise HTTPException(status_code=404, detail="Habit not found")
-    return crud.update_habit(db, habit_id=habit_id, habit_data=habit)
+    return schemas.HabitResponse.as_of(db_habit, scheduling.local_today(current_user.timezone))
 
 @app.delete("/habits/{habit_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Habits"])
 def delete_habit(
@@ -205,10 +295,8 @@ def delete_habit(
     current_user: models.User = Depends(get_current_user)
 ):
     """IDで指定された習慣を削除する"""
-    db_habit = crud.get_habit(db, habit_id=habit_id)
-    if not db_habit or db_habit.user_id != current_user.id:
+    if not crud.delete_habit(db, habit_id=habit_id, user_id=current_user.id):
         raise HTTPException(status_code=404, detail="Habit not found")
-    crud.delete_habit(db, habit_id=habit_id)
     return None 
 
 
@@ -219,8 +307,8 @@ def create_habit_record(
     current_user: models.User = Depends(get_current_user)
 ):
     """新しい習慣の記録を作成する"""
-    db_habit = crud.get_habit(db, habit_id=record.habit_id)
-    if not db_habit or db_habit.user_id != current_user.id:
+    db_habit = crud.get_habit_for_user(db, habit_id=record.habit_id, user_id=current_user.id)
+    if not db_habit:
         raise HTTPException(status_code=404, detail="Habit not found for this user")
         
     try:
@@ -229,6 +317,42 @@ def create_habit_record(
         db.rollback()
         raise HTTPException(status_code=409, detail="Record for this date already exists")
 
+@app.post("/habit_records/bulk", response_model=schemas.HabitRecordBulkResponse, tags=["Habit Records"])
+def bulk_upsert_habit_records(
+    payload: schemas.HabitRecordBulkCreate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    オフライン中に記録された複数の習慣の記録をまとめて作成・更新する。
+    同じ日付の記録が既にある場合は status を上書きし、結果を1件ごとに返す。
+    """
+    results = crud.bulk_upsert_habit_records(db, records=payload.records, user_id=current_user.id)
+    return schemas.HabitRecordBulkResponse(
+        created=sum(1 for result in results if result.outcome == "created"),
+        updated=sum(1 for result in results if result.outcome == "updated"),
+        not_found=sum(1 for result in results if result.outcome == "not_found"),
+        results=results
+    )
+
+@app.put("/habit_records/{record_id}", response_model=schemas.HabitRecordResponse, tags=["Habit Records"])
+def update_habit_record(
+    record_id: int,
+    record_update: schemas.HabitRecordUpdate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """IDで指定された習慣の記録を更新する"""
+    db_record = crud.get_habit_record_for_user(db, record_id=record_id, user_id=current_user.id)
+    if not db_record:
+        raise HTTPException(status_code=404, detail="Habit record not found")
+
+    try:
+        return crud.update_habit_record(db, db_record=db_record, record_update=record_update)
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Record for this date already exists")
+
 @app.get("/habits/{habit_id}/records", response_model=list[schemas.HabitRecordResponse], tags=["Habit Records"])
 def read_habit_records_for_habit(
     habit_id: int,
@@ -238,13 +362,95 @@ def read_habit_records_for_habit(
     current_user: models.User = Depends(get_current_user)
 ):
     """特定の習慣について、指定された期間の達成記録一覧を取得する"""
-    db_habit = crud.get_habit(db, habit_id=habit_id)
-    if not db_habit or db_habit.user_id != current_user.id:
+    db_habit = crud.get_habit_for_user(db, habit_id=habit_id, user_id=current_user.id)
+    if not db_habit:
         raise HTTPException(status_code=404, detail="Habit not found")
     
     return crud.get_habit_records_by_date_range(db=db, habit_id=habit_id, start_date=start_date, end_date=end_date)
 
 
+# カレンダーのビットマップで一度に取得できる日数の上限（約10年）
+MAX_CALENDAR_DAYS = 3660
+
+@app.get("/habits/{habit_id}/calendar", response_model=schemas.HabitCalendarBitmapResponse, tags=["Habit Records"])
+def read_habit_calendar(
+    habit_id: int,
+    start_date: date,
+    end_date: date,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """特定の習慣について、指定された期間の達成状況を1日1ビットのビットマップ（base64）で取得する"""
+    if end_date < start_date or calendar_bitmap.day_count(start_date, end_date) > MAX_CALENDAR_DAYS:
+        raise HTTPException(status_code=400, detail="Invalid date range")
+
+    db_habit = crud.get_habit_for_user(db, habit_id=habit_id, user_id=current_user.id)
+    if not db_habit:
+        raise HTTPException(status_code=404, detail="Habit not found")
+
+    completed_dates = crud.get_completed_dates(db, habit_id=habit_id, start_date=start_date, end_date=end_date)
+    bits = calendar_bitmap.build_bitmap(completed_dates, start_date, end_date)
+    return schemas.HabitCalendarBitmapResponse(
+        habit_id=habit_id,
+        start_date=start_date,
+        end_date=end_date,
+        days=calendar_bitmap.day_count(start_date, end_date),
+        bitmap=calendar_bitmap.to_base64(bits, start_date, end_date),
+        completed_count=bits.bit_count()
+    )
+
+@app.get("/records", response_model=schemas.RecordsCalendarResponse, tags=["Habit Records"])
+def read_records_for_user(
+    start_date: date,
+    end_date: date,
+    habit_ids: list[int] | None = Query(None),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    ログインしているユーザーのすべての習慣（habit_ids で絞り込み可能）について、
+    指定された期間に達成した日付を習慣ごとにまとめて取得する（カレンダー表示用）
+    """
+    dates_by_habit = crud.get_completed_dates_by_habit(
+        db, user_id=current_user.id, start_date=start_date, end_date=end_date, habit_ids=habit_ids
+    )
+    return schemas.RecordsCalendarResponse(
+        start_date=start_date,
+        end_date=end_date,
+        habits=[
+            schemas.HabitCompletedDates(habit_id=habit_id, dates=dates)
+            for habit_id, dates in dates_by_habit.items()
+        ]
+    )
+
+@app.get("/habits/{habit_id}/stats", response_model=schemas.HabitStatsResponse, tags=["Stats"])
+def read_habit_stats(
+    habit_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """特定の習慣の連続達成日数・直近7/30/90日の達成率・曜日ごとの達成数を取得する"""
+    rows = crud.get_completion_history(db, user_id=current_user.id, habit_ids=[habit_id])
+    if not rows:
+        raise HTTPException(status_code=404, detail="Habit not found")
+
+    today = scheduling.local_today(current_user.timezone)
+    return habit_stats.stats_from_history(rows, today)[0]
+
+@app.get("/users/me/stats", response_model=schemas.UserStatsResponse, tags=["Stats"])
+def read_stats_for_current_user(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """ログインしているユーザーのすべての習慣の統計をまとめて取得する"""
+    rows = crud.get_completion_history(db, user_id=current_user.id)
+    today = scheduling.local_today(current_user.timezone)
+    return schemas.UserStatsResponse(
+        as_of=today,
+        habits=[schemas.HabitStatsResponse.model_validate(stats) for stats in habit_stats.stats_from_history(rows, today)]
+    )
+
+
 @app.post("/habits/{habit_id}/goals", response_model=schemas.GoalResponse, status_code=status.HTTP_201_CREATED, tags=["Goals"])
 def create_goal(
     habit_id: int,
@@ -253,27 +459,11 @@ def create_goal(
     current_user: models.User = Depends(get_current_user)
 ):
     """特定の習慣に新しい目標を作成する"""
-    db_habit = crud.get_habit(db, habit_id=habit_id)
-    if not db_habit or db_habit.user_id != current_user.id:
+    db_habit = crud.get_habit_for_user(db, habit_id=habit_id, user_id=current_user.id)
+    if not db_habit:
         raise HTTPException(status_code=404, detail="Habit not found")
     
-    new_goal = crud.create_goal_for_habit(db=db, goal=goal, habit_id=habit_id)
-    
-    completed_records = crud.get_habit_records_by_date_range(db, habit_id=habit_id, start_date=new_goal.start_date, end_date=new_goal.end_date)
-    unique_completed_dates = {rec.date for rec in completed_records if rec.status}
-    current_count = len(unique_completed_dates)
-    is_achieved = current_count >= new_goal.target_count
-
-    return schemas.GoalResponse(
-        id=new_goal.id,
-        habit_id=new_goal.habit_id,
-        target_count=new_goal.target_count,
-        start_date=new_goal.start_date,
-        end_date=new_goal.end_date,
-        created_at=new_goal.created_at,
-        current_count=current_count,
-        is_achieved=is_achieved
-    )
+    return crud.create_goal_for_habit(db=db, goal=goal, habit_id=habit_id)
 
 @app.get("/habits/{habit_id}/goals", response_model=list[schemas.GoalResponse], tags=["Goals"])
 def read_goals(
@@ -282,29 +472,11 @@ def read_goals(
     current_user: models.User = Depends(get_current_user)
 ):
     """特定の習慣のすべての目標と、その達成状況を取得する"""
-    db_habit = crud.get_habit(db, habit_id=habit_id)
-    if not db_habit or db_habit.user_id != current_user.id:
+    db_habit = crud.get_habit_for_user(db, habit_id=habit_id, user_id=current_user.id)
+    if not db_habit:
         raise HTTPException(status_code=404, detail="Habit not found")
 
-    goals = crud.get_goals_for_habit(db, habit_id=habit_id)
-    response_goals = []
-    for goal in goals:
-        completed_records = crud.get_habit_records_by_date_range(db, habit_id=habit_id, start_date=goal.start_date, end_date=goal.end_date)
-        unique_completed_dates = {rec.date for rec in completed_records if rec.status}
-        current_count = len(unique_completed_dates)
-        is_achieved = current_count >= goal.target_count
-        
-        response_goals.append(schemas.GoalResponse(
-            id=goal.id,
-            habit_id=goal.habit_id,
-            target_count=goal.target_count,
-            start_date=goal.start_date,
-            end_date=goal.end_date,
-            created_at=goal.created_at,
-            current_count=current_count,
-            is_achieved=is_achieved
-        ))
-    return response_goals
+    return crud.get_goals_for_habit(db, habit_id=habit_id)
 
 @app.post("/notifications", response_model=schemas.NotificationResponse, status_code=status.HTTP_201_CREATED, tags=["Notifications"])
 def create_notification(
@@ -313,11 +485,10 @@ def create_notification(
     current_user: models.User = Depends(get_current_user)
 ):
     """新しい通知設定を作成する"""
-    db_habit = crud.get_habit(db, habit_id=notification.habit_id)
-    if not db_habit or db_habit.user_id != current_user.id:
+    db_notification = crud.create_notification(db, notification=notification, user_id=current_user.id, tz_name=current_user.timezone)
+    if not db_notification:
         raise HTTPException(status_code=404, detail="Habit not found for this user")
-
-    return crud.create_notification(db, notification=notification, user_id=current_user.id)
+    return db_notification
 
 @app.get("/habits/{habit_id}/notifications", response_model=list[schemas.NotificationResponse], tags=["Notifications"])
 def read_notifications_for_habit(
@@ -326,11 +497,11 @@ def read_notifications_for_habit(
     current_user: models.User = Depends(get_current_user)
 ):
     """特定の習慣に紐づく通知設定をすべて取得する"""
-    db_habit = crud.get_habit(db, habit_id=habit_id)
-    if not db_habit or db_habit.user_id != current_user.id:
+    db_habit = crud.get_habit_for_user(db, habit_id=habit_id, user_id=current_user.id)
+    if not db_habit:
         raise HTTPException(status_code=404, detail="Habit not found")
         
-    return crud.get_notifications_for_habit(db, habit_id=habit_id) 
+    return crud.get_notifications_for_habit(db, habit_id=habit_id, user_id=current_user.id)
 
 @app.put("/notifications/{notification_id}", response_model=schemas.NotificationResponse, tags=["Notifications"])
 def update_notification(
@@ -340,11 +511,16 @@ def update_notification(
     current_user: models.User = Depends(get_current_user)
 ):
     """IDで指定された通知設定を更新する"""
-    db_notification = crud.get_notification(db, notification_id=notification_id)
-    if not db_notification or db_notification.user_id != current_user.id:
+    db_notification = crud.update_notification(
+        db,
+        notification_id=notification_id,
+        user_id=current_user.id,
+        notification_update=notification_update,
+        tz_name=current_user.timezone
+    )
+    if not db_notification:
         raise HTTPException(status_code=404, detail="Notification not found")
-
-    return crud.update_notification(db, notification_id=notification_id, notification_update=notification_update)
+    return db_notification
 
 @app.delete("/notifications/{notification_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Notifications"])
 def delete_notification(
@@ -353,9 +529,6 @@ def delete_notification(
     current_user: models.User = Depends(get_current_user)
 ):
     """IDで指定された通知設定を削除する"""
-    db_notification = crud.get_notification(db, notification_id=notification_id)
-    if not db_notification or db_notification.user_id != current_user.id:
+    if not crud.delete_notification(db, notification_id=notification_id, user_id=current_user.id):
         raise HTTPException(status_code=404, detail="Notification not found")
-        
-    crud.delete_notification(db, notification_id=notification_id)
     return None
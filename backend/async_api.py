@@ -0,0 +1,118 @@
+# async_api.py
+# 負荷の高いエンドポイントの非同期版。/async 以下に同期版と同じパスで公開し、
+# スレッドプールを使う同期版と負荷試験で直接比較できるようにしている。
+
+from datetime import date
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+import models, crud_async, schemas, security, auth_cache, scheduling
+
+router = APIRouter(prefix="/async")
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+
+async def get_async_db():
+    """非同期データベースセッションを取得する依存性関数"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_current_user_async(db: AsyncSession = Depends(get_async_db), token: str = Depends(oauth2_scheme)) -> models.User:
+    """トークンを検証し、現在のユーザーモデルを返す依存性関数（非同期版）"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    # キャッシュにあれば、トークンのデコードとユーザーの取得を省略する
+    user = auth_cache.principal_cache.get(token)
+    if user is not None:
+        return user
+
+    payload = security.decode_access_token(token)
+    if payload is None:
+        raise credentials_exception
+
+    user = await crud_async.get_user_by_email(db, email=payload["sub"])
+    if user is None:
+        raise credentials_exception
+    return auth_cache.principal_cache.put(token, user, token_expires_at=payload.get("exp"))
+
+async def _get_owned_habit(db: AsyncSession, habit_id: int, user_id: int, detail: str = "Habit not found"):
+    """ユーザーが所有する習慣を取得する。見つからなければ404を返す"""
+    habit = await crud_async.get_habit_for_user(db, habit_id=habit_id, user_id=user_id)
+    if not habit:
+        raise HTTPException(status_code=404, detail=detail)
+    return habit
+
+
+@router.post("/habits", response_model=schemas.HabitResponse, status_code=status.HTTP_201_CREATED, tags=["Async"])
+async def create_habit(
+    habit: schemas.HabitCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_user_async)
+):
+    """新しい習慣を作成する"""
+    return await crud_async.create_habit(db, habit_data=habit, user_id=current_user.id)
+
+@router.get("/habits", response_model=list[schemas.HabitResponse], tags=["Async"])
+async def read_habits_for_user(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_user_async)
+):
+    """ログインしているユーザーのすべての習慣を取得する"""
+    today = scheduling.local_today(current_user.timezone)
+    return [schemas.HabitResponse.as_of(habit, today) for habit in await crud_async.get_habits_by_user(db, user_id=current_user.id)]
+
+@router.post("/habit_records", response_model=schemas.HabitRecordResponse, status_code=status.HTTP_201_CREATED, tags=["Async"])
+async def create_habit_record(
+    record: schemas.HabitRecordCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_user_async)
+):
+    """新しい習慣の記録を作成する"""
+    await _get_owned_habit(db, habit_id=record.habit_id, user_id=current_user.id, detail="Habit not found for this user")
+
+    try:
+        return await crud_async.create_habit_record(db, record)
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Record for this date already exists")
+
+@router.get("/habits/{habit_id}/records", response_model=list[schemas.HabitRecordResponse], tags=["Async"])
+async def read_habit_records_for_habit(
+    habit_id: int,
+    start_date: date,
+    end_date: date,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_user_async)
+):
+    """特定の習慣について、指定された期間の達成記録一覧を取得する"""
+    await _get_owned_habit(db, habit_id=habit_id, user_id=current_user.id)
+    return await crud_async.get_habit_records_by_date_range(db, habit_id=habit_id, start_date=start_date, end_date=end_date)
+
+@router.post("/habits/{habit_id}/goals", response_model=schemas.GoalResponse, status_code=status.HTTP_201_CREATED, tags=["Async"])
+async def create_goal(
+    habit_id: int,
+    goal: schemas.GoalCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_user_async)
+):
+    """特定の習慣に新しい目標を作成する"""
+    await _get_owned_habit(db, habit_id=habit_id, user_id=current_user.id)
+    return await crud_async.create_goal_for_habit(db, goal=goal, habit_id=habit_id)
+
+@router.get("/habits/{habit_id}/goals", response_model=list[schemas.GoalResponse], tags=["Async"])
+async def read_goals(
+    habit_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_user_async)
+):
+    """特定の習慣のすべての目標と、その達成状況を取得する"""
+    await _get_owned_habit(db, habit_id=habit_id, user_id=current_user.id)
+    return await crud_async.get_goals_for_habit(db, habit_id=habit_id)
@@ -0,0 +1,110 @@
+# auth_cache.py
+# get_current_user で毎回行っていた JWT のデコードとユーザーの SELECT を省くための、
+# プロセス内の TTL 付き LRU キャッシュ。
+# キャッシュはプロセスごとなので、ユーザーの更新による無効化は同じプロセスにしか届かない。
+# 他のワーカーでの古い情報は最大でも TTL の間しか残らない。
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import metrics
+import models
+from settings import settings
+
+
+def _token_key(token: str) -> str:
+    """トークンそのものではなく、そのハッシュをキーにする"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _detached_copy(user: models.User) -> models.User:
+    """セッションに属さない、列の値だけを持つユーザーのコピーを作る（読み取り専用として扱う）"""
+    return models.User(**{column.key: getattr(user, column.key) for column in models.User.__table__.columns})
+
+
+class PrincipalCache:
+    """トークンのハッシュをキーに、デコード済みのトークンに対応するユーザーを保持するキャッシュ"""
+
+    def __init__(self, maxsize: int, ttl_seconds: float, enabled: bool = True):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled and maxsize > 0
+        # token_key -> (user, expires_at)
+        self._entries: OrderedDict[str, tuple[models.User, float]] = OrderedDict()
+        # user_id -> そのユーザーのエントリの token_key（ユーザー単位の無効化に使う）
+        self._keys_by_user: dict[int, set[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[models.User]:
+        """キャッシュされたユーザーを返す。ない場合や期限切れの場合は None"""
+        if not self.enabled:
+            return None
+        key = _token_key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(key)
+                metrics.AUTH_CACHE_REQUESTS.labels("hit").inc()
+                return entry[0]
+            if entry is not None:
+                self._remove(key)
+        metrics.AUTH_CACHE_REQUESTS.labels("miss").inc()
+        return None
+
+    def put(self, token: str, user: models.User, token_expires_at: Optional[float] = None) -> models.User:
+        """
+        ユーザーをキャッシュし、リクエストで使うユーザーを返す。
+        有効期限は TTL とトークン自体の有効期限（exp）の早い方になる。
+        """
+        if not self.enabled:
+            return user
+        expires_at = time.time() + self.ttl_seconds
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+
+        cached_user = _detached_copy(user)
+        key = _token_key(token)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (cached_user, expires_at)
+            self._keys_by_user.setdefault(cached_user.id, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                metrics.AUTH_CACHE_EVICTIONS.inc()
+            metrics.AUTH_CACHE_SIZE.set(len(self._entries))
+        return cached_user
+
+    def invalidate_user(self, user_id: int):
+        """ユーザーが更新されたときに、そのユーザーのエントリをすべて削除する"""
+        if not self.enabled:
+            return
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._remove(key)
+            metrics.AUTH_CACHE_SIZE.set(len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+            metrics.AUTH_CACHE_SIZE.set(0)
+
+    def _remove(self, key: str):
+        """エントリを削除する（ロックを取得した状態で呼び出す）"""
+        user, _ = self._entries.pop(key)
+        keys = self._keys_by_user.get(user.id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user.id]
+
+
+principal_cache = PrincipalCache(
+    maxsize=settings.auth_cache_maxsize,
+    ttl_seconds=settings.auth_cache_ttl_seconds,
+    enabled=settings.auth_cache_enabled,
+)
@@ -0,0 +1,90 @@
+"""
+1年分の達成履歴について、従来の記録一覧（HabitRecordResponse の配列）と
+カレンダーのビットマップ（base64）のペイロードの大きさと、作成にかかる時間を比較する。
+
+--habit-id を指定した場合は、ローカルのデータベースからその習慣の記録を読み込み、
+crud.get_habit_records_by_date_range の経路とビットマップの経路をクエリ込みで計測する。
+指定しない場合は、達成率 70% の合成データでシリアライズだけを計測する。
+
+使い方（backend ディレクトリで実行）:
+    python -m benchmarks.bench_calendar_payload
+    python -m benchmarks.bench_calendar_payload --habit-id 1 --year 2025
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import date, timedelta
+
+import calendar_bitmap
+import schemas
+
+
+def _records_payload(records) -> bytes:
+    return json.dumps(
+        [schemas.HabitRecordResponse.model_validate(record).model_dump(mode="json") for record in records]
+    ).encode()
+
+def _bitmap_payload(habit_id: int, completed_dates, start_date: date, end_date: date) -> bytes:
+    bits = calendar_bitmap.build_bitmap(completed_dates, start_date, end_date)
+    return schemas.HabitCalendarBitmapResponse(
+        habit_id=habit_id,
+        start_date=start_date,
+        end_date=end_date,
+        days=calendar_bitmap.day_count(start_date, end_date),
+        bitmap=calendar_bitmap.to_base64(bits, start_date, end_date),
+        completed_count=bits.bit_count(),
+    ).model_dump_json().encode()
+
+def _timeit(fn, repeat: int) -> tuple[float, object]:
+    result = None
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--habit-id", type=int)
+    parser.add_argument("--year", type=int, default=date.today().year)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    start_date, end_date = date(args.year, 1, 1), date(args.year, 12, 31)
+
+    if args.habit_id is None:
+        rng = random.Random(0)
+        records = [
+            schemas.HabitRecordResponse(id=i + 1, habit_id=1, date=start_date + timedelta(days=i), status=rng.random() < 0.7)
+            for i in range(calendar_bitmap.day_count(start_date, end_date))
+        ]
+        completed = [record.date for record in records if record.status]
+        records_fn = lambda: _records_payload(records)
+        bitmap_fn = lambda: _bitmap_payload(1, completed, start_date, end_date)
+    else:
+        import crud
+        from database import SessionLocal
+
+        db = SessionLocal()
+        records_fn = lambda: _records_payload(
+            crud.get_habit_records_by_date_range(db, habit_id=args.habit_id, start_date=start_date, end_date=end_date)
+        )
+        bitmap_fn = lambda: _bitmap_payload(
+            args.habit_id,
+            crud.get_completed_dates(db, habit_id=args.habit_id, start_date=start_date, end_date=end_date),
+            start_date,
+            end_date,
+        )
+
+    records_time, records_body = _timeit(records_fn, args.repeat)
+    bitmap_time, bitmap_body = _timeit(bitmap_fn, args.repeat)
+
+    print(f"{'path':<10} {'bytes':>8} {'ms/request':>12}")
+    print(f"{'records':<10} {len(records_body):>8} {records_time * 1000:>12.3f}")
+    print(f"{'bitmap':<10} {len(bitmap_body):>8} {bitmap_time * 1000:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+メールの送信のスループットを、ローカルで起動した SMTP サーバー（aiosmtpd。実際にはどこにも配送しない）で計測する。
+データベースは使わず、email_sender のトランスポートだけを比べる:
+
+    per-message  メールごとに接続し、1通送って切断する（アウトボックス導入前のインライン送信に相当）
+    pooled       SmtpTransport（接続プール + バッチ送信）を workers 個のスレッドから使う
+
+--connect-latency で接続（EHLO）ごとの遅延（TLS・認証の往復の代わり）、--latency で1通ごとの遅延を加えられる。
+
+使い方（backend ディレクトリで実行）:
+    python -m benchmarks.bench_email_outbox
+    python -m benchmarks.bench_email_outbox --emails 2000 --workers 1 2 4 --connect-latency 0.05 --latency 0.005
+    python -m benchmarks.bench_email_outbox --rate 50
+"""
+
+import argparse
+import asyncio
+import smtplib
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiosmtpd.controller import Controller
+
+from email_sender import OutgoingEmail, RateLimiter, SmtpConnectionPool, SmtpTransport
+
+FROM_ADDRESS = "Snoop <no-reply@snoop.local>"
+
+
+class CountingHandler:
+    """受け取ったメールと接続の数を数えるだけの SMTP サーバーのハンドラー"""
+
+    def __init__(self, connect_latency: float, latency: float):
+        self.connect_latency = connect_latency
+        self.latency = latency
+        self.messages = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        session.host_name = hostname
+        with self._lock:
+            self.connections += 1
+        if self.connect_latency:
+            await asyncio.sleep(self.connect_latency)
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        with self._lock:
+            self.messages += 1
+        return "250 OK"
+
+
+def free_port() -> int:
+    # aiosmtpd の Controller は port=0（空いているポートを選ばせる）で起動できないので、先に選んでおく
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_emails(n: int) -> list[OutgoingEmail]:
+    return [
+        OutgoingEmail(
+            outbox_id=i,
+            to_address=f"user-{i}@email-bench.invalid",
+            subject="Snoop 認証コード",
+            body=f"あなたの認証コードは: {i:06d} です。",
+            correlation_id=f"bench-{i}",
+        )
+        for i in range(n)
+    ]
+
+
+def send_per_message(host: str, port: int, emails: list[OutgoingEmail], workers: int) -> int:
+    """メールごとに接続して送る。成功した数を返す"""
+    builder = SmtpTransport(pool=None, from_address=FROM_ADDRESS)
+
+    def send(email):
+        with smtplib.SMTP(host, port, timeout=30) as smtp:
+            smtp.send_message(builder.build_message(email))
+        return 1
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(send, emails))
+
+
+def send_pooled(transport: SmtpTransport, emails: list[OutgoingEmail], workers: int, batch_size: int) -> int:
+    """workers 個のスレッドで、batch_size 通ずつ SmtpTransport.send_batch で送る。成功した数を返す"""
+    batches = [emails[i:i + batch_size] for i in range(0, len(emails), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(
+            sum(result.success for result in results)
+            for results in executor.map(transport.send_batch, batches)
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=1000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--messages-per-connection", type=int, default=100)
+    parser.add_argument("--connect-latency", type=float, default=0.02, help="seconds added to every EHLO")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every message")
+    parser.add_argument("--rate", type=float, default=0.0, help="emails per second for the pooled transport (0: unlimited)")
+    args = parser.parse_args()
+
+    handler = CountingHandler(args.connect_latency, args.latency)
+    host, port = "127.0.0.1", free_port()
+    controller = Controller(handler, hostname=host, port=port)
+    controller.start()
+    emails = make_emails(args.emails)
+
+    print(
+        f"{args.emails} emails, connect latency {args.connect_latency * 1000:.0f} ms, "
+        f"per-message latency {args.latency * 1000:.0f} ms, batch size {args.batch_size}"
+    )
+    print(f"{'mode':<12} {'workers':>7} {'sent':>6} {'seconds':>8} {'emails/s':>9} {'connections':>12}")
+    try:
+        for workers in args.workers:
+            modes = {
+                "per-message": lambda: send_per_message(host, port, emails, workers),
+            }
+            pool = SmtpConnectionPool(
+                host, port, size=workers, messages_per_connection=args.messages_per_connection, timeout=30
+            )
+            limiter = RateLimiter(args.rate) if args.rate else None
+            transport = SmtpTransport(pool, FROM_ADDRESS, limiter)
+            modes["pooled"] = lambda: send_pooled(transport, emails, workers, args.batch_size)
+
+            for mode, run in modes.items():
+                connections_before = handler.connections
+                start = time.perf_counter()
+                sent = run()
+                elapsed = time.perf_counter() - start
+                print(
+                    f"{mode:<12} {workers:>7} {sent:>6} {elapsed:>8.2f} {sent / elapsed:>9.0f} "
+                    f"{handler.connections - connections_before:>12}"
+                )
+            transport.close()
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+habit_stats.compute_stats（NumPy でまとめて計算）と、記録を1件ずつ見ていく素朴な Python のループで、
+多数の習慣の統計を計算する時間を比較する。結果が一致することも確認する。
+
+使い方（backend ディレクトリで実行）:
+    python -m benchmarks.bench_habit_stats
+    python -m benchmarks.bench_habit_stats --habits 10000 --days 730
+"""
+
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+import habit_stats
+
+
+def naive_stats(habit_ids, record_habit_ids, record_dates, today, start_dates):
+    """習慣ごとに記録を1件ずつたどって統計を求める（比較用）"""
+    dates_by_habit = {habit_id: set() for habit_id in habit_ids}
+    for habit_id, record_date in zip(record_habit_ids, record_dates):
+        if habit_id in dates_by_habit and record_date <= today:
+            dates_by_habit[habit_id].add(record_date)
+
+    results = []
+    for habit_id, start_date in zip(habit_ids, start_dates):
+        completed = sorted(dates_by_habit[habit_id])
+
+        longest = run = 0
+        previous = None
+        for record_date in completed:
+            run = run + 1 if previous is not None and record_date - previous == timedelta(days=1) else 1
+            longest = max(longest, run)
+            previous = record_date
+        current = run if previous is not None and previous >= today - timedelta(days=1) else 0
+
+        rates = []
+        elapsed = (today - start_date).days + 1
+        for window in habit_stats.ROLLING_WINDOWS:
+            count = sum(1 for record_date in completed if record_date > today - timedelta(days=window))
+            rates.append(round(min(count / min(max(elapsed, 1), window), 1.0), 4))
+
+        weekday_counts = [0] * 7
+        for record_date in completed:
+            weekday_counts[record_date.weekday()] += 1
+
+        results.append(habit_stats.HabitStats(
+            habit_id=habit_id,
+            as_of=today,
+            current_streak=current,
+            longest_streak=longest,
+            completion_rate_7d=rates[0],
+            completion_rate_30d=rates[1],
+            completion_rate_90d=rates[2],
+            weekday_counts=weekday_counts,
+        ))
+    return results
+
+
+def make_history(n_habits: int, n_days: int, today: date, seed: int = 0):
+    """習慣ごとに達成率の異なる合成データを作る"""
+    rng = random.Random(seed)
+    habit_ids = list(range(1, n_habits + 1))
+    start_dates = []
+    record_habit_ids, record_dates = [], []
+    for habit_id in habit_ids:
+        length = rng.randint(1, n_days)
+        start = today - timedelta(days=length - 1)
+        start_dates.append(start)
+        probability = rng.uniform(0.2, 0.95)
+        for offset in range(length):
+            if rng.random() < probability:
+                record_habit_ids.append(habit_id)
+                record_dates.append(start + timedelta(days=offset))
+    return habit_ids, record_habit_ids, record_dates, start_dates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--habits", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+
+    today = date.today()
+    habit_ids, record_habit_ids, record_dates, start_dates = make_history(args.habits, args.days, today)
+    print(f"{args.habits} habits, {len(record_dates)} completed records")
+
+    start = time.perf_counter()
+    naive = naive_stats(habit_ids, record_habit_ids, record_dates, today, start_dates)
+    naive_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = habit_stats.compute_stats(habit_ids, record_habit_ids, record_dates, today, start_dates=start_dates)
+    vectorized_time = time.perf_counter() - start
+
+    assert naive == vectorized, "results differ"
+    print(f"naive loop: {naive_time * 1000:10.1f} ms")
+    print(f"numpy:      {vectorized_time * 1000:10.1f} ms  ({naive_time / vectorized_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
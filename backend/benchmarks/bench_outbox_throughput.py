@@ -0,0 +1,120 @@
+"""
+通知のアウトボックスのスループットを、ローカルのデータベースと FakeTransport（FCMの代わり）で計測する。
+ベンチマーク用のユーザー・習慣・通知を作成し、ワーカー数ごとに
+「通知ティックがアウトボックスに積む時間」と「ディスパッチャーが送信し切る時間」を計測してから削除する。
+
+使い方（backend ディレクトリで実行。他のデータの入っていないローカルのデータベースで実行すること）:
+    python -m benchmarks.bench_outbox_throughput
+    python -m benchmarks.bench_outbox_throughput --reminders 20000 --workers 1 2 4 8 --latency 0.1 --failure-rate 0.02
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as time_type, timedelta, timezone
+
+from sqlalchemy import delete, insert, select, update
+
+import crud
+import fcm_dispatcher
+import models
+from database import SessionLocal
+from notification_dispatcher import drain_outbox
+
+EMAIL_DOMAIN = "outbox-bench.invalid"
+
+
+def seed(db, n: int) -> list[int]:
+    """ベンチマーク用のユーザー・習慣・通知を n 件ずつ作成し、通知のIDを返す"""
+    now = datetime.now(timezone.utc)
+    user_ids = db.scalars(
+        insert(models.User).returning(models.User.id, sort_by_parameter_order=True),
+        [
+            dict(
+                name=f"bench-{i}",
+                email=f"bench-{i}@{EMAIL_DOMAIN}",
+                password_hash="x",
+                created_at=now,
+                fcm_token=f"bench-token-{i}",
+                is_verified=True,
+            )
+            for i in range(n)
+        ],
+    ).all()
+    habit_ids = db.scalars(
+        insert(models.Habit).returning(models.Habit.id, sort_by_parameter_order=True),
+        [dict(user_id=user_id, name="bench", created_at=now) for user_id in user_ids],
+    ).all()
+    notification_ids = db.scalars(
+        insert(models.Notification).returning(models.Notification.id),
+        [
+            dict(user_id=user_id, habit_id=habit_id, time=time_type(8, 0), enabled=True)
+            for user_id, habit_id in zip(user_ids, habit_ids)
+        ],
+    ).all()
+    db.commit()
+    return notification_ids
+
+
+def cleanup(db):
+    bench_users = select(models.User.id).where(models.User.email.like(f"%@{EMAIL_DOMAIN}"))
+    db.execute(delete(models.Notification).where(models.Notification.user_id.in_(bench_users)))
+    db.execute(delete(models.Habit).where(models.Habit.user_id.in_(bench_users)))
+    db.execute(delete(models.User).where(models.User.email.like(f"%@{EMAIL_DOMAIN}")))
+    db.commit()
+
+
+def run_once(db, notification_ids: list[int], workers: int, transport) -> tuple[float, float, int]:
+    """すべての通知を期限切れにしてから、積む時間と送信し切る時間を計測する"""
+    now = datetime.now(timezone.utc)
+    db.execute(
+        update(models.Notification)
+        .where(models.Notification.id.in_(notification_ids))
+        .values(next_fire_at=now - timedelta(seconds=1))
+    )
+    db.commit()
+
+    start = time.perf_counter()
+    while crud.enqueue_due_reminders(db, now=now)[0]:
+        pass
+    enqueue_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        claimed = sum(executor.map(lambda _: drain_outbox(transport=transport), range(workers)))
+    dispatch_time = time.perf_counter() - start
+
+    # 次の計測に持ち越さないよう、再送待ちや dead の行も削除する
+    db.execute(delete(models.NotificationOutbox).where(models.NotificationOutbox.notification_id.in_(notification_ids)))
+    db.commit()
+    return enqueue_time, dispatch_time, claimed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reminders", type=int, default=5000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--latency", type=float, default=0.05, help="fake FCM latency per batch (seconds)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of transient send failures")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        cleanup(db)
+        notification_ids = seed(db, args.reminders)
+        print(f"{args.reminders} reminders, fake FCM latency {args.latency * 1000:.0f} ms/batch, failure rate {args.failure_rate:.1%}")
+        print(f"{'workers':>8} {'enqueue s':>10} {'dispatch s':>11} {'msgs/s':>10} {'failed':>8}")
+        for workers in args.workers:
+            transport = fcm_dispatcher.FakeTransport(latency=args.latency, failure_rate=args.failure_rate, seed=0)
+            enqueue_time, dispatch_time, claimed = run_once(db, notification_ids, workers, transport)
+            print(
+                f"{workers:>8} {enqueue_time:>10.2f} {dispatch_time:>11.2f} "
+                f"{claimed / dispatch_time:>10.0f} {transport.failed_count:>8}"
+            )
+    finally:
+        cleanup(db)
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
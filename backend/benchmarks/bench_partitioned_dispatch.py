@@ -0,0 +1,168 @@
+"""
+リマインダーの送信を user_id % K で K 個のプロセスに分けたときの、1秒あたりの送信数を計測する。
+ベンチマーク用のユーザー・通知を作成してアウトボックスに積み、K ごとに各プロセスが
+notification_dispatcher.drain_outbox(partition=p, partitions=K) で自分のパーティションを送信し切るまでを計測する
+（run_partition が繰り返し実行するのと同じ処理で、claim_outbox_batch の user_id % K の絞り込みを通る）。
+各プロセスが確保した行の数が、そのパーティションに積んだ数と一致することも確かめる。
+
+FCMの代わりにローカルの偽のエンドポイント（HTTP）を起動し、fcm_dispatcher.HttpFakeTransport で送信する。
+メッセージの組み立て・JSONへの変換・HTTPの送受信のCPUコストはプロセスごとに並列になるが、TLS は再現しない。
+
+使い方（backend ディレクトリで実行。他のデータの入っていないローカルのデータベースで実行すること）:
+    python -m benchmarks.bench_partitioned_dispatch
+    python -m benchmarks.bench_partitioned_dispatch --reminders 50000 --partitions 1 2 4 8 --latency 0.02
+"""
+
+import argparse
+import json
+import multiprocessing
+import socket
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import delete, func, select, update
+
+import crud
+import fcm_dispatcher
+import models
+from benchmarks.bench_outbox_throughput import cleanup, seed
+from database import SessionLocal
+from notification_dispatcher import drain_outbox
+from settings import settings
+
+
+class _FakeFCMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+
+    def do_POST(self):
+        messages = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.latency:
+            time.sleep(self.latency)
+        body = json.dumps([
+            {"success": True, "message_id": f"fake/{uuid.uuid4().hex}"} for _ in messages
+        ]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ReusePortServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # 複数のプロセスで同じポートを待ち受け、偽のエンドポイント側がボトルネックにならないようにする
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+def _serve_fake_fcm(port: int, latency: float):
+    _FakeFCMHandler.latency = latency
+    _ReusePortServer(("127.0.0.1", port), _FakeFCMHandler).serve_forever()
+
+
+def _drain_partition(partition: int, partitions: int, port: int, workers: int) -> int:
+    """workers 個のスレッドで、このパーティションのアウトボックスを送信し切り、確保した行の数を返す"""
+    transport = fcm_dispatcher.HttpFakeTransport(port=port)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(
+            lambda _: drain_outbox(transport=transport, partition=partition, partitions=partitions), range(workers)
+        ))
+
+
+def enqueue_all(db, notification_ids: list[int]) -> int:
+    """すべての通知を期限切れにしてアウトボックスに積み、積んだ数を返す"""
+    now = datetime.now(timezone.utc)
+    db.execute(
+        update(models.Notification)
+        .where(models.Notification.id.in_(notification_ids))
+        .values(next_fire_at=now - timedelta(seconds=1))
+    )
+    db.commit()
+    enqueued = 0
+    while True:
+        claimed, added = crud.enqueue_due_reminders(db, now=now)
+        if not claimed:
+            return enqueued
+        enqueued += added
+
+
+def pending_by_partition(db, partitions: int) -> dict[int, int]:
+    """パーティションごとの送信待ちの行の数"""
+    partition = models.NotificationOutbox.user_id % partitions
+    return dict(db.execute(
+        select(partition, func.count())
+        .where(models.NotificationOutbox.status == crud.OUTBOX_STATUS_PENDING)
+        .group_by(partition)
+    ).all())
+
+
+def _warm_up(_):
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reminders", type=int, default=20000)
+    parser.add_argument("--partitions", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--workers", type=int, default=settings.notification_dispatcher_workers, help="dispatcher threads per partition")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake FCM latency per batch (seconds)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--server-processes", type=int, default=4)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    servers = [
+        context.Process(target=_serve_fake_fcm, args=(args.port, args.latency), daemon=True)
+        for _ in range(args.server_processes)
+    ]
+    for server in servers:
+        server.start()
+    time.sleep(1.0)
+
+    db = SessionLocal()
+    try:
+        cleanup(db)
+        notification_ids = seed(db, args.reminders)
+        print(f"{args.reminders} reminders, {args.workers} threads/partition, fake FCM latency {args.latency * 1000:.0f} ms/batch")
+        print(f"{'K':>4} {'seconds':>9} {'reminders/s':>12} {'speedup':>8}")
+        baseline = None
+        for partitions in args.partitions:
+            enqueued = enqueue_all(db, notification_ids)
+            expected = pending_by_partition(db, partitions)
+            with ProcessPoolExecutor(max_workers=partitions, mp_context=context) as executor:
+                # プロセスの起動時間を計測に含めない
+                list(executor.map(_warm_up, range(partitions)))
+                start = time.perf_counter()
+                futures = {
+                    partition: executor.submit(_drain_partition, partition, partitions, args.port, args.workers)
+                    for partition in range(partitions)
+                }
+                claimed = {partition: future.result() for partition, future in futures.items()}
+                elapsed = time.perf_counter() - start
+            # 各プロセスが自分のパーティションの行だけを、過不足なく確保したこと
+            assert claimed == {p: expected.get(p, 0) for p in range(partitions)}, f"claimed {claimed}, expected {expected}"
+            assert sum(claimed.values()) == enqueued
+            db.execute(delete(models.NotificationOutbox).where(models.NotificationOutbox.notification_id.in_(notification_ids)))
+            db.commit()
+
+            rate = enqueued / elapsed
+            baseline = baseline or rate
+            print(f"{partitions:>4} {elapsed:>9.2f} {rate:>12.0f} {rate / baseline:>7.1f}x")
+    finally:
+        cleanup(db)
+        db.close()
+        for server in servers:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
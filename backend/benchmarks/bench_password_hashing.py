@@ -0,0 +1,87 @@
+"""
+ログインのスループットと、ログイン集中時に他のエンドポイントがどれだけ遅れるかを、
+bcrypt をスレッドで実行する場合（従来の同期エンドポイントと同じ）とプロセスプールで実行する場合で比較する。
+データベースは使わない。
+
+使い方（backend ディレクトリで実行）:
+    python -m benchmarks.bench_password_hashing --logins 200 --concurrency 32 --pool-size 4
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from password_hashing import PasswordHasher
+
+
+def _other_endpoint_work():
+    """他のエンドポイントの処理を模した、短いCPU処理（GILが必要）"""
+    payload = [{"id": i, "name": f"habit {i}", "status": i % 2 == 0} for i in range(200)]
+    return json.dumps(payload)
+
+
+async def _probe(stop: asyncio.Event, latencies: list[float]):
+    """ログインの処理中に、他のリクエストの処理にかかる時間を繰り返し測る"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.to_thread(_other_endpoint_work)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+
+
+async def _run(hasher: PasswordHasher, hashed_password: str, logins: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with semaphore:
+            verified, _ = await hasher.verify_and_update("correct horse battery staple", hashed_password)
+            assert verified
+
+    stop = asyncio.Event()
+    latencies: list[float] = []
+    probe_task = asyncio.create_task(_probe(stop, latencies))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await probe_task
+    latencies.sort()
+    return {
+        "logins_per_sec": logins / elapsed,
+        "probe_p50_ms": statistics.median(latencies) * 1000,
+        "probe_p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000 if len(latencies) > 1 else latencies[0] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--pool-size", type=int, default=4)
+    args = parser.parse_args()
+
+    inline = PasswordHasher(rounds=args.rounds, pool_size=0)
+    hashed_password = inline.hash_sync("correct horse battery staple")
+
+    pooled = PasswordHasher(rounds=args.rounds, pool_size=args.pool_size)
+    # プロセスの起動時間を計測に含めないよう、先に1回実行しておく
+    pooled.verify_sync("correct horse battery staple", hashed_password)
+
+    try:
+        for label, hasher in (("threads", inline), (f"process pool ({args.pool_size})", pooled)):
+            result = asyncio.run(_run(hasher, hashed_password, args.logins, args.concurrency))
+            print(
+                f"{label:<20} {result['logins_per_sec']:8.1f} logins/s   "
+                f"other endpoint p50 {result['probe_p50_ms']:7.2f} ms  p99 {result['probe_p99_ms']:7.2f} ms"
+            )
+    finally:
+        pooled.shutdown()
+
+
+if __name__ == "__main__":
+    main()
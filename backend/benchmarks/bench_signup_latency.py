@@ -0,0 +1,114 @@
+"""
+ユーザー登録（crud.create_or_update_unverified_user）のレイテンシを、認証メールの送り方ごとに計測する:
+
+    outbox   メールは同じトランザクションで email_outbox に積むだけ（現在の実装）
+    inline   積んだうえで、その場で SMTP サーバーに接続して送る（アウトボックス導入前の送り方に相当）
+
+SMTP サーバーはローカルで起動した aiosmtpd（どこにも配送しない）で、--connect-latency・--latency で遅延を加えられる。
+パスワードのハッシュは事前に1回だけ計算して使い回す（bcrypt の時間を計測に含めない）。
+作成したユーザー（@signup-bench.example.com）と、そのアウトボックスの行は最後に削除する。
+
+使い方（backend ディレクトリで実行。ローカルのデータベースで実行すること）:
+    python -m benchmarks.bench_signup_latency
+    python -m benchmarks.bench_signup_latency --repeat 500 --connect-latency 0.2
+"""
+
+import argparse
+import smtplib
+import statistics
+import time
+
+from aiosmtpd.controller import Controller
+from sqlalchemy import delete
+
+import crud
+import models
+import schemas
+import security
+from benchmarks.bench_email_outbox import FROM_ADDRESS, CountingHandler, free_port
+from database import SessionLocal
+from email_sender import OutgoingEmail, SmtpTransport
+
+EMAIL_DOMAIN = "signup-bench.example.com"
+
+
+def measure(fn, repeat: int, warmup: int) -> list[float]:
+    """fn を warmup 回実行してから repeat 回計測し、1回ごとの秒数を返す"""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def percentile(timings: list[float], p: float) -> float:
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def cleanup(db):
+    """ベンチマークで作成したユーザーを削除する（アウトボックスの行は ON DELETE CASCADE で消える）"""
+    db.execute(delete(models.User).where(models.User.email.like(f"%@{EMAIL_DOMAIN}")))
+    db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--connect-latency", type=float, default=0.05, help="seconds added to every EHLO")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds added to every message")
+    args = parser.parse_args()
+
+    handler = CountingHandler(args.connect_latency, args.latency)
+    host, port = "127.0.0.1", free_port()
+    controller = Controller(handler, hostname=host, port=port)
+    controller.start()
+    builder = SmtpTransport(pool=None, from_address=FROM_ADDRESS)
+    password_hash = security.get_password_hash("signup-bench-password")
+    counter = iter(range(10**9))
+
+    db = SessionLocal()
+
+    def signup():
+        i = next(counter)
+        user_data = schemas.UserCreate(name=f"signup-{i}", email=f"signup-{i}@{EMAIL_DOMAIN}", password="x")
+        user = crud.create_or_update_unverified_user(db, user_data, password_hash=password_hash)
+        db.expunge_all()
+        return user
+
+    def signup_and_send():
+        user = signup()
+        email = OutgoingEmail(
+            outbox_id=0,
+            to_address=user.email,
+            subject=crud.VERIFICATION_EMAIL_SUBJECT,
+            body=f"あなたの認証コードは: {user.verification_code} です。",
+        )
+        with smtplib.SMTP(host, port, timeout=30) as smtp:
+            smtp.send_message(builder.build_message(email))
+
+    print(
+        f"SMTP connect latency {args.connect_latency * 1000:.0f} ms, "
+        f"per-message latency {args.latency * 1000:.0f} ms"
+    )
+    print(f"{'mode':<8} {'runs':>5} {'p50 ms':>9} {'p99 ms':>9}")
+    try:
+        cleanup(db)
+        for mode, fn in (("outbox", signup), ("inline", signup_and_send)):
+            timings = measure(fn, args.repeat, args.warmup)
+            print(
+                f"{mode:<8} {args.repeat:>5} {statistics.median(timings) * 1000:>9.2f} "
+                f"{percentile(timings, 0.99) * 1000:>9.2f}"
+            )
+    finally:
+        cleanup(db)
+        db.close()
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
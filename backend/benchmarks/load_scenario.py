@@ -0,0 +1,139 @@
+"""
+起動中の API に対して「ログイン → ダッシュボード → チェックイン」のシナリオを並行して繰り返し、
+ステップごとのレイテンシ（p50・p99）・SQL文の数（X-DB-Query-Count）と、全体のスループットを表示する。
+標準ライブラリの http.client だけを使うので、オフラインの環境でも実行できる。
+
+ログインには seed_data で作成したユーザーを順番に使う。チェックインは /habit_records/bulk で
+今日の記録を作成・上書きするので、同じユーザーで何度繰り返しても失敗しない。
+
+使い方（backend ディレクトリで実行。先に seed_data でデータを作成し、API を起動しておくこと）:
+    python -m benchmarks.seed_data --users 1000 --habits 5 --days 365
+    uvicorn app:app --workers 4
+    python -m benchmarks.load_scenario --concurrency 20 --duration 60
+"""
+
+import argparse
+import json
+import statistics
+import threading
+import time
+from collections import defaultdict
+from http.client import HTTPConnection
+from urllib.parse import urlencode, urlsplit
+
+from benchmarks.seed_data import PASSWORD, seed_email
+
+STEPS = ("login", "dashboard", "check-in")
+
+
+class Recorder:
+    """ステップごとのレイテンシ・SQL文の数・失敗数を集める（スレッドセーフ）"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, step: str, seconds: float, status: int, query_count: str | None):
+        with self._lock:
+            if status >= 400:
+                self.errors[step] += 1
+                return
+            self.latencies[step].append(seconds)
+            if query_count is not None:
+                self.queries[step].append(int(query_count))
+
+
+def _request(conn: HTTPConnection, recorder: Recorder, step: str, method: str, path: str, body=None, headers=None):
+    start = time.perf_counter()
+    conn.request(method, path, body=body, headers=headers or {})
+    response = conn.getresponse()
+    payload = response.read()
+    recorder.add(step, time.perf_counter() - start, response.status, response.getheader("X-DB-Query-Count"))
+    return response.status, payload
+
+
+def run_scenario(conn: HTTPConnection, recorder: Recorder, email: str) -> bool:
+    """1人分のシナリオを1回実行し、最後のステップまで成功したかを返す"""
+    status, payload = _request(
+        conn, recorder, "login", "POST", "/token",
+        body=urlencode({"username": email, "password": PASSWORD}),
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    if status != 200:
+        return False
+    auth = {"Authorization": f"Bearer {json.loads(payload)['access_token']}"}
+
+    status, payload = _request(conn, recorder, "dashboard", "GET", "/dashboard", headers=auth)
+    if status != 200:
+        return False
+    dashboard = json.loads(payload)
+    if not dashboard["habits"]:
+        return False
+
+    record = {"habit_id": dashboard["habits"][0]["id"], "date": dashboard["as_of"], "status": True}
+    status, _ = _request(
+        conn, recorder, "check-in", "POST", "/habit_records/bulk",
+        body=json.dumps({"records": [record]}),
+        headers={**auth, "Content-Type": "application/json"},
+    )
+    return status == 200
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=10, help="virtual users running the scenario in parallel")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    parser.add_argument("--users", type=int, default=1000, help="number of seeded users to cycle through")
+    args = parser.parse_args()
+
+    url = urlsplit(args.base_url)
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+    completed = [0] * args.concurrency
+
+    def virtual_user(index: int):
+        # 接続はキープアライブで使い回す
+        conn = HTTPConnection(url.hostname, url.port or 80, timeout=30)
+        iteration = 0
+        while time.perf_counter() < deadline:
+            email = seed_email((index + iteration * args.concurrency) % args.users)
+            try:
+                completed[index] += run_scenario(conn, recorder, email)
+            except (OSError, ValueError) as e:
+                print(f"Virtual user {index}: {e}")
+                conn.close()
+                # API が落ちている間に空回りしない
+                time.sleep(1)
+            iteration += 1
+        conn.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=virtual_user, args=(i,)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.concurrency} virtual users for {elapsed:.1f}s against {args.base_url}")
+    print(f"{'step':<10} {'ok':>7} {'errors':>7} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>8} {'queries':>8}")
+    for step in STEPS:
+        latencies = sorted(recorder.latencies[step])
+        if not latencies:
+            print(f"{step:<10} {0:>7} {recorder.errors[step]:>7}")
+            continue
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        queries = recorder.queries[step]
+        print(
+            f"{step:<10} {len(latencies):>7} {recorder.errors[step]:>7} "
+            f"{statistics.median(latencies) * 1000:>9.1f} {p99 * 1000:>9.1f} "
+            f"{len(latencies) / elapsed:>8.1f} {statistics.mean(queries) if queries else 0:>8.1f}"
+        )
+    print(f"{sum(completed)} completed scenarios, {sum(completed) / elapsed:.1f} scenarios/s")
+
+
+if __name__ == "__main__":
+    main()
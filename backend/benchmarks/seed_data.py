@@ -0,0 +1,175 @@
+"""
+ベンチマーク・負荷試験用のデータ（ユーザー N人 × 習慣 M件 × D日分の記録、目標、通知）を作成する。
+乱数のシードを固定しているので、同じ引数なら毎回同じデータになる。
+作成したユーザーのメールアドレスは seed-<番号>@seed.example.com、パスワードはすべて PASSWORD。
+記録は昨日までの D日分（今日のチェックインは負荷試験で行う）。通知の多くは 08:00 に集中させる。
+
+使い方（backend ディレクトリで実行。ローカルのデータベースで実行すること）:
+    python -m benchmarks.seed_data --users 1000 --habits 5 --days 365
+    python -m benchmarks.seed_data --cleanup
+
+crud のマイクロベンチマーク（tests/benchmarks）は、seed() で小さなデータを作成してから計測する。
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, time as time_type, timedelta, timezone
+
+from sqlalchemy import delete, insert, select
+
+import crud
+import models
+import scheduling
+from database import SessionLocal
+from password_hashing import hasher
+
+EMAIL_DOMAIN = "seed.example.com"
+PASSWORD = "seed-password"
+TIMEZONE = "Asia/Tokyo"
+# 通知の時刻の分布（08:00 のリマインダーの集中を再現する）
+NOTIFICATION_TIMES = [(time_type(8, 0), 0.6), (time_type(7, 30), 0.1), (time_type(12, 0), 0.1), (time_type(21, 0), 0.2)]
+INSERT_CHUNK_SIZE = 10000
+
+
+def seed_email(i: int) -> str:
+    return f"seed-{i}@{EMAIL_DOMAIN}"
+
+
+def seeded_users():
+    """作成したユーザーを絞り込む条件"""
+    return models.User.email.like(f"%@{EMAIL_DOMAIN}")
+
+
+def _insert_chunked(db, model, rows: list[dict]):
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        db.execute(insert(model), rows[i:i + INSERT_CHUNK_SIZE])
+
+
+def seed(db, users: int, habits: int, days: int, completion_rate: float, goals: int, random_seed: int = 0) -> dict:
+    """データを作成して、テーブルごとの件数を返す"""
+    rng = random.Random(random_seed)
+    now = datetime.now(timezone.utc)
+    today = scheduling.local_today(TIMEZONE, now)
+    password_hash = hasher.hash_sync(PASSWORD)
+
+    user_ids = db.scalars(
+        insert(models.User).returning(models.User.id, sort_by_parameter_order=True),
+        [
+            dict(
+                name=f"seed-{i}",
+                email=seed_email(i),
+                password_hash=password_hash,
+                created_at=now - timedelta(days=days),
+                fcm_token=f"seed-token-{i}",
+                is_verified=True,
+                timezone=TIMEZONE,
+            )
+            for i in range(users)
+        ],
+    ).all()
+    habit_rows = [
+        dict(user_id=user_id, name=f"habit-{j}", created_at=now - timedelta(days=days))
+        for user_id in user_ids
+        for j in range(habits)
+    ]
+    habit_ids = db.scalars(
+        insert(models.Habit).returning(models.Habit.id, sort_by_parameter_order=True), habit_rows
+    ).all()
+
+    # 習慣ごとに達成しやすさを変え、連続達成日数や達成率にばらつきを持たせる
+    # 件数が多くなるので、チャンクごとに作って投入する
+    records = []
+    record_count = 0
+    for habit_id in habit_ids:
+        rate = min(1.0, max(0.0, rng.gauss(completion_rate, 0.2)))
+        for offset in range(days, 0, -1):
+            records.append(dict(habit_id=habit_id, date=today - timedelta(days=offset), status=rng.random() < rate))
+        if len(records) >= INSERT_CHUNK_SIZE:
+            db.execute(insert(models.HabitRecord), records)
+            record_count += len(records)
+            records = []
+    if records:
+        db.execute(insert(models.HabitRecord), records)
+        record_count += len(records)
+
+    goal_rows = [
+        dict(
+            habit_id=habit_id,
+            target_count=rng.choice([10, 20, 30]),
+            start_date=today - timedelta(days=30 * (k + 1)),
+            end_date=today + timedelta(days=30),
+        )
+        for habit_id in habit_ids
+        for k in range(goals)
+    ]
+    _insert_chunked(db, models.Goal, goal_rows)
+
+    times, weights = zip(*NOTIFICATION_TIMES)
+    notification_rows = []
+    for row, habit_id in zip(habit_rows, habit_ids):
+        local_time = rng.choices(times, weights)[0]
+        notification_rows.append(dict(
+            user_id=row["user_id"],
+            habit_id=habit_id,
+            time=local_time,
+            enabled=True,
+            next_fire_at=scheduling.compute_next_fire_at(local_time, TIMEZONE, now),
+        ))
+    _insert_chunked(db, models.Notification, notification_rows)
+    db.commit()
+
+    # 直接投入したので、目標の達成数と連続達成日数のカウンタを記録から計算し直す
+    for i in range(0, len(habit_ids), 1000):
+        crud.rebuild_goal_counters(db, habit_ids=habit_ids[i:i + 1000])
+        crud.rebuild_habit_streaks(db, habit_ids=habit_ids[i:i + 1000])
+
+    return dict(
+        users=len(user_ids),
+        habits=len(habit_ids),
+        habit_records=record_count,
+        goals=len(goal_rows),
+        notifications=len(notification_rows),
+    )
+
+
+def cleanup(db):
+    """作成したデータを削除する（記録・目標・アウトボックスは外部キーの ON DELETE CASCADE で消える）"""
+    user_ids = select(models.User.id).where(seeded_users())
+    db.execute(delete(models.Notification).where(models.Notification.user_id.in_(user_ids)))
+    db.execute(delete(models.Habit).where(models.Habit.user_id.in_(user_ids)))
+    deleted = db.execute(delete(models.User).where(seeded_users())).rowcount
+    db.commit()
+    return deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--habits", type=int, default=5, help="habits per user")
+    parser.add_argument("--days", type=int, default=365, help="days of habit_records per habit")
+    parser.add_argument("--completion-rate", type=float, default=0.7, help="average fraction of completed days")
+    parser.add_argument("--goals", type=int, default=1, help="goals per habit")
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--cleanup", action="store_true", help="only delete previously seeded data")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        deleted = cleanup(db)
+        if deleted:
+            print(f"Deleted {deleted} previously seeded users.")
+        if args.cleanup:
+            return
+
+        start = time.perf_counter()
+        counts = seed(db, args.users, args.habits, args.days, args.completion_rate, args.goals, args.random_seed)
+        print(", ".join(f"{n} {table}" for table, n in counts.items()) + f" in {time.perf_counter() - start:.1f}s")
+        print(f"Log in as {seed_email(0)} .. {seed_email(args.users - 1)} with password {PASSWORD!r}.")
+    finally:
+        db.close()
+        hasher.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+# calendar_bitmap.py
+# 習慣の達成履歴を「1日1ビット」のビットマップとして扱うための関数。
+# ビット i は start_date から i 日目を表し、バイト列にするときは下位ビットから詰める（リトルエンディアン）。
+# 1年分でも46バイトで表せるため、記録をJSONオブジェクトの配列で返すよりペイロードが小さい。
+# 期間内の達成日数は popcount（int.bit_count）で求める。連続達成日数は habits のキャッシュ列と habit_stats で扱う。
+
+import base64
+from datetime import date
+from typing import Iterable
+
+
+def day_count(start_date: date, end_date: date) -> int:
+    """期間の日数（両端を含む）"""
+    return (end_date - start_date).days + 1
+
+def build_bitmap(completed_dates: Iterable[date], start_date: date, end_date: date) -> int:
+    """達成した日付の集合から、期間のビットマップ（Pythonの整数）を作る"""
+    bits = 0
+    for completed_date in completed_dates:
+        offset = (completed_date - start_date).days
+        if 0 <= offset <= (end_date - start_date).days:
+            bits |= 1 << offset
+    return bits
+
+def to_base64(bits: int, start_date: date, end_date: date) -> str:
+    """ビットマップをbase64文字列にする"""
+    n_bytes = (day_count(start_date, end_date) + 7) // 8
+    return base64.b64encode(bits.to_bytes(n_bytes, "little")).decode("ascii")
@@ -1,8 +1,10 @@
+from sqlalchemy import BigInteger, Boolean, Integer, Interval, Text, and_, case, cast, column, delete, distinct, func, insert, literal, literal_column, or_, select, true, update, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta, timezone, date, time as time_type
+from datetime import datetime, timedelta, timezone, date
 
 # security.pyの関数を正しく使うためにインポート
-import models, schemas, security
+import models, schemas, security, scheduling, metrics, auth_cache, log_setup
 
 # --- User CRUD ---
 def get_user(db: Session, user_id: int):
@@ -13,41 +15,89 @@ def get_user_by_email(db: Session, email: str):
     """メールアドレスで単一のユーザーを取得する"""
     return db.query(models.User).filter(models.User.email == email).first()
 
-def create_or_update_unverified_user(db: Session, user_data: schemas.UserCreate) -> models.User:
+def create_or_update_unverified_user(db: Session, user_data: schemas.UserCreate, password_hash: str | None = None) -> models.User:
     """
     ユーザーが存在しない場合は新規作成し、
     未認証で存在する場合には認証コードとパスワードを更新する。
+    password_hash を渡した場合は、ここではハッシュ化を行わずにその値を使う。
+    認証コードのメールは同じトランザクションで email_outbox に積む。
     """
     db_user = get_user_by_email(db, user_data.email)
-    
+    if password_hash is None:
+        password_hash = security.get_password_hash(user_data.password)
+
+    user_to_return = prepare_unverified_user(db_user, user_data, password_hash)
+    if user_to_return is not db_user:
+        db.add(user_to_return)
+    else:
+        # 以前に積んだ、古い認証コードのメールはもう送らない
+        db.execute(pending_emails_delete_stmt(db_user.id))
+    # 認証コードのメールはユーザーと同じトランザクションでアウトボックスに積み、email_sender が送信する
+    db.add(prepare_verification_email(user_to_return))
+
+    db.commit()
+    db.refresh(user_to_return)
+    auth_cache.principal_cache.invalidate_user(user_to_return.id)
+    return user_to_return
+
+def prepare_unverified_user(db_user: models.User | None, user_data: schemas.UserCreate, password_hash: str) -> models.User:
+    """
+    未認証ユーザーの作成・更新内容をモデルに反映する（同期・非同期のCRUDで共有する）。
+    新規作成の場合は、セッションに追加する前の新しいモデルを返す。
+    """
     verification_code = security.create_verification_code()
     expires_at = datetime.now(timezone.utc) + timedelta(minutes=15)
 
     if db_user and not db_user.is_verified:
         # ユーザーが「未認証」で存在する場合、コードとパスワードを更新
-        db_user.password_hash = security.get_password_hash(user_data.password)
+        db_user.password_hash = password_hash
         db_user.verification_code = verification_code
         db_user.verification_code_expires_at = expires_at
         db_user.name = user_data.name
-        user_to_return = db_user
-    else:
-        # ユーザーが存在しない場合、新規作成
-        hashed_password = security.get_password_hash(user_data.password)
-        new_user = models.User(
-            name=user_data.name,
-            email=user_data.email,
-            password_hash=hashed_password,
-            created_at=datetime.now(timezone.utc),
-            is_verified=False,
-            verification_code=verification_code,
-            verification_code_expires_at=expires_at
-        )
-        db.add(new_user)
-        user_to_return = new_user
+        return db_user
 
-    db.commit()
-    db.refresh(user_to_return)
-    return user_to_return
+    # ユーザーが存在しない場合、新規作成
+    return models.User(
+        name=user_data.name,
+        email=user_data.email,
+        password_hash=password_hash,
+        created_at=datetime.now(timezone.utc),
+        is_verified=False,
+        verification_code=verification_code,
+        verification_code_expires_at=expires_at
+    )
+
+VERIFICATION_EMAIL_SUBJECT = "Snoop 認証コード"
+
+def prepare_verification_email(user: models.User) -> models.EmailOutbox:
+    """
+    認証コードのメールを、アウトボックスに積む行として作る（同期・非同期のCRUDで共有する）。
+    ユーザーと同じセッションに追加すると、新規作成のユーザーでも同じトランザクションで INSERT される。
+    """
+    return models.EmailOutbox(
+        user=user,
+        to_address=user.email,
+        subject=VERIFICATION_EMAIL_SUBJECT,
+        body=f"あなたの認証コードは: {user.verification_code} です。",
+        next_attempt_at=datetime.now(timezone.utc),
+        correlation_id=log_setup.get_correlation_id(),
+    )
+
+def pending_emails_delete_stmt(user_id: int):
+    """
+    ユーザーの送信待ちのメールのうち、送信側が確保していない行を削除するDELETE文（同期・非同期のCRUDで共有する）。
+    確保中の行（attempts > 0 で next_attempt_at が未来）は送信側が結果を記録するので消さない。
+    確保中と再送の待ちは区別できないため、再送を待っている行も残る。
+    """
+    return (
+        delete(models.EmailOutbox)
+        .where(
+            models.EmailOutbox.user_id == user_id,
+            models.EmailOutbox.status == OUTBOX_STATUS_PENDING,
+            or_(models.EmailOutbox.attempts == 0, models.EmailOutbox.next_attempt_at <= func.now()),
+        )
+        .execution_options(synchronize_session=False)
+    )
 
 def verify_user_code(db: Session, email: str, code: str) -> models.User | None:
     """ユーザーの認証コードを検証する"""
@@ -61,9 +111,21 @@ def verify_user_code(db: Session, email: str, code: str) -> models.User | None:
         user.verification_code_expires_at = None
         db.commit()
         db.refresh(user)
+        auth_cache.principal_cache.invalidate_user(user.id)
         return user
     return None
 
+def update_user_password_hash(db: Session, user_id: int, password_hash: str):
+    """パスワードのハッシュを差し替える（ハッシュのコストを変更したときの再ハッシュに使う）"""
+    db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(password_hash=password_hash)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    auth_cache.principal_cache.invalidate_user(user_id)
+
 def update_user_fcm_token(db: Session, user_id: int, fcm_token: str):
     """ユーザーのFCMトークンを更新または設定する"""
     db_user = get_user(db, user_id=user_id)
@@ -71,21 +133,64 @@ def update_user_fcm_token(db: Session, user_id: int, fcm_token: str):
         db_user.fcm_token = fcm_token
         db.commit()
         db.refresh(db_user)
+        auth_cache.principal_cache.invalidate_user(user_id)
     return db_user
 
+def update_user_timezone(db: Session, user_id: int, tz_name: str):
+    """ユーザーのタイムゾーンを更新し、そのユーザーの有効な通知の次回送信時刻を再計算する"""
+    db_user = get_user(db, user_id=user_id)
+    if db_user:
+        db_user.timezone = tz_name
+        now = datetime.now(timezone.utc)
+        db.execute(
+            update(models.Notification)
+            .where(
+                models.Notification.user_id == user_id,
+                models.Notification.enabled == True,
+            )
+            .values(next_fire_at=scheduling.next_fire_at_expr(models.Notification.time, tz_name, now))
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        db.refresh(db_user)
+        auth_cache.principal_cache.invalidate_user(user_id)
+    return db_user
+
+def clear_fcm_tokens(db: Session, fcm_tokens) -> int:
+    """無効になったFCMトークンをまとめて削除し、更新したユーザー数を返す"""
+    fcm_tokens = list(fcm_tokens)
+    if not fcm_tokens:
+        return 0
+    user_ids = db.scalars(
+        update(models.User)
+        .where(models.User.fcm_token.in_(fcm_tokens))
+        .values(fcm_token=None)
+        .returning(models.User.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    for user_id in user_ids:
+        auth_cache.principal_cache.invalidate_user(user_id)
+    return len(user_ids)
+
 # --- Habit CRUD ---
+# 習慣と通知の操作は、id と user_id の両方で絞り込んだ1つの文で行う。
+# 所有者以外の行は対象にならないため、事前の SELECT による所有権の確認は不要で、
+# 対象がなければ None を返す。結果は RETURNING で受け取り、db.refresh は行わない。
 def create_habit(db: Session, habit_data: schemas.HabitCreate, user_id: int):
     """新しい習慣を作成する"""
-    db_habit = models.Habit(
-        user_id=user_id,
-        name=habit_data.name,
-        description=habit_data.description,
-        created_at=datetime.now(timezone.utc)
-    )
-    db.add(db_habit)
+    row = db.execute(
+        insert(models.Habit)
+        .values(
+            user_id=user_id,
+            name=habit_data.name,
+            description=habit_data.description,
+            created_at=datetime.now(timezone.utc)
+        )
+        .returning(*models.Habit.__table__.c)
+    ).one()
     db.commit()
-    db.refresh(db_habit)
-    return db_habit
+    return row
     
 def get_habits_by_user(db: Session, user_id: int):
     """ユーザーIDに基づいて、そのユーザーのすべての習慣を取得する"""
@@ -94,24 +199,39 @@ def get_habits_by_user(db: Session, user_id: int):
 def get_habit(db: Session, habit_id: int):
     return db.query(models.Habit).filter(models.Habit.id == habit_id).first()
 
-def update_habit(db: Session, habit_id: int, habit_data: schemas.HabitUpdate):
+def get_habit_for_user(db: Session, habit_id: int, user_id: int):
+    """指定したユーザーが所有する習慣を取得する（他のユーザーの習慣であれば None）"""
+    return db.query(models.Habit).filter(
+        models.Habit.id == habit_id,
+        models.Habit.user_id == user_id
+    ).first()
+
+def update_habit(db: Session, habit_id: int, user_id: int, habit_data: schemas.HabitUpdate):
     """習慣を更新する"""
-    db_habit = get_habit(db, habit_id=habit_id)
-    if db_habit:
-        update_data = habit_data.dict(exclude_unset=True)
-        for key, value in update_data.items():
-            setattr(db_habit, key, value)
-        db.commit()
-        db.refresh(db_habit)
-    return db_habit
-
-def delete_habit(db: Session, habit_id: int):
-    """習慣を削除する"""
-    db_habit = get_habit(db, habit_id=habit_id)
-    if db_habit:
-        db.delete(db_habit)
-        db.commit()
-    return db_habit
+    update_data = habit_data.dict(exclude_unset=True)
+    if not update_data:
+        return get_habit_for_user(db, habit_id=habit_id, user_id=user_id)
+
+    row = db.execute(
+        update(models.Habit)
+        .where(models.Habit.id == habit_id, models.Habit.user_id == user_id)
+        .values(**update_data)
+        .returning(*models.Habit.__table__.c)
+        .execution_options(synchronize_session=False)
+    ).one_or_none()
+    db.commit()
+    return row
+
+def delete_habit(db: Session, habit_id: int, user_id: int):
+    """習慣を削除する（記録・目標・通知は外部キーの ON DELETE CASCADE で削除される）"""
+    deleted_id = db.scalar(
+        delete(models.Habit)
+        .where(models.Habit.id == habit_id, models.Habit.user_id == user_id)
+        .returning(models.Habit.id)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return deleted_id
 
 # --- HabitRecord CRUD ---
 def create_habit_record(db: Session, record: schemas.HabitRecordCreate):
@@ -121,70 +241,776 @@ def create_habit_record(db: Session, record: schemas.HabitRecordCreate):
         status=record.status
     )
     db.add(db_record)
+    db.flush()
+    # 記録の追加と目標の達成数・連続達成日数の更新を同じトランザクションで行う
+    if db_record.status:
+        db.execute(habit_lock_stmt([db_record.habit_id]))
+        _adjust_goal_counters(db, habit_id=db_record.habit_id, record_date=db_record.date, delta=1)
+        _record_habit_completion(db, habit_id=db_record.habit_id, record_date=db_record.date)
+    db.commit()
+    db.refresh(db_record)
+    return db_record
+
+def get_habit_record_for_user(db: Session, record_id: int, user_id: int):
+    """IDで記録を取得する（指定したユーザーの習慣の記録でなければ None）"""
+    return db.query(models.HabitRecord).join(models.Habit).filter(
+        models.HabitRecord.id == record_id,
+        models.Habit.user_id == user_id
+    ).first()
+
+def update_habit_record(db: Session, db_record: models.HabitRecord, record_update: schemas.HabitRecordUpdate):
+    """記録の日付・状態を更新し、影響を受ける目標の達成数を増減させる"""
+    old_date, old_status = db_record.date, db_record.status
+    update_data = record_update.dict(exclude_unset=True)
+    for key, value in update_data.items():
+        setattr(db_record, key, value)
+    db.flush()
+
+    if (old_date, old_status) != (db_record.date, db_record.status):
+        if old_status or db_record.status:
+            db.execute(habit_lock_stmt([db_record.habit_id]))
+        if old_status:
+            _adjust_goal_counters(db, habit_id=db_record.habit_id, record_date=old_date, delta=-1)
+        if db_record.status:
+            _adjust_goal_counters(db, habit_id=db_record.habit_id, record_date=db_record.date, delta=1)
+        # 過去の記録の変更は連続記録を途中で分けたりつないだりするため、習慣単位で再計算する
+        if old_status or db_record.status:
+            _rebuild_habit_streaks(db, habit_ids=[db_record.habit_id])
+            metrics.HABIT_STREAK_UPDATES.labels("recompute").inc()
     db.commit()
     db.refresh(db_record)
     return db_record
 
+# 一括登録で1つの INSERT 文にまとめる行数
+BULK_UPSERT_CHUNK_SIZE = 1000
+
+def bulk_upsert_habit_records(db: Session, records: list[schemas.HabitRecordCreate], user_id: int) -> list[schemas.HabitRecordBulkItemResult]:
+    """
+    複数の習慣の記録を INSERT ... ON CONFLICT (habit_id, date) DO UPDATE でまとめて作成・更新し、
+    入力と同じ順序で1件ごとの結果を返す。
+    所有権の確認は1回のクエリで行い、ユーザーの習慣でない記録は "not_found" として書き込まない。
+    """
+    habit_ids = {record.habit_id for record in records}
+    owned_habit_ids = set(db.scalars(
+        select(models.Habit.id).where(models.Habit.user_id == user_id, models.Habit.id.in_(habit_ids))
+    ))
+
+    # 同じ (habit_id, date) が複数含まれる場合は後のものを採用する
+    # （1つの ON CONFLICT DO UPDATE 文で同じ行を2回更新することはできない）
+    latest_status = {}
+    for record in records:
+        if record.habit_id in owned_habit_ids:
+            latest_status[(record.habit_id, record.date)] = record.status
+
+    table = models.HabitRecord.__table__
+    written = {}
+    items = list(latest_status.items())
+    for i in range(0, len(items), BULK_UPSERT_CHUNK_SIZE):
+        stmt = pg_insert(table).values([
+            {"habit_id": habit_id, "date": record_date, "status": status}
+            for (habit_id, record_date), status in items[i:i + BULK_UPSERT_CHUNK_SIZE]
+        ])
+        stmt = stmt.on_conflict_do_update(
+            constraint="_habit_date_uc",
+            set_={"status": stmt.excluded.status},
+        ).returning(
+            table.c.id,
+            table.c.habit_id,
+            table.c.date,
+            # xmax が 0 の行は新しく挿入された行
+            literal_column("xmax = 0", Boolean).label("inserted"),
+        )
+        for row in db.execute(stmt):
+            written[(row.habit_id, row.date)] = row
+
+    if written:
+        # 記録が変わった習慣の目標の達成数を、習慣単位でまとめて再計算する
+        changed_habit_ids = {habit_id for habit_id, _ in written}
+        db.execute(habit_lock_stmt(changed_habit_ids))
+        _rebuild_goal_counters(db, habit_ids=changed_habit_ids)
+        _rebuild_habit_streaks(db, habit_ids=changed_habit_ids)
+        metrics.HABIT_STREAK_UPDATES.labels("recompute").inc(len(changed_habit_ids))
+    db.commit()
+
+    results = []
+    for index, record in enumerate(records):
+        row = written.get((record.habit_id, record.date)) if record.habit_id in owned_habit_ids else None
+        if row is None:
+            outcome = "not_found"
+        else:
+            outcome = "created" if row.inserted else "updated"
+        results.append(schemas.HabitRecordBulkItemResult(
+            index=index,
+            habit_id=record.habit_id,
+            date=record.date,
+            outcome=outcome,
+            record_id=row.id if row is not None else None,
+        ))
+    return results
+
 def get_habit_records_by_date_range(db: Session, habit_id: int, start_date: date, end_date: date):
     return db.query(models.HabitRecord).filter(
         models.HabitRecord.habit_id == habit_id,
         models.HabitRecord.date.between(start_date, end_date)
     ).order_by(models.HabitRecord.date).all()
     
+def get_completed_dates(db: Session, habit_id: int, start_date: date, end_date: date) -> list[date]:
+    """期間内に達成した日付だけを取得する（記録の行全体は読み込まない）"""
+    return db.scalars(
+        select(models.HabitRecord.date).where(
+            models.HabitRecord.habit_id == habit_id,
+            models.HabitRecord.status == True,
+            models.HabitRecord.date.between(start_date, end_date),
+        )
+    ).all()
+
+def get_completed_dates_by_habit(db: Session, user_id: int, start_date: date, end_date: date, habit_ids: list[int] | None = None) -> dict[int, list[date]]:
+    """
+    ユーザーのすべての習慣（habit_ids を指定した場合はそのうちの指定した習慣）について、
+    期間内に達成した日付を1回のクエリで取得し、習慣IDごとにまとめて返す。
+    記録のない習慣も空のリストとして含める。
+    """
+    stmt = (
+        select(models.Habit.id, models.HabitRecord.date)
+        .outerjoin(
+            models.HabitRecord,
+            and_(
+                models.HabitRecord.habit_id == models.Habit.id,
+                models.HabitRecord.status == True,
+                models.HabitRecord.date.between(start_date, end_date),
+            ),
+        )
+        .where(models.Habit.user_id == user_id)
+        .order_by(models.Habit.id, models.HabitRecord.date)
+    )
+    if habit_ids is not None:
+        stmt = stmt.where(models.Habit.id.in_(habit_ids))
+
+    dates_by_habit: dict[int, list[date]] = {}
+    for habit_id, record_date in db.execute(stmt):
+        dates = dates_by_habit.setdefault(habit_id, [])
+        if record_date is not None:
+            dates.append(record_date)
+    return dates_by_habit
+
+def get_completion_history(db: Session, user_id: int | None = None, habit_ids: list[int] | None = None):
+    """
+    統計の計算用に、習慣ごとの作成日時・ユーザーのタイムゾーンと達成したすべての日付を1回のクエリで取得する。
+    （習慣ID, 作成日時, タイムゾーン, 日付）の行を習慣ID・日付の順に返し、記録のない習慣は日付が None の行になる。
+    user_id も habit_ids も指定しない場合はすべての習慣が対象（バッチ処理用）。
+    """
+    stmt = (
+        select(models.Habit.id, models.Habit.created_at, models.User.timezone, models.HabitRecord.date)
+        .join(models.User, models.User.id == models.Habit.user_id)
+        .outerjoin(
+            models.HabitRecord,
+            and_(models.HabitRecord.habit_id == models.Habit.id, models.HabitRecord.status == True),
+        )
+        .order_by(models.Habit.id, models.HabitRecord.date)
+    )
+    if user_id is not None:
+        stmt = stmt.where(models.Habit.user_id == user_id)
+    if habit_ids is not None:
+        stmt = stmt.where(models.Habit.id.in_(habit_ids))
+    return db.execute(stmt).all()
+
+# --- Habit streaks ---
+def _record_habit_completion(db: Session, habit_id: int, record_date: date):
+    """
+    達成した記録の追加を習慣の連続達成日数に反映する。
+    最後に達成した日より後の日付であれば1文のUPDATEで済ませ、
+    それ以前の日付（過去の記録の後からの追加）であれば習慣単位で再計算する（その習慣の全履歴を走査する）。
+    """
+    result = db.execute(streak_append_stmt(habit_id, record_date))
+    if result.rowcount:
+        metrics.HABIT_STREAK_UPDATES.labels("incremental").inc()
+    else:
+        _rebuild_habit_streaks(db, habit_ids=[habit_id])
+        metrics.HABIT_STREAK_UPDATES.labels("recompute").inc()
+
+def streak_append_stmt(habit_id: int, record_date: date):
+    """
+    last_completed_date より後の日付の達成を連続達成日数に加えるUPDATE文（同期・非同期のCRUDで共有する）。
+    前日に達成していれば連続日数を1増やし、間が空いていれば1からやり直す。
+    過去の日付の場合は1行も更新しないので、呼び出し側で再計算に切り替える。
+    """
+    new_streak = case(
+        (models.Habit.last_completed_date == record_date - timedelta(days=1), models.Habit.current_streak + 1),
+        else_=1,
+    )
+    return (
+        update(models.Habit)
+        .where(
+            models.Habit.id == habit_id,
+            (models.Habit.last_completed_date == None) | (models.Habit.last_completed_date < record_date),
+        )
+        .values(
+            current_streak=new_streak,
+            longest_streak=func.greatest(models.Habit.longest_streak, new_streak),
+            last_completed_date=record_date,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+def habit_streak_rebuild_stmts(habit_ids=None):
+    """
+    習慣の連続達成日数を habit_records から求め直すUPDATE文を2つ返す（同期・非同期のCRUDで共有する）。
+    1つ目で対象の習慣を0に戻し、2つ目で達成した記録のある習慣に値を設定する。
+    連続する日付は「日付 - 行番号」が同じ値になることを使い（gaps and islands）、
+    習慣ごとの最長の連続日数と、最後に達成した日で終わる連続日数を1回の集計で求める。
+    期間は限定せず、対象の習慣の達成した記録をすべて走査する。過去の記録の変更は履歴のどこにある連続記録
+    （longest_streak）も分け得るため、変更した日付以降だけでは求められない。コストは習慣1つ分の記録数に比例する。
+    """
+    position = func.row_number().over(partition_by=models.HabitRecord.habit_id, order_by=models.HabitRecord.date)
+    completed = select(
+        models.HabitRecord.habit_id,
+        models.HabitRecord.date,
+        (models.HabitRecord.date - cast(position, Integer)).label("run_key"),
+    ).where(models.HabitRecord.status == True)
+    if habit_ids is not None:
+        completed = completed.where(models.HabitRecord.habit_id.in_(list(habit_ids)))
+    completed = completed.subquery()
+
+    runs = (
+        select(
+            completed.c.habit_id,
+            func.count().label("length"),
+            func.max(completed.c.date).label("run_end"),
+        )
+        .group_by(completed.c.habit_id, completed.c.run_key)
+        .subquery()
+    )
+    ranked = select(
+        runs.c.habit_id,
+        runs.c.length,
+        runs.c.run_end,
+        func.max(runs.c.length).over(partition_by=runs.c.habit_id).label("longest"),
+        func.row_number().over(partition_by=runs.c.habit_id, order_by=runs.c.run_end.desc()).label("rank"),
+    ).subquery()
+
+    reset = update(models.Habit).values(current_streak=0, longest_streak=0, last_completed_date=None)
+    if habit_ids is not None:
+        reset = reset.where(models.Habit.id.in_(list(habit_ids)))
+    rebuild = (
+        update(models.Habit)
+        .where(models.Habit.id == ranked.c.habit_id, ranked.c.rank == 1)
+        .values(
+            current_streak=ranked.c.length,
+            longest_streak=ranked.c.longest,
+            last_completed_date=ranked.c.run_end,
+        )
+    )
+    return (
+        reset.execution_options(synchronize_session=False),
+        rebuild.execution_options(synchronize_session=False),
+    )
+
+def rebuild_habit_streaks(db: Session, habit_ids: list[int] | None = None) -> int:
+    """
+    習慣の連続達成日数を habit_records から再計算して保存し、達成した記録のある習慣の数を返す。
+    habit_ids を指定した場合は、その習慣だけを再計算する。
+    """
+    updated = _rebuild_habit_streaks(db, habit_ids=habit_ids)
+    db.commit()
+    return updated
+
+def _rebuild_habit_streaks(db: Session, habit_ids=None) -> int:
+    """rebuild_habit_streaks の本体（コミットは呼び出し側で行う）"""
+    reset, rebuild = habit_streak_rebuild_stmts(habit_ids)
+    db.execute(reset)
+    return db.execute(rebuild).rowcount
+    
 # --- Goal CRUD ---
 def create_goal_for_habit(db: Session, goal: schemas.GoalCreate, habit_id: int):
+    # 作成時点の達成数は、期間内の記録から1回だけ数える（以降は記録の変更時に増減させる）。
+    # 数える前に習慣の行をロックし、同時に書き込まれた記録を目標と記録のどちらの側でも数え漏らさないようにする
+    db.execute(habit_lock_stmt([habit_id]))
+    current_count = db.scalar(completed_days_count_stmt(habit_id, goal.start_date, goal.end_date))
     db_goal = models.Goal(
         habit_id=habit_id,
         target_count=goal.target_count,
         start_date=goal.start_date,
-        end_date=goal.end_date
+        end_date=goal.end_date,
+        current_count=current_count,
+        is_achieved=current_count >= goal.target_count
     )
     db.add(db_goal)
     db.commit()
     db.refresh(db_goal)
     return db_goal
 
-# --- Notification CRUD ---
-def create_notification(db: Session, notification: schemas.NotificationCreate, user_id: int):
-    db_notification = models.Notification(
-        user_id=user_id,
-        habit_id=notification.habit_id,
-        time=notification.time,
-        enabled=notification.enabled
+def get_goals_for_habit(db: Session, habit_id: int):
+    """習慣のすべての目標を取得する（達成数は goals テーブルに保持されている）"""
+    return db.query(models.Goal).filter(models.Goal.habit_id == habit_id).order_by(models.Goal.id).all()
+
+def habit_lock_stmt(habit_ids):
+    """
+    習慣の行をロックするSELECT文（同期・非同期のCRUDで共有する）。目標の作成（達成数を数えて INSERT）と、
+    記録の書き込み（目標の達成数の増減・再計算）は、この文で同じ習慣ごとに直列にする。
+    そうしないと、目標が数えた後・コミットする前にコミットされた記録は、目標の作成側にも記録の側にも数えられない。
+    記録・目標の INSERT が外部キーのために取る FOR KEY SHARE とは競合しない FOR NO KEY UPDATE を使い、
+    複数の習慣は ID の順にロックする（デッドロックを避ける）。
+    """
+    return (
+        select(models.Habit.id)
+        .where(models.Habit.id.in_(habit_ids))
+        .order_by(models.Habit.id)
+        .with_for_update(key_share=True)
+    )
+
+def _adjust_goal_counters(db: Session, habit_id: int, record_date: date, delta: int) -> int:
+    """
+    record_date を期間に含む目標の達成数を delta だけ増減させ、更新した目標の数を返す。
+    1件の記録の変更で更新される目標の数（書き込みの増幅）はメトリクスとして記録する。
+    """
+    result = db.execute(goal_counter_update_stmt(habit_id, record_date, delta))
+    metrics.GOAL_COUNTER_FANOUT.observe(result.rowcount)
+    return result.rowcount
+
+def completed_days_count_stmt(habit_id: int, start_date: date, end_date: date):
+    """期間内に達成した日数を数えるSELECT文（同期・非同期のCRUDで共有する）"""
+    return select(func.count(distinct(models.HabitRecord.date))).where(
+        models.HabitRecord.habit_id == habit_id,
+        models.HabitRecord.status == True,
+        models.HabitRecord.date.between(start_date, end_date),
+    )
+
+def goal_counter_update_stmt(habit_id: int, record_date: date, delta: int):
+    """record_date を期間に含む目標の達成数を delta だけ増減させるUPDATE文（同期・非同期のCRUDで共有する）"""
+    new_count = models.Goal.current_count + delta
+    return (
+        update(models.Goal)
+        .where(
+            models.Goal.habit_id == habit_id,
+            models.Goal.start_date <= record_date,
+            models.Goal.end_date >= record_date,
+        )
+        .values(current_count=new_count, is_achieved=new_count >= models.Goal.target_count)
+        .execution_options(synchronize_session=False)
     )
-    db.add(db_notification)
+
+def rebuild_goal_counters(db: Session, habit_ids: list[int] | None = None) -> int:
+    """
+    目標の達成数を habit_records から再計算して保存し、更新した目標の数を返す。
+    habit_ids を指定した場合は、その習慣の目標だけを再計算する。
+    """
+    updated = _rebuild_goal_counters(db, habit_ids=habit_ids)
+    db.commit()
+    return updated
+
+def _rebuild_goal_counters(db: Session, habit_ids=None) -> int:
+    """rebuild_goal_counters の本体（コミットは呼び出し側で行う）"""
+    current_count = func.count(distinct(models.HabitRecord.date)).filter(models.HabitRecord.status == True)
+    progress = (
+        select(
+            models.Goal.id.label("goal_id"),
+            current_count.label("current_count"),
+            (current_count >= models.Goal.target_count).label("is_achieved"),
+        )
+        .outerjoin(
+            models.HabitRecord,
+            and_(
+                models.HabitRecord.habit_id == models.Goal.habit_id,
+                models.HabitRecord.date.between(models.Goal.start_date, models.Goal.end_date),
+            ),
+        )
+        .group_by(models.Goal.id)
+    )
+    if habit_ids is not None:
+        progress = progress.where(models.Goal.habit_id.in_(list(habit_ids)))
+    progress = progress.subquery()
+
+    result = db.execute(
+        update(models.Goal)
+        .where(models.Goal.id == progress.c.goal_id)
+        .values(current_count=progress.c.current_count, is_achieved=progress.c.is_achieved)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+# --- Notification CRUD ---
+def create_notification(db: Session, notification: schemas.NotificationCreate, user_id: int, tz_name: str):
+    """
+    新しい通知設定を作成する。
+    INSERT ... SELECT で習慣の所有権の確認と作成を1文で行い、ユーザーの習慣でなければ None を返す。
+    """
+    next_fire_at = scheduling.compute_next_fire_at(notification.time, tz_name) if notification.enabled else None
+    owned_habit = select(
+        literal(user_id),
+        models.Habit.id,
+        literal(notification.time, models.Notification.time.type),
+        literal(notification.enabled, models.Notification.enabled.type),
+        literal(next_fire_at, models.Notification.next_fire_at.type),
+    ).where(models.Habit.id == notification.habit_id, models.Habit.user_id == user_id)
+
+    row = db.execute(
+        insert(models.Notification)
+        .from_select(["user_id", "habit_id", "time", "enabled", "next_fire_at"], owned_habit)
+        .returning(*models.Notification.__table__.c)
+    ).one_or_none()
     db.commit()
-    db.refresh(db_notification)
-    return db_notification
+    return row
 
-def get_notifications_for_habit(db: Session, habit_id: int):
-    return db.query(models.Notification).filter(models.Notification.habit_id == habit_id).all()
+def get_notifications_for_habit(db: Session, habit_id: int, user_id: int):
+    return db.query(models.Notification).filter(
+        models.Notification.habit_id == habit_id,
+        models.Notification.user_id == user_id
+    ).all()
 
 def get_notification(db: Session, notification_id: int):
     return db.query(models.Notification).filter(models.Notification.id == notification_id).first()
 
-def update_notification(db: Session, notification_id: int, notification_update: schemas.NotificationUpdate):
-    db_notification = get_notification(db, notification_id)
-    if db_notification:
-        update_data = notification_update.dict(exclude_unset=True)
-        for key, value in update_data.items():
-            setattr(db_notification, key, value)
-        db.commit()
-        db.refresh(db_notification)
-    return db_notification
+def update_notification(db: Session, notification_id: int, user_id: int, notification_update: schemas.NotificationUpdate, tz_name: str):
+    """
+    通知設定を更新する。
+    時刻や有効/無効が変わる可能性があるので、次回の送信時刻も同じ UPDATE 文の中で計算し直す。
+    """
+    update_data = notification_update.dict(exclude_unset=True)
+    now = datetime.now(timezone.utc)
 
-def delete_notification(db: Session, notification_id: int):
-    db_notification = get_notification(db, notification_id)
-    if db_notification:
-        db.delete(db_notification)
-        db.commit()
-    return db_notification
+    new_time = literal(update_data["time"], models.Notification.time.type) if "time" in update_data else models.Notification.time
+    next_fire_at = scheduling.next_fire_at_expr(new_time, tz_name, now)
+    if "enabled" in update_data:
+        update_data["next_fire_at"] = next_fire_at if update_data["enabled"] else None
+    else:
+        update_data["next_fire_at"] = case((models.Notification.enabled == True, next_fire_at), else_=None)
 
-def get_notifications_by_time(db: Session, time_str: str):
-    hour, minute = map(int, time_str.split(':'))
-    target_time = time_type(hour, minute)
-    
-    return db.query(models.Notification).filter(
-        models.Notification.time == target_time,
-        models.Notification.enabled == True
+    row = db.execute(
+        update(models.Notification)
+        .where(models.Notification.id == notification_id, models.Notification.user_id == user_id)
+        .values(**update_data)
+        .returning(*models.Notification.__table__.c)
+        .execution_options(synchronize_session=False)
+    ).one_or_none()
+    db.commit()
+    return row
+
+def delete_notification(db: Session, notification_id: int, user_id: int):
+    deleted_id = db.scalar(
+        delete(models.Notification)
+        .where(models.Notification.id == notification_id, models.Notification.user_id == user_id)
+        .returning(models.Notification.id)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return deleted_id
+
+# 通知ティックで1度に確保する通知の件数
+REMINDER_CHUNK_SIZE = 1000
+
+def enqueue_due_reminders(
+    db: Session, now: datetime, chunk_size: int = REMINDER_CHUNK_SIZE, correlation_id: str | None = None
+) -> tuple[int, int]:
+    """
+    next_fire_at <= now の通知を最大 chunk_size 件確保して次回の送信時刻（ユーザーのタイムゾーンで翌日の同時刻）へ進め、
+    FCMトークンを持つユーザーの分を notification_outbox に積む。
+    確保・更新・追加は1つの文（UPDATE ... RETURNING を INSERT ... SELECT で受ける）で行い、
+    SKIP LOCKED により同時に実行された他のティックと同じ通知を取り合わない。
+    積んだ行には、ティックの相関ID（correlation_id）を記録する。
+    (確保した通知の数, 積んだ数) を返す。確保した数が 0 になるまで繰り返し呼び出す。
+    """
+    due = (
+        select(models.Notification.id, models.Notification.next_fire_at)
+        .where(
+            models.Notification.next_fire_at <= now,
+            models.Notification.enabled == True,
+        )
+        .order_by(models.Notification.next_fire_at)
+        .limit(chunk_size)
+        .with_for_update(skip_locked=True)
+        .subquery("due")
+    )
+    claimed = (
+        update(models.Notification)
+        .where(models.Notification.id == due.c.id, models.User.id == models.Notification.user_id)
+        .values(next_fire_at=scheduling.next_fire_at_expr(models.Notification.time, models.User.timezone, now))
+        .returning(
+            models.Notification.id.label("notification_id"),
+            models.Notification.user_id,
+            due.c.next_fire_at.label("scheduled_for"),
+            models.User.fcm_token,
+        )
+        .cte("claimed")
+    )
+    enqueued = (
+        pg_insert(models.NotificationOutbox)
+        .from_select(
+            ["notification_id", "user_id", "scheduled_for", "next_attempt_at", "correlation_id"],
+            select(
+                claimed.c.notification_id,
+                claimed.c.user_id,
+                claimed.c.scheduled_for,
+                literal(now, models.NotificationOutbox.next_attempt_at.type),
+                literal(correlation_id, models.NotificationOutbox.correlation_id.type),
+            ).where(claimed.c.fcm_token != None),
+        )
+        .on_conflict_do_nothing(constraint="_outbox_notification_scheduled_uc")
+        .returning(models.NotificationOutbox.id)
+        .cte("enqueued")
+    )
+    counts = db.execute(select(
+        select(func.count()).select_from(claimed).scalar_subquery(),
+        select(func.count()).select_from(enqueued).scalar_subquery(),
+    )).one()
+    db.commit()
+    return counts[0], counts[1]
+
+# --- Scheduler state ---
+def get_scheduler_high_water_mark(db: Session, name: str) -> datetime | None:
+    """ジョブの最後に完了したティックの基準時刻を返す（一度も完了していなければ None）"""
+    return db.scalar(select(models.SchedulerState.high_water_mark).where(models.SchedulerState.name == name))
+
+def advance_scheduler_high_water_mark(db: Session, name: str, high_water_mark: datetime, duration_seconds: float):
+    """ティックの完了を記録する。複数のプロセスから呼ばれても基準時刻が戻らないよう、大きい方を残す"""
+    stmt = pg_insert(models.SchedulerState).values(
+        name=name, high_water_mark=high_water_mark, last_duration_seconds=duration_seconds
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[models.SchedulerState.name],
+        set_={
+            "high_water_mark": func.greatest(models.SchedulerState.high_water_mark, stmt.excluded.high_water_mark),
+            "last_duration_seconds": stmt.excluded.last_duration_seconds,
+            "updated_at": func.now(),
+        },
+    ))
+    db.commit()
+
+# --- Notification outbox ---
+OUTBOX_STATUS_PENDING = "pending"
+OUTBOX_STATUS_DEAD = "dead"
+
+def claim_outbox_batch(
+    db: Session,
+    now: datetime,
+    batch_size: int,
+    lease_seconds: float,
+    max_attempts: int,
+    partition: int | None = None,
+    partitions: int = 1,
+):
+    """
+    送信時刻を過ぎた送信待ちの行を最大 batch_size 件確保し、送信に必要な列を返す。
+    確保した行は attempts を1増やし、next_attempt_at を now + lease_seconds（リース）に進める。
+    ディスパッチャーが結果を記録しないまま落ちた場合は、リースが切れた後に他のディスパッチャーが再び確保する。
+    SKIP LOCKED により、複数のディスパッチャー（スレッド・プロセス・ホスト）が同じ行を取り合わない。
+    partition を指定した場合は、user_id % partitions == partition の行だけを対象にする。
+    """
+    in_partition = (
+        models.NotificationOutbox.user_id % partitions == partition
+        if partition is not None and partitions > 1
+        else true()
+    )
+    _dead_letter_expired_leases(db, models.NotificationOutbox, now, max_attempts, in_partition)
+
+    ready_ids = (
+        select(models.NotificationOutbox.id)
+        .where(
+            models.NotificationOutbox.status == OUTBOX_STATUS_PENDING,
+            models.NotificationOutbox.next_attempt_at <= now,
+            in_partition,
+        )
+        .order_by(models.NotificationOutbox.next_attempt_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    rows = db.execute(
+        update(models.NotificationOutbox)
+        .where(
+            models.NotificationOutbox.id.in_(ready_ids),
+            models.Notification.id == models.NotificationOutbox.notification_id,
+            models.User.id == models.NotificationOutbox.user_id,
+            models.Habit.id == models.Notification.habit_id,
+        )
+        .values(
+            attempts=models.NotificationOutbox.attempts + 1,
+            next_attempt_at=now + timedelta(seconds=lease_seconds),
+        )
+        .returning(
+            models.NotificationOutbox.id.label("outbox_id"),
+            models.NotificationOutbox.scheduled_for,
+            models.NotificationOutbox.correlation_id,
+            models.User.id.label("user_id"),
+            models.User.fcm_token,
+            models.Habit.name.label("habit_name"),
+        )
+        .execution_options(synchronize_session=False)
     ).all()
+    db.commit()
+    return rows
+
+def finish_outbox_batch(
+    db: Session,
+    sent_ids: list[int],
+    failures: list[tuple[int, str, bool]],
+    now: datetime,
+    max_attempts: int,
+    backoff_base_seconds: float,
+    backoff_max_seconds: float,
+) -> int:
+    """
+    確保した行の送信結果を記録し、dead にした行の数を返す。
+    送信に成功した行（sent_ids）は削除する。failures は (outbox_id, エラー, 再送しても成功しないか) の組で、
+    再送できる行は指数バックオフ（base * 2^(attempts-1)、上限 backoff_max_seconds、0.5〜1倍のジッター）の後に再送する。
+    """
+    return _finish_outbox_rows(
+        db, models.NotificationOutbox, sent_ids, failures, now, max_attempts, backoff_base_seconds, backoff_max_seconds
+    )
+
+def _dead_letter_expired_leases(db: Session, model, now: datetime, max_attempts: int, *criteria):
+    """最後の試行のリースが切れた（結果が記録されなかった）行は、これ以上再送せずに dead にする"""
+    db.execute(
+        update(model)
+        .where(
+            model.status == OUTBOX_STATUS_PENDING,
+            model.next_attempt_at <= now,
+            model.attempts >= max_attempts,
+            *criteria,
+        )
+        .values(status=OUTBOX_STATUS_DEAD, last_error="lease expired after the last attempt")
+        .execution_options(synchronize_session=False)
+    )
+
+def _finish_outbox_rows(
+    db: Session,
+    model,
+    sent_ids: list[int],
+    failures: list[tuple[int, str, bool]],
+    now: datetime,
+    max_attempts: int,
+    backoff_base_seconds: float,
+    backoff_max_seconds: float,
+) -> int:
+    """アウトボックスのテーブル（model）に送信結果を記録する（通知とメールのアウトボックスで共有する）"""
+    if sent_ids:
+        db.execute(
+            delete(model)
+            .where(model.id.in_(sent_ids))
+            .execution_options(synchronize_session=False)
+        )
+
+    dead = 0
+    if failures:
+        failed = values(
+            column("id", BigInteger), column("error", Text), column("permanent", Boolean), name="failed"
+        ).data(failures)
+        attempts = model.attempts
+        delay_seconds = (
+            func.least(backoff_base_seconds * func.power(2, attempts - 1), backoff_max_seconds)
+            * (0.5 + func.random() / 2)
+        )
+        statuses = db.scalars(
+            update(model)
+            .where(model.id == failed.c.id)
+            .values(
+                status=case(
+                    (failed.c.permanent | (attempts >= max_attempts), OUTBOX_STATUS_DEAD),
+                    else_=OUTBOX_STATUS_PENDING,
+                ),
+                next_attempt_at=literal(now, model.next_attempt_at.type)
+                + func.make_interval(0, 0, 0, 0, 0, 0, delay_seconds, type_=Interval),
+                last_error=failed.c.error,
+            )
+            .returning(model.status)
+            .execution_options(synchronize_session=False)
+        ).all()
+        dead = sum(1 for status in statuses if status == OUTBOX_STATUS_DEAD)
+    db.commit()
+    return dead
+
+# --- Email outbox ---
+def claim_email_batch(db: Session, now: datetime, batch_size: int, lease_seconds: float, max_attempts: int):
+    """
+    送信時刻を過ぎた送信待ちのメールを最大 batch_size 件確保し、送信に必要な列を返す。
+    リースと SKIP LOCKED の扱いは claim_outbox_batch と同じ。
+    """
+    _dead_letter_expired_leases(db, models.EmailOutbox, now, max_attempts)
+    ready_ids = (
+        select(models.EmailOutbox.id)
+        .where(
+            models.EmailOutbox.status == OUTBOX_STATUS_PENDING,
+            models.EmailOutbox.next_attempt_at <= now,
+        )
+        .order_by(models.EmailOutbox.next_attempt_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    rows = db.execute(
+        update(models.EmailOutbox)
+        .where(models.EmailOutbox.id.in_(ready_ids))
+        .values(
+            attempts=models.EmailOutbox.attempts + 1,
+            next_attempt_at=now + timedelta(seconds=lease_seconds),
+        )
+        .returning(
+            models.EmailOutbox.id.label("outbox_id"),
+            models.EmailOutbox.to_address,
+            models.EmailOutbox.subject,
+            models.EmailOutbox.body,
+            models.EmailOutbox.correlation_id,
+            models.EmailOutbox.created_at,
+        )
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    return rows
+
+def finish_email_batch(
+    db: Session,
+    sent_ids: list[int],
+    failures: list[tuple[int, str, bool]],
+    now: datetime,
+    max_attempts: int,
+    backoff_base_seconds: float,
+    backoff_max_seconds: float,
+) -> int:
+    """確保したメールの送信結果を記録し、dead にした行の数を返す（扱いは finish_outbox_batch と同じ）"""
+    return _finish_outbox_rows(
+        db, models.EmailOutbox, sent_ids, failures, now, max_attempts, backoff_base_seconds, backoff_max_seconds
+    )
+
+# --- Dashboard ---
+# get_dashboard が実行するクエリの数（習慣の数によらず一定）
+DASHBOARD_QUERY_COUNT = 4
+
+def get_dashboard(db: Session, user_id: int, today: date) -> list[schemas.DashboardHabit]:
+    """
+    ダッシュボードに表示する、ユーザーのすべての習慣と今日の達成状況・期間中の目標・通知設定をまとめて取得する。
+    習慣ごとにクエリを発行せず、習慣・今日の記録・目標・通知をそれぞれ1回のクエリで取得して組み立てる。
+    """
+    habits = db.scalars(
+        select(models.Habit).where(models.Habit.user_id == user_id).order_by(models.Habit.id)
+    ).all()
+    today_status = dict(db.execute(
+        select(models.HabitRecord.habit_id, models.HabitRecord.status)
+        .join(models.Habit)
+        .where(models.Habit.user_id == user_id, models.HabitRecord.date == today)
+    ).all())
+    goals = db.scalars(
+        select(models.Goal)
+        .join(models.Habit)
+        .where(models.Habit.user_id == user_id, models.Goal.start_date <= today, models.Goal.end_date >= today)
+        .order_by(models.Goal.id)
+    ).all()
+    notifications = db.scalars(
+        select(models.Notification).where(models.Notification.user_id == user_id).order_by(models.Notification.id)
+    ).all()
+
+    goals_by_habit: dict[int, list] = {}
+    for goal in goals:
+        goals_by_habit.setdefault(goal.habit_id, []).append(schemas.GoalResponse.model_validate(goal))
+    notifications_by_habit: dict[int, list] = {}
+    for notification in notifications:
+        notifications_by_habit.setdefault(notification.habit_id, []).append(
+            schemas.NotificationResponse.model_validate(notification)
+        )
+
+    return [
+        schemas.DashboardHabit.as_of(
+            habit,
+            today,
+            today_status=today_status.get(habit.id),
+            active_goals=goals_by_habit.get(habit.id, []),
+            notifications=notifications_by_habit.get(habit.id, []),
+        )
+        for habit in habits
+    ]
@@ -0,0 +1,151 @@
+# crud_async.py
+# crud.py のうち、負荷の高いエンドポイントで使う関数の非同期（asyncpg）版。
+# SQL文は crud.py と共有し、同期版と同じ結果になるようにしている。
+
+from datetime import datetime, timezone, date
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models, schemas, metrics, auth_cache
+from crud import (
+    completed_days_count_stmt,
+    goal_counter_update_stmt,
+    habit_lock_stmt,
+    habit_streak_rebuild_stmts,
+    pending_emails_delete_stmt,
+    prepare_unverified_user,
+    prepare_verification_email,
+    streak_append_stmt,
+)
+
+# --- User CRUD ---
+async def get_user_by_email(db: AsyncSession, email: str):
+    """メールアドレスで単一のユーザーを取得する"""
+    return await db.scalar(select(models.User).where(models.User.email == email))
+
+async def create_or_update_unverified_user(db: AsyncSession, user_data: schemas.UserCreate, password_hash: str) -> models.User:
+    """
+    ユーザーが存在しない場合は新規作成し、
+    未認証で存在する場合には認証コードとパスワードを更新する。
+    認証コードのメールは同じトランザクションで email_outbox に積む。
+    """
+    db_user = await get_user_by_email(db, user_data.email)
+    user_to_return = prepare_unverified_user(db_user, user_data, password_hash)
+    if user_to_return is not db_user:
+        db.add(user_to_return)
+    else:
+        # 以前に積んだ、古い認証コードのメールはもう送らない
+        await db.execute(pending_emails_delete_stmt(db_user.id))
+    # 認証コードのメールはユーザーと同じトランザクションでアウトボックスに積み、email_sender が送信する
+    db.add(prepare_verification_email(user_to_return))
+
+    await db.commit()
+    await db.refresh(user_to_return)
+    auth_cache.principal_cache.invalidate_user(user_to_return.id)
+    return user_to_return
+
+async def update_user_password_hash(db: AsyncSession, user_id: int, password_hash: str):
+    """パスワードのハッシュを差し替える（ハッシュのコストを変更したときの再ハッシュに使う）"""
+    await db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(password_hash=password_hash)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    auth_cache.principal_cache.invalidate_user(user_id)
+
+# --- Habit CRUD ---
+async def create_habit(db: AsyncSession, habit_data: schemas.HabitCreate, user_id: int):
+    """新しい習慣を作成する"""
+    result = await db.execute(
+        insert(models.Habit)
+        .values(
+            user_id=user_id,
+            name=habit_data.name,
+            description=habit_data.description,
+            created_at=datetime.now(timezone.utc)
+        )
+        .returning(*models.Habit.__table__.c)
+    )
+    row = result.one()
+    await db.commit()
+    return row
+
+async def get_habits_by_user(db: AsyncSession, user_id: int):
+    """ユーザーIDに基づいて、そのユーザーのすべての習慣を取得する"""
+    result = await db.scalars(select(models.Habit).where(models.Habit.user_id == user_id))
+    return result.all()
+
+async def get_habit_for_user(db: AsyncSession, habit_id: int, user_id: int):
+    """指定したユーザーが所有する習慣を取得する（他のユーザーの習慣であれば None）"""
+    return await db.scalar(
+        select(models.Habit).where(models.Habit.id == habit_id, models.Habit.user_id == user_id)
+    )
+
+# --- HabitRecord CRUD ---
+async def create_habit_record(db: AsyncSession, record: schemas.HabitRecordCreate):
+    db_record = models.HabitRecord(
+        habit_id=record.habit_id,
+        date=record.date,
+        status=record.status
+    )
+    db.add(db_record)
+    await db.flush()
+    # 記録の追加と目標の達成数・連続達成日数の更新を同じトランザクションで行う
+    if db_record.status:
+        await db.execute(habit_lock_stmt([db_record.habit_id]))
+        result = await db.execute(goal_counter_update_stmt(db_record.habit_id, db_record.date, 1))
+        metrics.GOAL_COUNTER_FANOUT.observe(result.rowcount)
+        await _record_habit_completion(db, habit_id=db_record.habit_id, record_date=db_record.date)
+    await db.commit()
+    await db.refresh(db_record)
+    return db_record
+
+async def get_habit_records_by_date_range(db: AsyncSession, habit_id: int, start_date: date, end_date: date):
+    result = await db.scalars(
+        select(models.HabitRecord)
+        .where(
+            models.HabitRecord.habit_id == habit_id,
+            models.HabitRecord.date.between(start_date, end_date)
+        )
+        .order_by(models.HabitRecord.date)
+    )
+    return result.all()
+
+# --- Habit streaks ---
+async def _record_habit_completion(db: AsyncSession, habit_id: int, record_date: date):
+    """達成した記録の追加を習慣の連続達成日数に反映する（crud._record_habit_completion の非同期版）"""
+    result = await db.execute(streak_append_stmt(habit_id, record_date))
+    if result.rowcount:
+        metrics.HABIT_STREAK_UPDATES.labels("incremental").inc()
+        return
+    for stmt in habit_streak_rebuild_stmts([habit_id]):
+        await db.execute(stmt)
+    metrics.HABIT_STREAK_UPDATES.labels("recompute").inc()
+
+# --- Goal CRUD ---
+async def create_goal_for_habit(db: AsyncSession, goal: schemas.GoalCreate, habit_id: int):
+    # 数える前に習慣の行をロックする（crud.create_goal_for_habit と同じ）
+    await db.execute(habit_lock_stmt([habit_id]))
+    current_count = await db.scalar(completed_days_count_stmt(habit_id, goal.start_date, goal.end_date))
+    db_goal = models.Goal(
+        habit_id=habit_id,
+        target_count=goal.target_count,
+        start_date=goal.start_date,
+        end_date=goal.end_date,
+        current_count=current_count,
+        is_achieved=current_count >= goal.target_count
+    )
+    db.add(db_goal)
+    await db.commit()
+    await db.refresh(db_goal)
+    return db_goal
+
+async def get_goals_for_habit(db: AsyncSession, habit_id: int):
+    """習慣のすべての目標を取得する（達成数は goals テーブルに保持されている）"""
+    result = await db.scalars(
+        select(models.Goal).where(models.Goal.habit_id == habit_id).order_by(models.Goal.id)
+    )
+    return result.all()
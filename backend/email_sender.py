@@ -0,0 +1,429 @@
+# email_sender.py
+# email_outbox に積まれたメール（認証コードなど）を取り出して送信する。
+# ユーザー登録のリクエストはアウトボックスに積むだけで返り、SMTPサーバーが遅くても落ちていても失敗しない。
+#
+# SMTP接続はプールして使い回し（接続・EHLO・STARTTLS・認証の往復をメールごとに行わない）、
+# 確保した1バッチ分のメールを1つの接続で続けて送る。送信レートはトークンバケットで制限する。
+# 送信に失敗したメールは、notification_dispatcher と同じく指数バックオフで再送し、上限に達したら dead にする。
+# 行の確保は SELECT ... FOR UPDATE SKIP LOCKED で行うため、スレッド・プロセスをいくつ並べても二重に送らない。
+#
+# API のプロセスの中ではスケジューラから drain_email_outbox を定期的に実行する。
+# 別のプロセスとして起動する場合は EMAIL_SENDER_IN_PROCESS=false にして:
+#     python email_sender.py --workers 2
+
+import argparse
+import logging
+import smtplib
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid, parseaddr
+from typing import Optional
+
+import crud
+import log_setup
+import metrics
+from database import SessionLocal
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class OutgoingEmail:
+    """送信する1通のメール"""
+    outbox_id: int
+    to_address: str
+    subject: str
+    body: str
+    correlation_id: Optional[str] = None
+
+
+@dataclass
+class EmailResult:
+    """1通ごとの送信結果。permanent はサーバーが恒久的なエラー（5xx）を返し、再送しても成功しないこと"""
+    outbox_id: int
+    success: bool
+    error: Optional[str] = None
+    permanent: bool = False
+
+
+class RateLimiter:
+    """トークンバケットによる送信レートの制限（スレッド間で共有する）。rate_per_second が 0 以下なら制限しない"""
+
+    def __init__(self, rate_per_second: float, burst: Optional[float] = None):
+        self.rate = rate_per_second
+        self.capacity = burst or max(1.0, rate_per_second)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """1通分のトークンを取り、足りなければ補充されるまで待つ"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # 先に取っておき（負になってもよい）、足りない分だけロックの外で待つ
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        metrics.EMAIL_THROTTLE_WAIT.observe(wait)
+        if wait:
+            time.sleep(wait)
+
+
+@dataclass
+class _PooledConnection:
+    smtp: smtplib.SMTP
+    sent: int = 0
+    reused: bool = False
+
+
+def _quit(smtp: smtplib.SMTP):
+    try:
+        smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        smtp.close()
+
+
+class SmtpConnectionPool:
+    """
+    SMTP接続のプール。同時に貸し出す接続は size 本まで（それ以上は返却を待つ）。
+    1つの接続で messages_per_connection 通送ったら接続し直す（サーバーの1接続あたりの上限に備える）。
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str = "",
+        password: str = "",
+        starttls: bool = False,
+        timeout: float = 10.0,
+        size: int = 2,
+        messages_per_connection: int = 100,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.messages_per_connection = messages_per_connection
+        self._idle: list[_PooledConnection] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+            raise
+        metrics.EMAIL_SMTP_CONNECTIONS.inc()
+        return smtp
+
+    def acquire(self) -> _PooledConnection:
+        """空いている接続を借りる（なければ新しく接続する）"""
+        self._slots.acquire()
+        try:
+            with self._lock:
+                pooled = self._idle.pop() if self._idle else None
+            if pooled is not None:
+                pooled.reused = True
+                return pooled
+            return _PooledConnection(self._connect())
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, pooled: _PooledConnection, reusable: bool = True):
+        """接続を返す。reusable=False（接続が壊れた）か、送信数の上限に達した接続は閉じる"""
+        try:
+            if reusable and pooled.sent < self.messages_per_connection:
+                with self._lock:
+                    self._idle.append(pooled)
+                return
+            _quit(pooled.smtp)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            _quit(pooled.smtp)
+
+
+def _classify_error(exc: Exception) -> tuple[str, bool, bool]:
+    """SMTPのエラーを (エラー, 恒久的なエラーか, 接続をそのまま使えるか) に分類する"""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in exc.recipients.values()]
+        return f"recipients refused: {exc.recipients}", all(500 <= code < 600 for code in codes), True
+    if isinstance(exc, smtplib.SMTPResponseException):
+        error = exc.smtp_error.decode(errors="replace") if isinstance(exc.smtp_error, bytes) else str(exc.smtp_error)
+        # 421 はサーバーが接続を閉じるという応答
+        return f"{exc.smtp_code} {error}", 500 <= exc.smtp_code < 600, exc.smtp_code != 421
+    # 切断・タイムアウトなど。接続を作り直して後で再送する
+    return str(exc) or type(exc).__name__, False, False
+
+
+class SmtpTransport:
+    """プールしたSMTP接続で、バッチのメールを1つの接続で続けて送るトランスポート"""
+
+    def __init__(self, pool: SmtpConnectionPool, from_address: str, limiter: Optional[RateLimiter] = None):
+        self.pool = pool
+        self.from_address = from_address
+        self.limiter = limiter
+        # make_msgid はドメインを省略するとメールごとにホスト名を引くので、送信元のドメインを使う
+        self._msgid_domain = parseaddr(from_address)[1].rpartition("@")[2] or "localhost"
+
+    def build_message(self, email: OutgoingEmail) -> EmailMessage:
+        message = EmailMessage()
+        message["From"] = self.from_address
+        message["To"] = email.to_address
+        message["Subject"] = email.subject
+        message["Date"] = formatdate(usegmt=True)
+        message["Message-ID"] = make_msgid(domain=self._msgid_domain)
+        if email.correlation_id:
+            message["X-Correlation-ID"] = email.correlation_id
+        message.set_content(email.body)
+        return message
+
+    def send_batch(self, emails: list[OutgoingEmail]) -> list[EmailResult]:
+        results = []
+        pooled = None
+        try:
+            for index, email in enumerate(emails):
+                message = self.build_message(email)
+                if self.limiter is not None:
+                    self.limiter.acquire()
+                retried = False
+                while True:
+                    if pooled is None:
+                        try:
+                            pooled = self.pool.acquire()
+                        except (smtplib.SMTPException, OSError) as e:
+                            # サーバーに接続できない場合は、残りのメールもまとめて後で再送する
+                            error = _classify_error(e)[0]
+                            results.extend(EmailResult(rest.outbox_id, success=False, error=error) for rest in emails[index:])
+                            return results
+                    try:
+                        pooled.smtp.send_message(message)
+                        pooled.sent += 1
+                        results.append(EmailResult(email.outbox_id, success=True))
+                        break
+                    except (smtplib.SMTPException, OSError) as e:
+                        error, permanent, usable = _classify_error(e)
+                        if not usable:
+                            reused = pooled.reused
+                            self.pool.release(pooled, reusable=False)
+                            pooled = None
+                            # 使い回した接続がサーバー側で切られていた場合は、新しい接続で1度だけ送り直す
+                            if reused and not retried:
+                                retried = True
+                                continue
+                        results.append(EmailResult(email.outbox_id, success=False, error=error, permanent=permanent))
+                        break
+        finally:
+            if pooled is not None:
+                self.pool.release(pooled)
+        return results
+
+    def close(self):
+        self.pool.close()
+
+
+class LogTransport:
+    """
+    メールを送らずにログに出し、送信済みにするトランスポート（SMTPサーバーのない開発環境用。EMAIL_BACKEND=log で使う）。
+    本文には認証コードが含まれるので、DEBUG のときだけ出す（LOG_LEVELS=email_sender=DEBUG）。
+    """
+
+    def send_batch(self, emails: list[OutgoingEmail]) -> list[EmailResult]:
+        log_body = logger.isEnabledFor(logging.DEBUG)
+        for email in emails:
+            extra = {"correlation_id": email.correlation_id, "to": email.to_address, "subject": email.subject}
+            if log_body:
+                logger.debug("Email (not sent: EMAIL_BACKEND=log)", extra={**extra, "body": email.body})
+            else:
+                logger.info("Email (not sent: EMAIL_BACKEND=log)", extra=extra)
+        return [EmailResult(email.outbox_id, success=True) for email in emails]
+
+    def close(self):
+        pass
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def default_transport():
+    """設定（EMAIL_BACKEND）に従ったトランスポートを返す。SMTPの接続プールはプロセスの中で共有する"""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            if settings.email_backend == "log":
+                _transport = LogTransport()
+            else:
+                pool = SmtpConnectionPool(
+                    settings.smtp_host,
+                    settings.smtp_port,
+                    username=settings.smtp_username,
+                    password=settings.smtp_password,
+                    starttls=settings.smtp_starttls,
+                    timeout=settings.smtp_timeout_seconds,
+                    size=settings.smtp_pool_size,
+                    messages_per_connection=settings.smtp_messages_per_connection,
+                )
+                _transport = SmtpTransport(pool, settings.email_from, RateLimiter(settings.email_rate_per_second))
+        return _transport
+
+
+def warn_if_not_sending():
+    """EMAIL_BACKEND=log のときは、メールを送らずに送信済みにすることを起動時に警告する"""
+    if settings.email_backend == "log":
+        logger.warning("EMAIL_BACKEND=log: emails are logged and marked as sent but never delivered (development only)")
+
+
+def close_transport():
+    """プールしているSMTP接続を閉じる（終了時に呼び出す）"""
+    global _transport
+    with _transport_lock:
+        if _transport is not None:
+            _transport.close()
+            _transport = None
+
+
+def send_email_batch(transport=None, batch_size: int = None) -> int:
+    """
+    送信待ちのメールを1バッチ分確保して送信し、結果を記録する。確保した行の数を返す（0 なら送信待ちのメールはない）。
+    transport を渡すと、設定に従ったトランスポートの代わりにそれで送信する。
+    """
+    transport = transport or default_transport()
+    batch_size = batch_size or settings.email_batch_size
+    with log_setup.correlation_scope():
+        db = SessionLocal()
+        try:
+            rows = crud.claim_email_batch(
+                db,
+                now=datetime.now(timezone.utc),
+                batch_size=batch_size,
+                lease_seconds=settings.email_lease_seconds,
+                max_attempts=settings.email_max_attempts,
+            )
+            if not rows:
+                return 0
+
+            results = transport.send_batch([
+                OutgoingEmail(
+                    outbox_id=row.outbox_id,
+                    to_address=row.to_address,
+                    subject=row.subject,
+                    body=row.body,
+                    correlation_id=row.correlation_id,
+                )
+                for row in rows
+            ])
+
+            now = datetime.now(timezone.utc)
+            sent_ids = []
+            failures = []
+            for row, result in zip(rows, results):
+                if result.success:
+                    sent_ids.append(row.outbox_id)
+                    metrics.EMAIL_DELIVERY_LAG.observe((now - row.created_at).total_seconds())
+                else:
+                    failures.append((row.outbox_id, result.error or "unknown error", result.permanent))
+                # メールを積んだリクエストの相関IDで、送信の結果をログに出す
+                logger.info(
+                    "Email sent" if result.success else "Email failed",
+                    extra={"correlation_id": row.correlation_id, "outbox_id": row.outbox_id, "error": result.error},
+                )
+
+            dead = crud.finish_email_batch(
+                db,
+                sent_ids=sent_ids,
+                failures=failures,
+                now=now,
+                max_attempts=settings.email_max_attempts,
+                backoff_base_seconds=settings.email_backoff_base_seconds,
+                backoff_max_seconds=settings.email_backoff_max_seconds,
+            )
+            metrics.EMAIL_DELIVERIES.labels("sent").inc(len(sent_ids))
+            metrics.EMAIL_DELIVERIES.labels("retry").inc(len(failures) - dead)
+            metrics.EMAIL_DELIVERIES.labels("dead").inc(dead)
+            if failures:
+                logger.warning(
+                    "Email batch had failures",
+                    extra={"sent": len(sent_ids), "retry": len(failures) - dead, "dead": dead},
+                )
+            return len(rows)
+        finally:
+            db.close()
+
+
+def drain_email_outbox(transport=None, batch_size: int = None) -> int:
+    """送信時刻を過ぎた送信待ちのメールがなくなるまでバッチの送信を繰り返し、確保した行の合計を返す"""
+    total = 0
+    while True:
+        claimed = send_email_batch(transport=transport, batch_size=batch_size)
+        if not claimed:
+            return total
+        total += claimed
+
+
+def run_workers(workers: int, stop_event: threading.Event, transport=None, poll_seconds: float = None, batch_size: int = None):
+    """
+    workers 個のスレッドでアウトボックスのメールを送信し続ける。stop_event がセットされるまで戻らない。
+    SMTPの接続プールの大きさ（SMTP_POOL_SIZE）以上のスレッドを動かしても、同時に使う接続は増えない。
+    """
+    poll_seconds = poll_seconds if poll_seconds is not None else settings.email_sender_poll_seconds
+
+    def _worker():
+        while not stop_event.is_set():
+            try:
+                claimed = send_email_batch(transport=transport, batch_size=batch_size)
+            except Exception:
+                logger.exception("Email sender error")
+                claimed = 0
+            if not claimed:
+                stop_event.wait(poll_seconds)
+
+    threads = [threading.Thread(target=_worker, name=f"email-sender-{i}", daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deliver emails from the email outbox.")
+    parser.add_argument("--workers", type=int, default=settings.smtp_pool_size)
+    parser.add_argument("--batch-size", type=int, default=settings.email_batch_size)
+    parser.add_argument("--poll-seconds", type=float, default=settings.email_sender_poll_seconds)
+    args = parser.parse_args()
+    log_setup.configure()
+
+    logger.info("Starting email sender with %d workers (backend: %s)", args.workers, settings.email_backend)
+    warn_if_not_sending()
+    stop_event = threading.Event()
+    try:
+        run_workers(args.workers, stop_event, poll_seconds=args.poll_seconds, batch_size=args.batch_size)
+    except KeyboardInterrupt:
+        stop_event.set()
+        logger.info("Email sender stopped.")
+    finally:
+        close_transport()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+# fcm_dispatcher.py
+
+import http.client
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from firebase_admin import messaging
+
+import metrics
+
+# messaging.send_each が一度に受け付けるメッセージ数の上限
+FCM_MAX_BATCH_SIZE = 500
+DEFAULT_MAX_WORKERS = 8
+
+
+@dataclass
+class Reminder:
+    """1件のリマインダー送信に必要な情報"""
+    user_id: int
+    fcm_token: str
+    habit_name: str
+
+
+@dataclass
+class TransportResponse:
+    """トランスポートが返す1メッセージ分の送信結果"""
+    success: bool
+    message_id: Optional[str] = None
+    error: Optional[str] = None
+    token_invalid: bool = False
+    # メトリクスに使うエラーの種類（FCMのエラーコードや例外のクラス名）
+    code: Optional[str] = None
+
+
+@dataclass
+class SendResult:
+    """トークンごとの最終的な送信結果"""
+    user_id: int
+    fcm_token: str
+    success: bool
+    message_id: Optional[str] = None
+    error: Optional[str] = None
+    token_invalid: bool = False
+
+
+class FirebaseTransport:
+    """firebase_admin の send_each を使って実際にFCMへ送信するトランスポート"""
+
+    def send_batch(self, messages: list[messaging.Message]) -> list[TransportResponse]:
+        batch_response = messaging.send_each(messages)
+        results = []
+        for response in batch_response.responses:
+            if response.success:
+                results.append(TransportResponse(success=True, message_id=response.message_id))
+            else:
+                exc = response.exception
+                results.append(TransportResponse(
+                    success=False,
+                    error=str(exc),
+                    token_invalid=_is_invalid_token_error(exc),
+                    code=type(exc).__name__,
+                ))
+        return results
+
+
+class FakeTransport:
+    """
+    ネットワークを使わずにスループットを計測するためのローカルなトランスポート。
+    バッチごとに latency 秒だけ待ち、invalid_tokens に含まれるトークンは未登録として扱う。
+    failure_rate を指定すると、その割合のメッセージを一時的なエラー（再送で成功しうる）として失敗させる。
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        invalid_tokens: Optional[set[str]] = None,
+        failure_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.invalid_tokens = invalid_tokens or set()
+        self.failure_rate = failure_rate
+        self.sent_count = 0
+        self.failed_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def send_batch(self, messages: list[messaging.Message]) -> list[TransportResponse]:
+        if self.latency:
+            time.sleep(self.latency)
+        results = []
+        with self._lock:
+            for message in messages:
+                if message.token in self.invalid_tokens:
+                    results.append(TransportResponse(success=False, error="UNREGISTERED", token_invalid=True, code="UNREGISTERED"))
+                elif self.failure_rate and self._random.random() < self.failure_rate:
+                    results.append(TransportResponse(success=False, error="UNAVAILABLE", code="UNAVAILABLE"))
+                    self.failed_count += 1
+                else:
+                    results.append(TransportResponse(success=True, message_id=f"fake/{uuid.uuid4().hex}"))
+            self.sent_count += len(messages)
+        return results
+
+
+class HttpFakeTransport:
+    """
+    ローカルで動かした偽のFCMエンドポイントへ、HTTPでメッセージを送るトランスポート。
+    FakeTransport と違い、メッセージのJSONへの変換と送受信のCPUコストが実際にかかるため、
+    プロセス数を増やしたときのスループットの伸びを計測するのに使う（TLS は再現しない）。
+    エンドポイントは JSON の配列を受け取り、メッセージごとの結果（{"success": ..., "message_id": ...}）の配列を返す。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, path: str = "/v1/messages:batchSend"):
+        self.host = host
+        self.port = port
+        self.path = path
+        # 接続はスレッドごとに持ち、キープアライブで使い回す
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def send_batch(self, messages: list[messaging.Message]) -> list[TransportResponse]:
+        body = json.dumps([
+            {
+                "token": message.token,
+                "notification": {"title": message.notification.title, "body": message.notification.body},
+            }
+            for message in messages
+        ]).encode()
+        conn = self._connection()
+        try:
+            conn.request("POST", self.path, body=body, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            payload = json.loads(response.read())
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+        return [
+            TransportResponse(
+                success=item.get("success", False),
+                message_id=item.get("message_id"),
+                error=item.get("error"),
+                token_invalid=item.get("error") == "UNREGISTERED",
+                code=item.get("error"),
+            )
+            for item in payload
+        ]
+
+
+def _is_invalid_token_error(exc: Exception) -> bool:
+    """トークン自体が無効（再送しても成功しない）エラーかどうかを判定する"""
+    return isinstance(exc, (messaging.UnregisteredError, messaging.SenderIdMismatchError))
+
+
+def build_reminder_message(reminder: Reminder) -> messaging.Message:
+    """リマインダー用のFCMメッセージを作成する"""
+    return messaging.Message(
+        notification=messaging.Notification(
+            title="今日の習慣リマインダー！",
+            body=f"「{reminder.habit_name}」の時間ですよ！頑張りましょう！"
+        ),
+        token=reminder.fcm_token,
+    )
+
+
+def _send_chunk(transport, chunk: list[Reminder]) -> list[SendResult]:
+    """1バッチ分のリマインダーを送信し、トークンごとの結果を返す"""
+    messages = [build_reminder_message(reminder) for reminder in chunk]
+    started = time.perf_counter()
+    try:
+        responses = transport.send_batch(messages)
+    except Exception as e:
+        # バッチ全体が失敗した場合（ネットワークエラーなど）はトークンは無効扱いにしない
+        metrics.FCM_ERRORS.labels(type(e).__name__).inc(len(chunk))
+        return [
+            SendResult(user_id=r.user_id, fcm_token=r.fcm_token, success=False, error=str(e))
+            for r in chunk
+        ]
+    finally:
+        metrics.FCM_BATCH_SECONDS.observe(time.perf_counter() - started)
+
+    for response in responses:
+        if not response.success:
+            metrics.FCM_ERRORS.labels(response.code or "unknown").inc()
+
+    return [
+        SendResult(
+            user_id=reminder.user_id,
+            fcm_token=reminder.fcm_token,
+            success=response.success,
+            message_id=response.message_id,
+            error=response.error,
+            token_invalid=response.token_invalid,
+        )
+        for reminder, response in zip(chunk, responses)
+    ]
+
+
+def dispatch_reminders(
+    reminders: Iterable[Reminder],
+    transport=None,
+    batch_size: int = FCM_MAX_BATCH_SIZE,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> list[SendResult]:
+    """
+    リマインダーを最大 batch_size 件ずつのバッチにまとめ、
+    上限付きのワーカープールで並行して送信する。
+    結果は入力と同じ順序で、トークンごとに返す。
+    """
+    if transport is None:
+        transport = FirebaseTransport()
+    batch_size = max(1, min(batch_size, FCM_MAX_BATCH_SIZE))
+
+    reminders = list(reminders)
+    chunks = [reminders[i:i + batch_size] for i in range(0, len(reminders), batch_size)]
+    if not chunks:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        chunk_results = executor.map(lambda chunk: _send_chunk(transport, chunk), chunks)
+        return [result for results in chunk_results for result in results]
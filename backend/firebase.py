@@ -1,11 +1,15 @@
+import logging
+
 import firebase_admin
 from firebase_admin import credentials
 
+logger = logging.getLogger(__name__)
+
 SERVICE_ACCOUNT_FILE = 'firebase-service-account.json'
 
 try:
     cred = credentials.Certificate(SERVICE_ACCOUNT_FILE)
     firebase_admin.initialize_app(cred)
-    print("Firebase Admin SDK initialized successfully.")
+    logger.info("Firebase Admin SDK initialized successfully.")
 except Exception as e:
-    print(f"Error initializing Firebase Admin SDK: {e}")
\ No newline at end of file
+    logger.error("Error initializing Firebase Admin SDK: %s", e)
\ No newline at end of file
@@ -0,0 +1,141 @@
+# habit_stats.py
+# 習慣の達成履歴から、連続達成日数・直近の達成率・曜日ごとの達成数を求める。
+# 1つの習慣だけでなく、複数の習慣の履歴をまとめて NumPy の配列で受け取り、
+# 習慣ごとのループを使わずに一度に計算する（バッチ処理で数千件の習慣を扱えるようにするため）。
+
+from dataclasses import dataclass
+from datetime import date
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+import scheduling
+
+# 達成率を求める直近の日数
+ROLLING_WINDOWS = (7, 30, 90)
+
+# date.toordinal() での 1970-01-01 の値
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# 1970-01-01（日数 0）は木曜日なので、3 を足して 7 で割った余りが月曜日=0 の曜日になる
+_EPOCH_WEEKDAY_OFFSET = 3
+
+
+@dataclass
+class HabitStats:
+    habit_id: int
+    as_of: date
+    current_streak: int
+    longest_streak: int
+    completion_rate_7d: float
+    completion_rate_30d: float
+    completion_rate_90d: float
+    # 月曜日から日曜日までの達成数
+    weekday_counts: list[int]
+
+
+def _to_days(dates: Sequence[date]) -> np.ndarray:
+    """日付の列を 1970-01-01 からの日数（int64）の配列にする"""
+    # np.asarray(dates, dtype="datetime64[D]") は date オブジェクトの変換が遅いため、toordinal を使う
+    return np.fromiter((d.toordinal() for d in dates), dtype=np.int64, count=len(dates)) - _EPOCH_ORDINAL
+
+
+def compute_stats(
+    habit_ids: Sequence[int],
+    record_habit_ids: Sequence[int],
+    record_dates: Sequence[date],
+    today: date,
+    start_dates: Optional[Sequence[date]] = None,
+) -> list[HabitStats]:
+    """
+    habit_ids の各習慣について統計を求め、同じ順番で返す。
+    record_habit_ids / record_dates は達成した記録（習慣IDと日付の組）で、順番は問わない。
+    start_dates（習慣の開始日）を渡すと、開始から日が浅い習慣の達成率は開始日からの日数で割る。
+    today より後の日付の記録は無視する。
+    """
+    ids = np.asarray(habit_ids, dtype=np.int64)
+    n = len(ids)
+    if n == 0:
+        return []
+    today_day = _to_days([today])[0]
+
+    # 記録の習慣IDを habit_ids の中の位置に変換し、対象外の習慣の記録と未来の記録を除く
+    rec_ids = np.asarray(record_habit_ids, dtype=np.int64)
+    days = _to_days(record_dates)
+    order = np.argsort(ids, kind="stable")
+    idx = order[np.clip(np.searchsorted(ids[order], rec_ids), 0, n - 1)]
+    keep = (ids[idx] == rec_ids) & (days <= today_day)
+    idx, days = idx[keep], days[keep]
+
+    # 習慣ごと・日付順に並べる（同じ習慣・同じ日付の記録は1件にする）
+    sort = np.lexsort((days, idx))
+    idx, days = idx[sort], days[sort]
+    if len(idx):
+        unique = np.ones(len(idx), dtype=bool)
+        unique[1:] = (idx[1:] != idx[:-1]) | (days[1:] != days[:-1])
+        idx, days = idx[unique], days[unique]
+    m = len(idx)
+
+    # 連続した日付の区間（ラン）に分け、習慣ごとに最長のランと、今日か昨日で終わるランを求める
+    longest = np.zeros(n, dtype=np.int64)
+    current = np.zeros(n, dtype=np.int64)
+    if m:
+        new_run = np.ones(m, dtype=bool)
+        new_run[1:] = (idx[1:] != idx[:-1]) | (np.diff(days) != 1)
+        run_starts = np.flatnonzero(new_run)
+        run_lengths = np.diff(np.append(run_starts, m))
+        run_habits = idx[run_starts]
+        run_ends = days[run_starts + run_lengths - 1]
+        np.maximum.at(longest, run_habits, run_lengths)
+        # 今日の記録がまだなくても、昨日まで続いていれば連続記録は途切れていないとみなす
+        live = run_ends >= today_day - 1
+        current[run_habits[live]] = run_lengths[live]
+
+    # 直近 N 日（今日を含む）の達成率
+    if start_dates is not None:
+        elapsed = today_day - _to_days(start_dates) + 1
+    else:
+        elapsed = np.full(n, max(ROLLING_WINDOWS), dtype=np.int64)
+    rates = []
+    for window in ROLLING_WINDOWS:
+        counts = np.bincount(idx[days > today_day - window], minlength=n)
+        denominator = np.clip(elapsed, 1, window)
+        rates.append(np.minimum(counts / denominator, 1.0))
+
+    # 曜日ごとの達成数（習慣ごとに7つの箱を用意し、1回の bincount で数える）
+    weekdays = (days + _EPOCH_WEEKDAY_OFFSET) % 7
+    weekday_counts = np.bincount(idx * 7 + weekdays, minlength=n * 7).reshape(n, 7)
+
+    return [
+        HabitStats(
+            habit_id=int(ids[i]),
+            as_of=today,
+            current_streak=int(current[i]),
+            longest_streak=int(longest[i]),
+            completion_rate_7d=round(float(rates[0][i]), 4),
+            completion_rate_30d=round(float(rates[1][i]), 4),
+            completion_rate_90d=round(float(rates[2][i]), 4),
+            weekday_counts=weekday_counts[i].tolist(),
+        )
+        for i in range(n)
+    ]
+
+
+def stats_from_history(rows: Iterable[tuple], today: date) -> list[HabitStats]:
+    """
+    crud.get_completion_history の結果（習慣ID・作成日時・ユーザーのタイムゾーン・達成した日付の行。
+    記録のない習慣は日付が None の行が1件）から、習慣ごとの統計を求める。
+    today と記録の日付はユーザーのタイムゾーンの日付なので、開始日も作成日時をそのタイムゾーンの日付にしたものを使う。
+    """
+    habit_ids: list[int] = []
+    start_dates: list[date] = []
+    record_habit_ids: list[int] = []
+    record_dates: list[date] = []
+    for habit_id, created_at, tz_name, record_date in rows:
+        if not habit_ids or habit_ids[-1] != habit_id:
+            habit_ids.append(habit_id)
+            start_dates.append(scheduling.local_date(created_at, tz_name))
+        if record_date is not None:
+            record_habit_ids.append(habit_id)
+            record_dates.append(record_date)
+    return compute_stats(habit_ids, record_habit_ids, record_dates, today, start_dates=start_dates)
@@ -0,0 +1,124 @@
+# leader_election.py
+# 複数のワーカー・ホストで API を動かしても、通知のスケジューラを1つのプロセスだけで実行するためのリーダー選出。
+# Postgres のセッション単位のアドバイザリロック（pg_try_advisory_lock）を専用の接続で保持したプロセスがリーダーになる。
+# リーダーのプロセスが落ちると接続が切れてロックが解放され、スタンバイが retry_seconds 以内に引き継ぐ。
+# ホストごと応答しなくなった場合も、TCPキープアライブで接続の切断を検出してロックが解放される。
+
+import logging
+import threading
+from typing import Optional
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import NullPool
+
+import metrics
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AdvisoryLockLeader:
+    """
+    アドバイザリロックによるリーダー選出。
+    ensure() を定期的に呼び出し、is_leader が True のプロセスだけがスケジュールされた処理を実行する。
+    """
+
+    def __init__(self, engine: Engine, lock_id: int):
+        self.engine = engine
+        self.lock_id = lock_id
+        self._conn: Optional[Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_leader(self) -> bool:
+        return self._conn is not None
+
+    def ensure(self) -> bool:
+        """
+        リーダーであればロックを保持している接続がまだ生きているかを確認し、
+        そうでなければロックの取得を試みる。リーダーかどうかを返す。
+        """
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.exec_driver_sql("SELECT 1")
+                    self._conn.commit()
+                    return True
+                except DBAPIError as e:
+                    # 接続が切れた時点でロックはサーバー側で解放されているので、リーダーを降りる
+                    logger.warning("Lost scheduler leadership: %s", e)
+                    self._discard("lost")
+            return self._try_acquire()
+
+    def _try_acquire(self) -> bool:
+        try:
+            conn = self.engine.connect()
+        except DBAPIError as e:
+            logger.warning("Could not connect for scheduler leader election: %s", e)
+            return False
+
+        try:
+            # 接続が切れたことをサーバー側でも早く検出し、ロックを解放させる
+            keepalive = settings.scheduler_leader_keepalive_seconds
+            conn.exec_driver_sql(f"SET tcp_keepalives_idle = {int(keepalive)}")
+            conn.exec_driver_sql(f"SET tcp_keepalives_interval = {int(keepalive)}")
+            conn.exec_driver_sql("SET tcp_keepalives_count = 2")
+            acquired = conn.scalar(select(func.pg_try_advisory_lock(self.lock_id)))
+            # ロックはセッション単位なのでコミットしても保持される（idle in transaction のまま残さない）
+            conn.commit()
+        except DBAPIError as e:
+            logger.warning("Scheduler leader election failed: %s", e)
+            conn.close()
+            return False
+
+        if not acquired:
+            conn.close()
+            return False
+
+        self._conn = conn
+        metrics.SCHEDULER_IS_LEADER.set(1)
+        metrics.SCHEDULER_LEADER_TRANSITIONS.labels("acquired").inc()
+        logger.info("Acquired scheduler leadership (advisory lock %d).", self.lock_id)
+        return True
+
+    def _discard(self, event: str):
+        try:
+            self._conn.close()
+        except DBAPIError:
+            pass
+        self._conn = None
+        metrics.SCHEDULER_IS_LEADER.set(0)
+        metrics.SCHEDULER_LEADER_TRANSITIONS.labels(event).inc()
+
+    def release(self):
+        """ロックを解放してリーダーを降りる（終了時に呼び出し、スタンバイがすぐに引き継げるようにする）"""
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                self._conn.scalar(select(func.pg_advisory_unlock(self.lock_id)))
+                self._conn.commit()
+            except DBAPIError:
+                pass
+            self._discard("released")
+            logger.info("Released scheduler leadership.")
+
+
+def _make_lock_engine() -> Engine:
+    # ロック用の接続はプールに戻さず、API のプールの接続数にも含めない
+    keepalive = settings.scheduler_leader_keepalive_seconds
+    return create_engine(
+        settings.scheduler_lock_database_url,
+        poolclass=NullPool,
+        connect_args={
+            "keepalives": 1,
+            "keepalives_idle": keepalive,
+            "keepalives_interval": keepalive,
+            "keepalives_count": 2,
+        },
+    )
+
+
+scheduler_leader = AdvisoryLockLeader(_make_lock_engine(), lock_id=settings.scheduler_leader_lock_id)
@@ -0,0 +1,173 @@
+# log_setup.py
+# 構造化（1行1つのJSON）ログの設定。各モジュールは print の代わりに logging.getLogger(__name__) を使う。
+# ログを出した側のスレッドでは LogRecord をキューに積むだけにし、整形と stdout への書き込みは
+# QueueListener のバックグラウンドスレッドで行う（リクエストや通知のティックを書き込みで待たせない）。
+#
+# 相関ID（correlation_id）は contextvars で持ち回り、そのコンテキストで出したすべてのログに付く。
+# API ではリクエストごと（X-Request-ID）、通知のティックではティックごとに割り当て、
+# ティックが積んだアウトボックスの行にも保存して、ディスパッチャーの送信ログに引き継ぐ。
+
+import atexit
+import json
+import logging
+import queue
+import re
+import sys
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Iterator, Optional
+
+from settings import settings
+
+_correlation_id: ContextVar[Optional[str]] = ContextVar("correlation_id", default=None)
+
+# 外部から受け取る相関ID（X-Request-ID）として受け付ける形式
+_VALID_CORRELATION_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+# LogRecord の標準の属性。これ以外の属性（extra= で渡したもの）は JSON のフィールドとして出力する
+_RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "correlation_id"}
+
+_listener: Optional[QueueListener] = None
+
+# ロガーごとに残すログの割合（configure で settings.log_sample_rates から設定する）
+_sample_rates: dict[str, float] = {}
+
+
+def new_correlation_id() -> str:
+    return uuid.uuid4().hex
+
+
+def get_correlation_id() -> Optional[str]:
+    """現在のコンテキストの相関IDを返す（割り当てられていなければ None）"""
+    return _correlation_id.get()
+
+
+def accept_correlation_id(value: Optional[str]) -> str:
+    """外部から受け取った相関IDを検証し、使えなければ新しく割り当てる"""
+    if value and _VALID_CORRELATION_ID.match(value):
+        return value
+    return new_correlation_id()
+
+
+@contextmanager
+def correlation_scope(correlation_id: Optional[str] = None) -> Iterator[str]:
+    """このブロックの中で出すログに相関IDを付ける（省略すると新しく割り当てる）"""
+    correlation_id = correlation_id or new_correlation_id()
+    token = _correlation_id.set(correlation_id)
+    try:
+        yield correlation_id
+    finally:
+        _correlation_id.reset(token)
+
+
+def sample_rate(logger: logging.Logger, level: int = logging.INFO) -> float:
+    """
+    logger に level のログを出す割合。レベルが無効なら 0、LOG_SAMPLE_RATES の指定（ロガーか親のもの）がなければ 1。
+    WARNING 以上は間引かない。件数の多いログは、呼び出し側で random() < rate のときだけ出し、
+    間引くログの extra の辞書や LogRecord を作らないようにする。
+    """
+    if not logger.isEnabledFor(level):
+        return 0.0
+    if level >= logging.WARNING:
+        return 1.0
+    name = logger.name
+    while name:
+        if name in _sample_rates:
+            return _sample_rates[name]
+        name = name.rpartition(".")[0]
+    return 1.0
+
+
+class JsonFormatter(logging.Formatter):
+    """1件のログを1行のJSONにする。extra= で渡したフィールドもそのまま含める"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        correlation_id = getattr(record, "correlation_id", None)
+        if correlation_id:
+            entry["correlation_id"] = correlation_id
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _ContextFilter(logging.Filter):
+    """ログを出したスレッドのコンテキストで、相関IDを LogRecord に写す（extra= で指定済みなら上書きしない）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "correlation_id", None) is None:
+            record.correlation_id = _correlation_id.get()
+        return True
+
+
+class _EnqueueHandler(QueueHandler):
+    """
+    LogRecord を整形せずにキューに積む（同じプロセスの中のキューなので、pickle のための整形は要らない）。
+    メッセージの引数だけはこの時点で埋め込み、後から変更されたオブジェクトの値が出ないようにする。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _parse_pairs(value: str) -> dict[str, str]:
+    """"name=value,name=value" の形式の設定を辞書にする"""
+    pairs = {}
+    for item in value.split(","):
+        name, sep, setting = item.partition("=")
+        if sep and name.strip():
+            pairs[name.strip()] = setting.strip()
+    return pairs
+
+
+def configure():
+    """
+    ルートロガーにキュー経由のハンドラーを設定し、書き込み用のスレッドを起動する（何度呼んでも1回だけ行う）。
+    API・ディスパッチャーの各プロセス（spawn で起動した子プロセスを含む）の起動時に呼び出す。
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    if settings.log_format == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(correlation_id)s] %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    handler = _EnqueueHandler(log_queue)
+    handler.addFilter(_ContextFilter())
+    _sample_rates.update((name, float(rate)) for name, rate in _parse_pairs(settings.log_sample_rates).items())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(settings.log_level.upper())
+    for name, level in _parse_pairs(settings.log_levels).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    # 終了時にキューに残ったログを書き出す
+    atexit.register(shutdown)
+
+
+def shutdown():
+    """キューに残ったログを書き出して、書き込み用のスレッドを止める"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,215 @@
+# metrics.py
+# Prometheus形式のメトリクス。/metrics で公開される。
+
+from prometheus_client import Counter, Gauge, Histogram
+
+GOAL_COUNTER_FANOUT = Histogram(
+    "snoop_goal_counter_fanout",
+    "Number of goals whose counters were updated by a single habit record change",
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+HABIT_STREAK_UPDATES = Counter(
+    "snoop_habit_streak_updates_total",
+    "Habit streak updates by path (incremental append or per-habit recompute)",
+    ["path"],
+)
+
+# --- DB接続プール ---
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "snoop_db_pool_checkout_wait_seconds",
+    "Time spent waiting to check out a connection from the pool",
+    ["engine"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+DB_POOL_CHECKOUT_TIMEOUTS = Counter(
+    "snoop_db_pool_checkout_timeouts_total",
+    "Number of pool checkouts that gave up after pool_timeout",
+    ["engine"],
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "snoop_db_pool_checked_out",
+    "Connections currently checked out from the pool",
+    ["engine"],
+)
+DB_POOL_CAPACITY = Gauge(
+    "snoop_db_pool_capacity",
+    "Maximum number of connections the pool can hand out (pool_size + max_overflow)",
+    ["engine"],
+)
+DB_POOL_SATURATION = Gauge(
+    "snoop_db_pool_saturation",
+    "Fraction of the pool capacity currently checked out",
+    ["engine"],
+)
+
+def track_db_pool(label: str, engine, capacity: int):
+    """エンジンの接続プールの使用状況をゲージに登録する（dispose で作り直されたプールにも追従する）"""
+    DB_POOL_CHECKED_OUT.labels(label).set_function(lambda: engine.pool.checkedout())
+    DB_POOL_CAPACITY.labels(label).set(capacity)
+    DB_POOL_SATURATION.labels(label).set_function(
+        lambda: engine.pool.checkedout() / capacity if capacity else 0.0
+    )
+
+
+# --- HTTPリクエスト ---
+# route はパスのテンプレート（/habits/{habit_id} など）。どのルートにも一致しなかったリクエストは "unmatched"
+HTTP_REQUEST_SECONDS = Histogram(
+    "snoop_http_request_seconds",
+    "Time to handle an HTTP request, from the outermost middleware to the response",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+HTTP_REQUESTS = Counter(
+    "snoop_http_requests_total",
+    "HTTP requests by method, route and status code",
+    ["method", "route", "status"],
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "snoop_http_requests_in_progress",
+    "HTTP requests currently being handled",
+    ["method"],
+)
+
+# --- リクエストごとのSQL文（query_stats.py） ---
+# route はパスのテンプレート（/habits/{habit_id} など）。どのルートにも一致しなかったリクエストは "unmatched"
+DB_QUERIES_PER_REQUEST = Histogram(
+    "snoop_db_queries_per_request",
+    "Number of SQL statements executed while handling a request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 4, 5, 7, 10, 15, 20, 30, 50, 100),
+)
+DB_QUERY_SECONDS_PER_REQUEST = Histogram(
+    "snoop_db_query_seconds_per_request",
+    "Total time spent executing SQL statements while handling a request",
+    ["route"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+DB_REPEATED_QUERY_REQUESTS = Counter(
+    "snoop_db_repeated_query_requests_total",
+    "Requests that executed the same statement shape at least QUERY_REPEAT_THRESHOLD times (suspected N+1)",
+    ["route"],
+)
+
+# --- 認証キャッシュ ---
+AUTH_CACHE_REQUESTS = Counter(
+    "snoop_auth_cache_requests_total",
+    "Principal cache lookups in get_current_user",
+    ["result"],
+)
+AUTH_CACHE_EVICTIONS = Counter(
+    "snoop_auth_cache_evictions_total",
+    "Principal cache entries evicted because the cache was full",
+)
+AUTH_CACHE_SIZE = Gauge(
+    "snoop_auth_cache_size",
+    "Number of entries in the principal cache",
+)
+
+# --- パスワードのハッシュ化 ---
+PASSWORD_HASH_QUEUE_DEPTH = Gauge(
+    "snoop_password_hash_queue_depth",
+    "bcrypt jobs submitted to the hashing pool and not yet finished",
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "snoop_password_hash_seconds",
+    "Time to hash or verify a password, including time queued in the hashing pool",
+    ["operation"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+# --- 通知スケジューラ ---
+SCHEDULER_IS_LEADER = Gauge(
+    "snoop_scheduler_is_leader",
+    "1 if this process currently holds the scheduler leader lock",
+)
+SCHEDULER_LEADER_TRANSITIONS = Counter(
+    "snoop_scheduler_leader_transitions_total",
+    "Number of times this process acquired or lost scheduler leadership",
+    ["event"],
+)
+SCHEDULER_TICK_SECONDS = Histogram(
+    "snoop_scheduler_tick_seconds",
+    "Duration of notification scheduler ticks",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120),
+)
+SCHEDULER_TICK_BUDGET_WARNINGS = Counter(
+    "snoop_scheduler_tick_budget_warnings_total",
+    "Ticks whose duration crossed the warning threshold or the full interval",
+    ["level"],
+)
+SCHEDULER_TICK_SKIPPED = Counter(
+    "snoop_scheduler_tick_skipped_total",
+    "Ticks skipped because the previous tick was still running",
+)
+SCHEDULER_REMINDERS_DUE = Counter(
+    "snoop_scheduler_reminders_due_total",
+    "Notifications found due by the scheduler tick (including those skipped for lack of an FCM token)",
+)
+SCHEDULER_TICK_LAG = Gauge(
+    "snoop_scheduler_tick_lag_seconds",
+    "Time between the previous completed tick's high-water mark and the start of the current tick",
+)
+
+# --- 通知のアウトボックス ---
+OUTBOX_ENQUEUED = Counter(
+    "snoop_outbox_enqueued_total",
+    "Reminders enqueued into the notification outbox by the scheduler tick",
+)
+# partition は分割したディスパッチャーの番号（分割していない場合は "all"）
+OUTBOX_DELIVERIES = Counter(
+    "snoop_outbox_deliveries_total",
+    "Outcome of outbox delivery attempts",
+    ["partition", "result"],
+)
+OUTBOX_DELIVERY_LAG = Histogram(
+    "snoop_outbox_delivery_lag_seconds",
+    "Time between a reminder's scheduled time and its successful delivery",
+    ["partition"],
+    buckets=(0.5, 1, 2, 5, 10, 30, 60, 120, 300, 900, 3600),
+)
+OUTBOX_BATCH_SECONDS = Histogram(
+    "snoop_outbox_batch_seconds",
+    "Time to claim, send and record one outbox batch",
+    ["partition"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+OUTBOX_BATCH_SIZE = Histogram(
+    "snoop_outbox_batch_size",
+    "Number of outbox rows claimed per batch",
+    ["partition"],
+    buckets=(1, 10, 50, 100, 250, 500, 1000),
+)
+
+# --- FCM ---
+FCM_BATCH_SECONDS = Histogram(
+    "snoop_fcm_batch_seconds",
+    "Time for one send_batch call to FCM (or the fake transport)",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+# code は FCM のエラーコード（UNREGISTERED・UNAVAILABLE など）。バッチ全体の失敗は例外のクラス名
+FCM_ERRORS = Counter(
+    "snoop_fcm_errors_total",
+    "Messages FCM failed to deliver, by error code",
+    ["code"],
+)
+
+# --- メールのアウトボックス（email_sender.py） ---
+EMAIL_DELIVERIES = Counter(
+    "snoop_email_deliveries_total",
+    "Outcome of email outbox delivery attempts",
+    ["result"],
+)
+EMAIL_DELIVERY_LAG = Histogram(
+    "snoop_email_delivery_lag_seconds",
+    "Time between an email being enqueued and its successful delivery",
+    buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 300, 900, 3600),
+)
+EMAIL_SMTP_CONNECTIONS = Counter(
+    "snoop_email_smtp_connections_total",
+    "SMTP connections opened by the email sender (lower is better; connections are pooled)",
+)
+EMAIL_THROTTLE_WAIT = Histogram(
+    "snoop_email_throttle_wait_seconds",
+    "Time an email waited for the send rate limiter",
+    buckets=(0, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
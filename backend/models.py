@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, Date, TIMESTAMP, Time, Text, UniqueConstraint 
+from sqlalchemy import Column, Integer, BigInteger, Float, String, ForeignKey, Boolean, Date, TIMESTAMP, Time, Text, UniqueConstraint, Index, func, text
 from sqlalchemy.orm import relationship
 from database import Base  
 from datetime import datetime, timezone
@@ -15,6 +15,9 @@ class User(Base):
     is_verified = Column(Boolean, default=False, nullable=False)
     verification_code = Column(String, nullable=True, unique=True)
     verification_code_expires_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+    # 通知をユーザーのローカル時刻で送るためのIANAタイムゾーン
+    timezone = Column(String, nullable=False, default="Asia/Tokyo", server_default="Asia/Tokyo")
     
     habits = relationship("Habit", back_populates="user")
     notifications = relationship("Notification", back_populates="user")
@@ -22,20 +25,28 @@ class User(Base):
 class Habit(Base):
     __tablename__ = "habits"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     name = Column(String, nullable=False)
     description = Column(Text)
     created_at = Column(TIMESTAMP, nullable=False)
+
+    # 連続達成日数のキャッシュ。current_streak は last_completed_date で終わる連続日数で、
+    # last_completed_date が昨日より前であれば、その連続記録はすでに途切れている
+    current_streak = Column(Integer, nullable=False, default=0, server_default="0")
+    longest_streak = Column(Integer, nullable=False, default=0, server_default="0")
+    last_completed_date = Column(Date, nullable=True)
+
     user = relationship("User", back_populates="habits")
-    habit_records = relationship("HabitRecord", back_populates="habit")
-    notifications = relationship("Notification", back_populates="habit")
-    goals = relationship("Goal", back_populates="habit", cascade="all, delete-orphan")
+    # 習慣を削除すると、記録・通知・目標はデータベース側（ON DELETE CASCADE）で削除される
+    habit_records = relationship("HabitRecord", back_populates="habit", passive_deletes=True)
+    notifications = relationship("Notification", back_populates="habit", passive_deletes=True)
+    goals = relationship("Goal", back_populates="habit", cascade="all, delete-orphan", passive_deletes=True)
 
 class HabitRecord(Base):
     __tablename__ = "habit_records"
     
     id = Column(Integer, primary_key=True, index=True)
-    habit_id = Column(Integer, ForeignKey("habits.id"), nullable=False)
+    habit_id = Column(Integer, ForeignKey("habits.id", ondelete="CASCADE"), nullable=False)
     date = Column(Date, nullable=False)
     status = Column(Boolean, nullable=False, default=False)
     habit = relationship("Habit", back_populates="habit_records")
@@ -46,22 +57,94 @@ class Notification(Base):
     __tablename__ = "notifications"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    habit_id = Column(Integer, ForeignKey("habits.id"), nullable=False)
+    habit_id = Column(Integer, ForeignKey("habits.id", ondelete="CASCADE"), nullable=False)
     time = Column(Time, nullable=False)
     enabled = Column(Boolean, default=True)
+    # 次回の送信時刻（UTC）。無効化されている通知は NULL
+    next_fire_at = Column(TIMESTAMP(timezone=True), nullable=True, index=True)
     user = relationship("User", back_populates="notifications")
     habit = relationship("Habit", back_populates="notifications")
+
+class NotificationOutbox(Base):
+    """
+    送信待ちのリマインダー。通知ティックが期限の来た通知をここに積み、ディスパッチャーが取り出して送信する。
+    送信に成功した行は削除し、再送の上限に達した行や再送しても成功しない行は status="dead" として残す。
+    """
+    __tablename__ = "notification_outbox"
+
+    id = Column(BigInteger, primary_key=True)
+    notification_id = Column(Integer, ForeignKey("notifications.id", ondelete="CASCADE"), nullable=False)
+    # 通知の所有者。ディスパッチャーを user_id で分割（user_id % K）して動かすときに使う
+    user_id = Column(Integer, nullable=False)
+    # 本来の送信時刻（同じ通知の同じ回を二重に積まないための一意キーにも使う）
+    scheduled_for = Column(TIMESTAMP(timezone=True), nullable=False)
+    status = Column(String, nullable=False, server_default="pending")  # "pending" | "dead"
+    attempts = Column(Integer, nullable=False, server_default="0")
+    # 次に送信を試みる時刻。ディスパッチャーが確保している間は、確保の期限（リース）になる
+    next_attempt_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    last_error = Column(Text, nullable=True)
+    # 行を積んだ通知ティックの相関ID。ディスパッチャーの送信ログに引き継ぐ
+    correlation_id = Column(String(64), nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('notification_id', 'scheduled_for', name='_outbox_notification_scheduled_uc'),
+        Index('ix_notification_outbox_pending', 'next_attempt_at', postgresql_where=text("status = 'pending'")),
+    )
     
 class Goal(Base):
     __tablename__ = "goals"
 
     id = Column(Integer, primary_key=True, index=True)
-    habit_id = Column(Integer, ForeignKey("habits.id"), nullable=False)
+    habit_id = Column(Integer, ForeignKey("habits.id", ondelete="CASCADE"), nullable=False, index=True)
     
     target_count = Column(Integer, nullable=False) 
     start_date = Column(Date, nullable=False)     
     end_date = Column(Date, nullable=False)       
 
+    # 期間内に達成した日数。habit_records の追加・変更のたびに crud で増減させる
+    current_count = Column(Integer, nullable=False, default=0, server_default="0")
+    is_achieved = Column(Boolean, nullable=False, default=False, server_default="false")
+
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
 
-    habit = relationship("Habit", back_populates="goals")
\ No newline at end of file
+    habit = relationship("Habit", back_populates="goals")
+
+class EmailOutbox(Base):
+    """
+    送信待ちのメール（認証コードなど）。ユーザーの作成・更新と同じトランザクションで積み、
+    email_sender がSMTPで送信する。送信に成功した行は削除し、再送の上限に達した行などは status="dead" として残す。
+    """
+    __tablename__ = "email_outbox"
+
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    to_address = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String, nullable=False, server_default="pending")  # "pending" | "dead"
+    attempts = Column(Integer, nullable=False, server_default="0")
+    # 次に送信を試みる時刻。送信側が確保している間は、確保の期限（リース）になる
+    next_attempt_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    last_error = Column(Text, nullable=True)
+    # メールを積んだリクエストの相関ID。送信側のログに引き継ぐ
+    correlation_id = Column(String(64), nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
+    user = relationship("User")
+
+    __table_args__ = (
+        Index('ix_email_outbox_pending', 'next_attempt_at', postgresql_where=text("status = 'pending'")),
+    )
+
+class SchedulerState(Base):
+    """
+    定期実行されるジョブの進み具合。high_water_mark は最後に完了したティックの基準時刻で、
+    次のティックはそれ以降に期限が来たものをすべて処理する。
+    """
+    __tablename__ = "scheduler_state"
+
+    name = Column(String, primary_key=True)
+    high_water_mark = Column(TIMESTAMP(timezone=True), nullable=False)
+    last_duration_seconds = Column(Float, nullable=True)
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
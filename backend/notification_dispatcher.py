@@ -0,0 +1,266 @@
+# notification_dispatcher.py
+# notification_outbox に積まれたリマインダーを取り出して送信するディスパッチャー。
+# 行の確保は SELECT ... FOR UPDATE SKIP LOCKED で行うため、スレッド・プロセス・ホストをいくつ並べても
+# 同じリマインダーを二重に送らない。送信に失敗した行は指数バックオフで再送し、上限に達したら dead にする。
+#
+# API のプロセスの中ではスケジューラから drain_outbox を定期的に実行する。
+# 送信量が多い場合は、別のプロセスとして起動して台数を増やす。
+# --partitions K を指定すると、アウトボックスを user_id % K で K 個に分け、それぞれを別のプロセスで処理する
+# （メッセージの組み立てやTLSの処理がプロセスごとに並列になる）。ホストをまたいで分ける場合は
+# --partition で担当する番号を指定して、インスタンスごとに1つずつ起動する。
+# 分割する場合は、API のワーカーがパーティションを区別せずに送信しないよう、API とディスパッチャーの両方で
+# NOTIFICATION_DISPATCHER_IN_PROCESS=false にし、NOTIFICATION_DISPATCHER_PARTITIONS も揃えておく:
+#     python notification_dispatcher.py --workers 4
+#     python notification_dispatcher.py --partitions 4 --metrics-port 9100
+#     python notification_dispatcher.py --partitions 4 --partition 0
+
+import argparse
+import logging
+import multiprocessing
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional
+
+import crud
+import fcm_dispatcher
+import log_setup
+import metrics
+from database import SessionLocal
+from settings import settings
+
+logger = logging.getLogger(__name__)
+# リマインダー1件ごとの送信ログ。件数が多いので LOG_SAMPLE_RATES で間引く
+delivery_logger = logging.getLogger(f"{__name__}.delivery")
+
+
+def _partition_label(partition: Optional[int], partitions: int) -> str:
+    return str(partition) if partition is not None and partitions > 1 else "all"
+
+
+def dispatch_outbox_batch(
+    transport=None, batch_size: int = None, partition: Optional[int] = None, partitions: int = 1
+) -> int:
+    """
+    送信待ちの行を1バッチ分確保して送信し、結果を記録する。確保した行の数を返す（0 なら送信待ちの行はない）。
+    transport を渡すと、FCMの代わりにそのトランスポート（FakeTransportなど）で送信する。
+    partition を指定すると、user_id % partitions == partition の行だけを処理する。
+    バッチのログにはバッチごとの相関IDを、1件ごとの送信ログには行を積んだティックの相関IDを付ける。
+    """
+    batch_size = batch_size or settings.outbox_batch_size
+    label = _partition_label(partition, partitions)
+    started = time.perf_counter()
+    with log_setup.correlation_scope():
+        db = SessionLocal()
+        try:
+            rows = crud.claim_outbox_batch(
+                db,
+                now=datetime.now(timezone.utc),
+                batch_size=batch_size,
+                lease_seconds=settings.outbox_lease_seconds,
+                max_attempts=settings.outbox_max_attempts,
+                partition=partition,
+                partitions=partitions,
+            )
+            if not rows:
+                return 0
+
+            sendable = [row for row in rows if row.fcm_token]
+            results = fcm_dispatcher.dispatch_reminders(
+                [
+                    fcm_dispatcher.Reminder(user_id=row.user_id, fcm_token=row.fcm_token, habit_name=row.habit_name)
+                    for row in sendable
+                ],
+                transport=transport,
+                batch_size=batch_size,
+            )
+
+            now = datetime.now(timezone.utc)
+            sent_ids = []
+            # 確保した後にユーザーがトークンを削除した場合は、再送しても届かない
+            failures = [(row.outbox_id, "No FCM token", True) for row in rows if not row.fcm_token]
+            invalid_tokens = set()
+            # 送信ログは extra の辞書や LogRecord を作る前に間引く
+            log_rate = log_setup.sample_rate(delivery_logger)
+            for row, result in zip(sendable, results):
+                lag = (now - row.scheduled_for).total_seconds()
+                if result.success:
+                    sent_ids.append(row.outbox_id)
+                    metrics.OUTBOX_DELIVERY_LAG.labels(label).observe(lag)
+                else:
+                    failures.append((row.outbox_id, result.error or "unknown error", result.token_invalid))
+                    if result.token_invalid:
+                        invalid_tokens.add(result.fcm_token)
+                if log_rate and random.random() < log_rate:
+                    delivery_logger.info(
+                        "Reminder sent" if result.success else "Reminder failed",
+                        extra={
+                            "correlation_id": row.correlation_id,
+                            "outbox_id": row.outbox_id,
+                            "user_id": row.user_id,
+                            "partition": label,
+                            "lag_seconds": round(lag, 3),
+                            "error": result.error,
+                        },
+                    )
+
+            dead = crud.finish_outbox_batch(
+                db,
+                sent_ids=sent_ids,
+                failures=failures,
+                now=now,
+                max_attempts=settings.outbox_max_attempts,
+                backoff_base_seconds=settings.outbox_backoff_base_seconds,
+                backoff_max_seconds=settings.outbox_backoff_max_seconds,
+            )
+            metrics.OUTBOX_DELIVERIES.labels(label, "sent").inc(len(sent_ids))
+            metrics.OUTBOX_DELIVERIES.labels(label, "retry").inc(len(failures) - dead)
+            metrics.OUTBOX_DELIVERIES.labels(label, "dead").inc(dead)
+            metrics.OUTBOX_BATCH_SIZE.labels(label).observe(len(rows))
+            metrics.OUTBOX_BATCH_SECONDS.labels(label).observe(time.perf_counter() - started)
+            if failures:
+                logger.warning(
+                    "Outbox batch had failures", extra={
+                        "partition": label,
+                        "sent": len(sent_ids),
+                        "retry": len(failures) - dead,
+                        "dead": dead,
+                    },
+                )
+
+            # 無効・未登録のトークンはまとめて削除する
+            if invalid_tokens:
+                cleared = crud.clear_fcm_tokens(db, invalid_tokens)
+                logger.info("Cleared %d invalid FCM tokens.", cleared)
+            return len(rows)
+        finally:
+            db.close()
+
+
+def drain_outbox(
+    transport=None, batch_size: int = None, partition: Optional[int] = None, partitions: int = 1
+) -> int:
+    """送信時刻を過ぎた送信待ちの行がなくなるまでバッチの送信を繰り返し、確保した行の合計を返す"""
+    total = 0
+    while True:
+        claimed = dispatch_outbox_batch(
+            transport=transport, batch_size=batch_size, partition=partition, partitions=partitions
+        )
+        if not claimed:
+            return total
+        total += claimed
+
+
+def run_workers(
+    workers: int,
+    stop_event: threading.Event,
+    transport=None,
+    poll_seconds: float = None,
+    batch_size: int = None,
+    partition: Optional[int] = None,
+    partitions: int = 1,
+):
+    """
+    workers 個のスレッドでアウトボックスを処理し続ける。stop_event がセットされるまで戻らない。
+    送信待ちの行がなくなったスレッドは poll_seconds 秒待ってから再び確認する。
+    """
+    poll_seconds = poll_seconds if poll_seconds is not None else settings.notification_dispatcher_poll_seconds
+
+    def _worker():
+        while not stop_event.is_set():
+            try:
+                claimed = dispatch_outbox_batch(
+                    transport=transport, batch_size=batch_size, partition=partition, partitions=partitions
+                )
+            except Exception:
+                logger.exception("Outbox dispatcher error")
+                claimed = 0
+            if not claimed:
+                stop_event.wait(poll_seconds)
+
+    label = _partition_label(partition, partitions)
+    threads = [
+        threading.Thread(target=_worker, name=f"outbox-dispatcher-{label}-{i}", daemon=True)
+        for i in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_partition(
+    partition: Optional[int],
+    partitions: int,
+    workers: int,
+    poll_seconds: float,
+    batch_size: int,
+    metrics_port: Optional[int] = None,
+):
+    """
+    1つのパーティションを処理し続ける（ProcessPoolExecutor の子プロセス、または単独のインスタンスで実行する）。
+    metrics_port を指定すると、このプロセスのメトリクスを metrics_port + partition で公開する。
+    """
+    log_setup.configure()
+    import firebase  # noqa: F401  Firebase Admin SDK を初期化する
+
+    if metrics_port:
+        from prometheus_client import start_http_server
+        start_http_server(metrics_port + (partition or 0))
+
+    label = _partition_label(partition, partitions)
+    logger.info("Starting outbox dispatcher for partition %s with %d workers", label, workers)
+    stop_event = threading.Event()
+    try:
+        run_workers(
+            workers, stop_event, poll_seconds=poll_seconds, batch_size=batch_size,
+            partition=partition, partitions=partitions,
+        )
+    except KeyboardInterrupt:
+        stop_event.set()
+        logger.info("Outbox dispatcher for partition %s stopped.", label)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deliver reminders from the notification outbox.")
+    parser.add_argument("--workers", type=int, default=settings.notification_dispatcher_workers, help="threads per partition")
+    parser.add_argument("--batch-size", type=int, default=settings.outbox_batch_size)
+    parser.add_argument("--poll-seconds", type=float, default=settings.notification_dispatcher_poll_seconds)
+    parser.add_argument("--partitions", type=int, default=settings.notification_dispatcher_partitions, help="split the outbox by user_id %% K")
+    parser.add_argument("--partition", type=int, help="only run this partition (for one instance per partition)")
+    parser.add_argument("--metrics-port", type=int, help="expose Prometheus metrics on this port + partition")
+    args = parser.parse_args()
+    if args.partitions < 1:
+        parser.error("--partitions must be at least 1")
+    if args.partition is not None and not 0 <= args.partition < args.partitions:
+        parser.error(f"--partition must be between 0 and {args.partitions - 1}")
+    if args.partitions > 1 and settings.notification_dispatcher_in_process:
+        # API のワーカーの drain_outbox はパーティションを区別せずに確保するため、分割した意味がなくなる
+        parser.error("--partitions > 1 requires NOTIFICATION_DISPATCHER_IN_PROCESS=false (for the API workers as well)")
+    log_setup.configure()
+
+    options = dict(
+        partitions=args.partitions,
+        workers=args.workers,
+        poll_seconds=args.poll_seconds,
+        batch_size=args.batch_size,
+        metrics_port=args.metrics_port,
+    )
+    if args.partition is not None or args.partitions <= 1:
+        run_partition(args.partition, **options)
+        return
+
+    # 各パーティションを別のプロセスで実行する（スレッドを持つ親プロセスを fork しないよう spawn を使う）
+    with ProcessPoolExecutor(max_workers=args.partitions, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(run_partition, partition, **options) for partition in range(args.partitions)]
+        try:
+            for future in futures:
+                future.result()
+        except KeyboardInterrupt:
+            logger.info("Outbox dispatcher stopped.")
+
+
+if __name__ == "__main__":
+    main()
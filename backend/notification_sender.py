@@ -1,61 +1,129 @@
 # notification_sender.py
 
+import logging
+import threading
+import time
 from datetime import datetime, timezone
 from sqlalchemy.orm import Session
-from firebase_admin import messaging
 
 import crud
+import log_setup
+import metrics
+import query_stats
 from database import SessionLocal
+from leader_election import scheduler_leader
+from settings import settings
 
-def send_scheduled_notifications():
+logger = logging.getLogger(__name__)
+
+# scheduler_state に記録するジョブ名
+TICK_JOB_NAME = "notification_tick"
+
+# 同じプロセスの中でティックが重ならないようにするロック
+_tick_lock = threading.Lock()
+
+def enqueue_scheduled_notifications():
     """
-    現在の時刻に合致する通知設定をデータベースから探し、
-    FCMプッシュ通知を送信する関数。
-    スケジューラによって定期的に実行される。
+    送信時刻（next_fire_at）を過ぎた通知設定をデータベースから確保し、
+    送信待ちのリマインダーとして notification_outbox に積む関数。
+    スケジューラによって定期的に実行される。実際の送信は notification_dispatcher が行う。
+
+    前回のティックが終わっていない場合は何もしない。next_fire_at が現在時刻以前のものをすべて対象にするため、
+    ティックが遅れたり飛ばされたりしても、次のティックがその間に期限の来た通知をまとめて処理する。
     """
-    print(f"[{datetime.now()}] Running notification check...")
+    if not _tick_lock.acquire(blocking=False):
+        metrics.SCHEDULER_TICK_SKIPPED.inc()
+        logger.warning("Previous notification tick is still running; skipping this tick.")
+        return
+    try:
+        # リクエストと同じく、ティックで実行したSQL文の数と時間を数え、ティックごとに相関IDを割り当てる
+        with query_stats.track(), log_setup.correlation_scope() as correlation_id:
+            _run_tick(correlation_id)
+    finally:
+        _tick_lock.release()
+
+def _run_tick(correlation_id: str):
+    logger.debug("Running notification check")
+    started = time.perf_counter()
+    budget = settings.scheduler_tick_interval_seconds
+    warn_after = budget * settings.scheduler_tick_warn_ratio
+    warned = False
 
     # バックグラウンドタスクでは、このように手動でDBセッションを管理する
     db: Session = SessionLocal()
 
     try:
-        # 現在の時刻（時:分）を取得
-        # サーバーのタイムゾーンに依存しないようにUTCで比較するのが望ましいが、
-        # 簡単のため、サーバーのローカル時刻で比較する
-        current_time = datetime.now().strftime("%H:%M")
+        # 送信時刻はユーザーごとのタイムゾーンから計算したUTCで保存されているので、UTCの現在時刻と比較する
+        now = datetime.now(timezone.utc)
 
-        # 現在の時刻に設定されている、有効な通知を取得
-        notifications_to_send = crud.get_notifications_by_time(db, time_str=current_time)
+        # 前回完了したティックからの経過時間。間隔より大きく空いていれば、その間の分もこのティックで処理する
+        high_water_mark = crud.get_scheduler_high_water_mark(db, TICK_JOB_NAME)
+        if high_water_mark is not None:
+            lag = (now - high_water_mark).total_seconds()
+            metrics.SCHEDULER_TICK_LAG.set(lag)
+            if lag > 2 * budget:
+                logger.warning(
+                    "Catching up %.1f minutes since the last completed tick", lag / 60,
+                    extra={"high_water_mark": high_water_mark.isoformat(), "lag_seconds": round(lag, 1)},
+                )
 
-        if not notifications_to_send:
-            print(f"No notifications to send at {current_time}.")
-            return
+        found = 0
+        enqueued = 0
+        while True:
+            # 期限を過ぎた通知を1チャンク分確保して次回の送信時刻へ進め、アウトボックスに積む
+            claimed, added = crud.enqueue_due_reminders(db, now=now, correlation_id=correlation_id)
+            if not claimed:
+                break
+            found += claimed
+            enqueued += added
 
-        print(f"Found {len(notifications_to_send)} notifications to send at {current_time}.")
+            # 間隔を超える前に警告する（チャンクごとに確保した分はコミット済みなので、超えても取りこぼしはない）
+            elapsed = time.perf_counter() - started
+            if not warned and elapsed > warn_after:
+                warned = True
+                metrics.SCHEDULER_TICK_BUDGET_WARNINGS.labels("warning").inc()
+                logger.warning(
+                    "Notification tick has run for %.1fs of its %ds budget", elapsed, budget,
+                    extra={"claimed_so_far": found},
+                )
 
-        for notif in notifications_to_send:
-            # ユーザーがFCMトークンを持っているか確認
-            if notif.user and notif.user.fcm_token:
-                print(f"  - Sending notification for habit '{notif.habit.name}' to user {notif.user.id}")
+        duration = time.perf_counter() - started
+        crud.advance_scheduler_high_water_mark(db, TICK_JOB_NAME, now, duration)
+        metrics.SCHEDULER_TICK_SECONDS.observe(duration)
+        if duration > budget:
+            metrics.SCHEDULER_TICK_BUDGET_WARNINGS.labels("overrun").inc()
+            logger.warning("Notification tick took %.1fs, longer than its %ds interval", duration, budget)
 
-                # FCMメッセージの作成
-                message = messaging.Message(
-                    notification=messaging.Notification(
-                        title=f"今日の習慣リマインダー！",
-                        body=f"「{notif.habit.name}」の時間ですよ！頑張りましょう！"
-                    ),
-                    token=notif.user.fcm_token,
-                )
+        if not found:
+            logger.debug("No notifications due", extra={"now": now.isoformat()})
+            return
 
-                # メッセージの送信
-                try:
-                    response = messaging.send(message)
-                    print(f"    Successfully sent message: {response}")
-                except Exception as e:
-                    print(f"    Error sending message for user {notif.user.id}: {e}")
-            else:
-                print(f"  - Skipping user {notif.user.id}: No FCM token found.")
+        metrics.SCHEDULER_REMINDERS_DUE.inc(found)
+        metrics.OUTBOX_ENQUEUED.inc(enqueued)
+        stats = query_stats.current()
+        logger.info(
+            "Enqueued %d/%d due notifications", enqueued, found,
+            extra={
+                "now": now.isoformat(),
+                "due": found,
+                "enqueued": enqueued,
+                # FCMトークンのないユーザーの通知は積まない
+                "skipped_no_token": found - enqueued,
+                "duration_seconds": round(duration, 3),
+                "db_queries": stats.count,
+                "db_seconds": round(stats.total_seconds, 3),
+            },
+        )
 
     finally:
         # 忘れずにDBセッションを閉じる
-        db.close()
\ No newline at end of file
+        db.close()
+
+def enqueue_scheduled_notifications_as_leader():
+    """
+    リーダーに選ばれているプロセスでだけ enqueue_scheduled_notifications を実行する。
+    すべてのワーカーのスケジューラから毎分呼び出され、スタンバイでは何もしない。
+    """
+    if not scheduler_leader.is_leader:
+        return
+    enqueue_scheduled_notifications()
@@ -0,0 +1,135 @@
+# password_hashing.py
+# bcrypt によるパスワードのハッシュ化・検証を、専用のプロセスプールで実行するサービス。
+# bcrypt は1回あたり数百ミリ秒CPUを使い、その間GILを保持するため、リクエストを処理する
+# ワーカーの中で実行すると、ログインが集中したときに他のエンドポイントが止まってしまう。
+
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+import metrics
+from settings import settings
+
+
+def make_crypt_context(rounds: int) -> CryptContext:
+    """
+    指定したコストで bcrypt を使う CryptContext を作る。
+    min_rounds / max_rounds も同じ値にしておくことで、コストの異なる既存のハッシュは
+    verify_and_update で再ハッシュの対象になる。
+    """
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+# --- プロセスプールのワーカー側で実行される関数 ---
+_worker_context: Optional[CryptContext] = None
+
+def _init_worker(rounds: int):
+    global _worker_context
+    _worker_context = make_crypt_context(rounds)
+
+def _hash_in_worker(password: str) -> str:
+    return _worker_context.hash(password)
+
+def _verify_and_update_in_worker(password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    return _worker_context.verify_and_update(password, hashed_password)
+
+
+class PasswordHasher:
+    """
+    パスワードのハッシュ化サービス。
+    pool_size が 0 の場合はプロセスプールを使わず、呼び出し元のスレッドで実行する。
+    """
+
+    def __init__(self, rounds: int, pool_size: int):
+        self.rounds = rounds
+        self.pool_size = pool_size
+        self.context = make_crypt_context(rounds)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        """プロセスプールを初回の利用時に起動する"""
+        if self.pool_size <= 0:
+            return None
+        with self._lock:
+            if self._executor is None:
+                # スケジューラなどのスレッドを持つプロセスを fork しないよう、spawn で起動する
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.pool_size,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.rounds,),
+                )
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _submit(self, operation: str, fn, *args) -> Future:
+        """プールに処理を投入し、キューの深さと処理時間をメトリクスに記録する"""
+        metrics.PASSWORD_HASH_QUEUE_DEPTH.inc()
+        start = time.perf_counter()
+        future = self._get_executor().submit(fn, *args)
+
+        def _done(_):
+            metrics.PASSWORD_HASH_QUEUE_DEPTH.dec()
+            metrics.PASSWORD_HASH_SECONDS.labels(operation).observe(time.perf_counter() - start)
+
+        future.add_done_callback(_done)
+        return future
+
+    def _run_inline(self, operation: str, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            metrics.PASSWORD_HASH_SECONDS.labels(operation).observe(time.perf_counter() - start)
+
+    # --- 非同期API ---
+    async def hash(self, password: str) -> str:
+        """パスワードをハッシュ化する"""
+        if self._get_executor() is None:
+            return await asyncio.to_thread(self._run_inline, "hash", self.context.hash, password)
+        return await asyncio.wrap_future(self._submit("hash", _hash_in_worker, password))
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+        """
+        パスワードを検証する。検証に成功し、ハッシュのコストが設定と異なる場合は
+        新しいハッシュを2つ目の値として返す（呼び出し側で保存する）。
+        """
+        if self._get_executor() is None:
+            return await asyncio.to_thread(
+                self._run_inline, "verify", self.context.verify_and_update, password, hashed_password
+            )
+        return await asyncio.wrap_future(
+            self._submit("verify", _verify_and_update_in_worker, password, hashed_password)
+        )
+
+    # --- 同期API（同期のエンドポイントやスクリプトから使う。プールの処理中はGILを解放して待つ） ---
+    def hash_sync(self, password: str) -> str:
+        if self._get_executor() is None:
+            return self._run_inline("hash", self.context.hash, password)
+        return self._submit("hash", _hash_in_worker, password).result()
+
+    def verify_sync(self, password: str, hashed_password: str) -> bool:
+        if self._get_executor() is None:
+            return self._run_inline("verify", self.context.verify, password, hashed_password)
+        verified, _ = self._submit("verify", _verify_and_update_in_worker, password, hashed_password).result()
+        return verified
+
+
+hasher = PasswordHasher(rounds=settings.bcrypt_rounds, pool_size=settings.password_hash_pool_size)
@@ -0,0 +1,119 @@
+# query_stats.py
+# リクエスト（や通知のティック）ごとに実行したSQL文の数と合計時間を数える。
+# エンジンの before_cursor_execute / after_cursor_execute イベントで計測し、contextvars で処理単位に集計する。
+# 同じ形のSQL文（パラメータの値だけが違う文）が何度も実行された場合は N+1 の疑いとして検出する。
+
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from settings import settings
+
+# IN (...) の展開などで並んだプレースホルダーは、個数によらず同じ形として扱う
+_PLACEHOLDER_LIST = re.compile(r"(?:%\(\w+\)s|\$\d+|\?)(?:\s*,\s*(?:%\(\w+\)s|\$\d+|\?))+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """SQL文を、繰り返しの検出に使う形に正規化する"""
+    return _PLACEHOLDER_LIST.sub("…", _WHITESPACE.sub(" ", statement).strip())
+
+
+@dataclass
+class QueryStats:
+    """1つの処理単位で実行したSQL文の集計。入れ子にした場合は、外側（parent）の集計にも加算する"""
+    count: int = 0
+    total_seconds: float = 0.0
+    shapes: Counter = field(default_factory=Counter)
+    parent: Optional["QueryStats"] = field(default=None, repr=False)
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.total_seconds += seconds
+        self.shapes[statement_shape(statement)] += 1
+        if self.parent is not None:
+            self.parent.record(statement, seconds)
+
+    def repeated(self, threshold: Optional[int] = None) -> list[tuple[str, int]]:
+        """threshold 回以上実行された同じ形のSQL文と、その回数を返す（N+1 の疑い）"""
+        threshold = threshold or settings.query_repeat_threshold
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= threshold]
+
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def current() -> Optional[QueryStats]:
+    """計測中の処理単位の集計を返す（計測していなければ None）"""
+    return _current.get()
+
+
+@contextmanager
+def track() -> Iterator[QueryStats]:
+    """
+    このブロックの中で実行したSQL文を集計する。
+    スレッドプールで実行される同期のエンドポイントにもコンテキストが引き継がれ、同じ集計に加算される。
+    外側の track() の中で呼び出した場合は、外側の集計にも加算される（テストの query_budget の中のリクエストなど）。
+    """
+    stats = QueryStats(parent=_current.get())
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """クエリの予算を超えた、または同じ形のSQL文が繰り返された"""
+
+
+@contextmanager
+def query_budget(max_queries: int, max_repeats: Optional[int] = None) -> Iterator[QueryStats]:
+    """
+    このブロックで実行したSQL文が max_queries 件を超えたら QueryBudgetExceeded を送出する。
+    max_repeats を指定すると、同じ形のSQL文がそれより多く実行された場合も送出する。
+    """
+    with track() as stats:
+        yield stats
+    problems = []
+    if stats.count > max_queries:
+        problems.append(f"{stats.count} queries (budget {max_queries})")
+    if max_repeats is not None:
+        problems.extend(f"{n}x {shape}" for shape, n in stats.repeated(max_repeats + 1))
+    if problems:
+        raise QueryBudgetExceeded("; ".join(problems))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_stats_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    started = conn.info.get("query_stats_started")
+    if stats is None or not started:
+        return
+    stats.record(statement, time.perf_counter() - started.pop())
+
+
+def _handle_error(exception_context):
+    # 失敗した文は after_cursor_execute が呼ばれないので、開始時刻だけを捨てる
+    conn = exception_context.connection
+    started = conn.info.get("query_stats_started") if conn is not None else None
+    if started:
+        started.pop()
+
+
+def instrument(engine: Engine):
+    """エンジンにSQL文の計測を登録する（非同期エンジンは sync_engine を渡す）"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
@@ -0,0 +1,38 @@
+"""
+目標の達成数（goals.current_count / goals.is_achieved）を habit_records から再計算するスクリプト。
+カウンタがずれた場合や、データを直接投入した後に実行する。
+
+使い方:
+    python rebuild_goal_counters.py
+    python rebuild_goal_counters.py --habit-id 1 --habit-id 2
+"""
+
+import argparse
+
+from sqlalchemy import distinct, select
+
+import crud
+import models
+from database import SessionLocal
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild goal progress counters from habit_records.")
+    parser.add_argument("--habit-id", type=int, action="append", dest="habit_ids", help="only rebuild goals of this habit (repeatable)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="number of habits processed per transaction")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        habit_ids = args.habit_ids
+        if habit_ids is None:
+            habit_ids = db.scalars(select(distinct(models.Goal.habit_id)).order_by(models.Goal.habit_id)).all()
+
+        total = 0
+        for i in range(0, len(habit_ids), args.batch_size):
+            total += crud.rebuild_goal_counters(db, habit_ids=habit_ids[i:i + args.batch_size])
+        print(f"Rebuilt counters for {total} goals across {len(habit_ids)} habits.")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
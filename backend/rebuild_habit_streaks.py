@@ -0,0 +1,40 @@
+"""
+習慣の連続達成日数（habits.current_streak / longest_streak / last_completed_date）を
+habit_records から再計算するスクリプト。
+連続達成日数のカラムを追加するマイグレーションの後や、データを直接投入した後に実行する。
+習慣をID順に --batch-size 件ずつ、別々のトランザクションで処理する。
+
+使い方:
+    python rebuild_habit_streaks.py
+    python rebuild_habit_streaks.py --habit-id 1 --habit-id 2
+"""
+
+import argparse
+
+from sqlalchemy import select
+
+import crud
+import models
+from database import SessionLocal
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild cached habit streaks from habit_records.")
+    parser.add_argument("--habit-id", type=int, action="append", dest="habit_ids", help="only rebuild this habit (repeatable)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="number of habits processed per transaction")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        habit_ids = args.habit_ids
+        if habit_ids is None:
+            habit_ids = db.scalars(select(models.Habit.id).order_by(models.Habit.id)).all()
+
+        total = 0
+        for i in range(0, len(habit_ids), args.batch_size):
+            total += crud.rebuild_habit_streaks(db, habit_ids=habit_ids[i:i + args.batch_size])
+        print(f"Rebuilt streaks for {len(habit_ids)} habits ({total} with completed records).")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
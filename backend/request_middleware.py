@@ -0,0 +1,101 @@
+# request_middleware.py
+# リクエストごとの相関ID・処理時間のメトリクス・SQL文の数をまとめて扱う ASGI ミドルウェア。
+# @app.middleware("http")（BaseHTTPMiddleware）は層ごとにタスクとメモリストリームを作るため、重ねるほど
+# 計測しているレイテンシ自体が伸びる。ここでは1つの純粋な ASGI ミドルウェアにまとめ、
+# レスポンスヘッダーは http.response.start のメッセージを send するときに追加する。
+
+import logging
+import time
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import log_setup
+import metrics
+import query_stats
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# CORS でブラウザのスクリプトから読めるようにするレスポンスヘッダー
+EXPOSED_HEADERS = ["X-DB-Query-Count", "X-DB-Query-Time-Ms", "Server-Timing", "X-Request-ID"]
+
+
+def route_path(scope: Scope) -> str:
+    """メトリクスのラベルに使うルートのパスのテンプレート（どのルートにも一致しなければ "unmatched"）"""
+    return getattr(scope.get("route"), "path", "unmatched")
+
+
+class RequestMiddleware:
+    """
+    リクエストに相関IDを割り当て（クライアントが X-Request-ID を送ってくればそれを使う）、処理中に出したログに付ける。
+    ルートごとの処理時間・ステータスコード・処理中のリクエスト数と、実行したSQL文の数・合計時間をメトリクスに記録し、
+    X-Request-ID・X-DB-Query-Count・X-DB-Query-Time-Ms・Server-Timing をレスポンスヘッダーで返す。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        correlation_id = log_setup.accept_correlation_id(Headers(scope=scope).get("X-Request-ID"))
+        in_progress = metrics.HTTP_REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        started = time.perf_counter()
+        status_code = 500
+
+        with log_setup.correlation_scope(correlation_id), query_stats.track() as stats:
+            async def send_with_headers(message: Message):
+                nonlocal status_code
+                if message["type"] == "http.response.start":
+                    status_code = message["status"]
+                    query_ms = stats.total_seconds * 1000
+                    headers = MutableHeaders(scope=message)
+                    headers["X-Request-ID"] = correlation_id
+                    headers["X-DB-Query-Count"] = str(stats.count)
+                    headers["X-DB-Query-Time-Ms"] = f"{query_ms:.1f}"
+                    headers["Server-Timing"] = f'db;dur={query_ms:.1f};desc="{stats.count} queries"'
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_headers)
+            finally:
+                path = route_path(scope)
+                metrics.HTTP_REQUEST_SECONDS.labels(method, path).observe(time.perf_counter() - started)
+                metrics.HTTP_REQUESTS.labels(method, path, str(status_code)).inc()
+                in_progress.dec()
+                _record_queries(method, path, status_code, stats)
+
+
+def _record_queries(method: str, path: str, status_code: int, stats: query_stats.QueryStats):
+    """リクエストで実行したSQL文の数と合計時間をメトリクスに記録し、N+1 の疑いがあればログに出す"""
+    query_ms = stats.total_seconds * 1000
+    metrics.DB_QUERIES_PER_REQUEST.labels(path).observe(stats.count)
+    metrics.DB_QUERY_SECONDS_PER_REQUEST.labels(path).observe(stats.total_seconds)
+
+    repeated = stats.repeated()
+    if repeated:
+        metrics.DB_REPEATED_QUERY_REQUESTS.labels(path).inc()
+        logger.warning(
+            "Possible N+1 in %s %s", method, path,
+            extra={
+                "route": path,
+                "db_queries": stats.count,
+                "db_ms": round(query_ms, 1),
+                "repeated": [{"count": n, "statement": shape[:200]} for shape, n in repeated],
+            },
+        )
+    elif settings.query_log_requests:
+        logger.info(
+            "%s %s", method, path,
+            extra={
+                "route": path,
+                "status": status_code,
+                "db_queries": stats.count,
+                "db_ms": round(query_ms, 1),
+            },
+        )
@@ -0,0 +1,62 @@
+# scheduling.py
+
+from datetime import date, datetime, timedelta, timezone, time as time_type
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import Date, TIMESTAMP, case, cast, func, literal
+
+# ユーザーがタイムゾーンを設定していない場合に使うタイムゾーン
+DEFAULT_TIMEZONE = "Asia/Tokyo"
+
+
+def is_valid_timezone(tz_name: str) -> bool:
+    """IANAタイムゾーン名として解釈できるかどうかを返す"""
+    try:
+        ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+def local_today(tz_name: str, now: Optional[datetime] = None) -> date:
+    """ユーザーのタイムゾーンでの今日の日付を返す"""
+    return local_date(now or datetime.now(timezone.utc), tz_name)
+
+
+def local_date(moment: datetime, tz_name: str) -> date:
+    """日時のユーザーのタイムゾーンでの日付を返す（タイムゾーンのない日時は、列の保存のとおりUTCとみなす）"""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(ZoneInfo(tz_name)).date()
+
+
+def compute_next_fire_at(local_time: time_type, tz_name: str, now: Optional[datetime] = None) -> datetime:
+    """
+    ユーザーのタイムゾーンでの時刻 local_time について、now より後で最も近い送信時刻をUTCで返す。
+    """
+    tz = ZoneInfo(tz_name)
+    now = now or datetime.now(timezone.utc)
+    local_now = now.astimezone(tz)
+
+    candidate = datetime.combine(local_now.date(), local_time, tzinfo=tz)
+    if candidate <= local_now:
+        candidate = datetime.combine(local_now.date() + timedelta(days=1), local_time, tzinfo=tz)
+    return candidate.astimezone(timezone.utc)
+
+
+def next_fire_at_expr(time_column, tz_column, now: datetime):
+    """
+    compute_next_fire_at と同じ計算をSQL式として組み立てる。
+    UPDATE文の中で、行ごとの時刻とユーザーのタイムゾーンから次回の送信時刻を求めるのに使う。
+    """
+    now_param = literal(now, TIMESTAMP(timezone=True))
+    # timezone(zone, timestamptz) はそのタイムゾーンでのローカル時刻（timestamp）を返す
+    local_now = func.timezone(tz_column, now_param, type_=TIMESTAMP())
+    candidate = cast(local_now, Date) + time_column
+    next_local = case(
+        (candidate > local_now, candidate),
+        else_=candidate + timedelta(days=1),
+    )
+    # timezone(zone, timestamp) はローカル時刻を timestamptz に戻す
+    return func.timezone(tz_column, next_local, type_=TIMESTAMP(timezone=True))
@@ -1,10 +1,13 @@
 # schemas.py (最終・修正版)
 
 from __future__ import annotations
-from pydantic import BaseModel, EmailStr, Field
-from datetime import datetime, date, time
+from pydantic import BaseModel, EmailStr, Field, field_validator
+from datetime import datetime, date, time, timedelta
+import datetime as datetime_module
 from typing import Optional
 
+import scheduling
+
 # --- ★★★ HabitCreateから user_id を削除しました ★★★ ---
 # これが今回の修正の核心です。
 # user_idはリクエストボディで送るのではなく、
@@ -18,10 +21,25 @@ class HabitResponse(BaseModel):
     name: str
     description: Optional[str]
     created_at: datetime
+    # 今日（ユーザーのタイムゾーン）の時点の連続達成日数。as_of で作ると、途切れている場合は 0 になる
+    current_streak: int = 0
+    longest_streak: int = 0
+    last_completed_date: Optional[date] = None
 
     class Config:
         from_attributes = True
 
+    @classmethod
+    def as_of(cls, habit, today: date, **values):
+        """
+        習慣の行からレスポンスを作る。保存している current_streak は last_completed_date で終わる連続日数なので、
+        last_completed_date が today の前日より前であれば、その連続記録は途切れているとして 0 にする。
+        """
+        data = HabitResponse.model_validate(habit).model_dump()
+        if data["last_completed_date"] is None or data["last_completed_date"] < today - timedelta(days=1):
+            data["current_streak"] = 0
+        return cls(**data, **values)
+
 class HabitUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
@@ -38,6 +56,7 @@ class UserResponse(BaseModel):
     id: int
     name: str
     email: EmailStr
+    timezone: str
 
     class Config:
         from_attributes = True
@@ -49,6 +68,16 @@ class UserUpdate(BaseModel):
     class Config:
         from_attributes = True
 
+class UserTimezoneUpdate(BaseModel):
+    timezone: str = Field(..., example="Asia/Tokyo")
+
+    @field_validator("timezone")
+    @classmethod
+    def validate_timezone(cls, value: str) -> str:
+        if not scheduling.is_valid_timezone(value):
+            raise ValueError("Unknown IANA timezone")
+        return value
+
 class UserVerify(BaseModel):
     email: EmailStr
     code: str = Field(..., min_length=6, max_length=6)
@@ -67,8 +96,60 @@ class HabitRecordResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class HabitCompletedDates(BaseModel):
+    habit_id: int
+    dates: list[date]
+
+class RecordsCalendarResponse(BaseModel):
+    start_date: date
+    end_date: date
+    habits: list[HabitCompletedDates]
+
+class HabitCalendarBitmapResponse(BaseModel):
+    habit_id: int
+    start_date: date
+    end_date: date
+    days: int
+    # 1日1ビット（start_date が最下位ビット）のビットマップをリトルエンディアンのバイト列にしてbase64化したもの
+    bitmap: str
+    completed_count: int
+
+class HabitStatsResponse(BaseModel):
+    habit_id: int
+    as_of: date
+    current_streak: int
+    longest_streak: int
+    completion_rate_7d: float
+    completion_rate_30d: float
+    completion_rate_90d: float
+    weekday_counts: list[int]  # 月曜日から日曜日までの達成数
+
+    class Config:
+        from_attributes = True
+
+class UserStatsResponse(BaseModel):
+    as_of: date
+    habits: list[HabitStatsResponse]
+
+class HabitRecordBulkCreate(BaseModel):
+    records: list[HabitRecordCreate] = Field(..., min_length=1, max_length=5000)
+
+class HabitRecordBulkItemResult(BaseModel):
+    index: int
+    habit_id: int
+    date: date
+    outcome: str = Field(..., example="created")  # "created" | "updated" | "not_found"
+    record_id: Optional[int] = None
+
+class HabitRecordBulkResponse(BaseModel):
+    created: int
+    updated: int
+    not_found: int
+    results: list[HabitRecordBulkItemResult]
+
 class HabitRecordUpdate(BaseModel):
-    date: Optional[date] = None
+    # NotificationUpdate.time と同じく、フィールド名が型名の date を隠すので、モジュール経由で指定する
+    date: Optional[datetime_module.date] = None
     status: Optional[bool] = None
 
     class Config:
@@ -85,12 +166,14 @@ class NotificationResponse(BaseModel):
     habit_id: int
     time: time
     enabled: bool
+    next_fire_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
 
 class NotificationUpdate(BaseModel):
-    time: Optional[time] = None
+    # フィールド名が型名の time を隠す（デフォルト値 None が型として解決される）ので、モジュール経由で指定する
+    time: Optional[datetime_module.time] = None
     enabled: Optional[bool] = None
 
     class Config:
@@ -123,3 +206,13 @@ class MessageResponse(BaseModel):
 
 class FCMTokenUpdate(BaseModel):
     fcm_token: str
+
+class DashboardHabit(HabitResponse):
+    today_status: Optional[bool] = None  # 今日の記録がなければ None
+    active_goals: list[GoalResponse] = []
+    notifications: list[NotificationResponse] = []
+
+class DashboardResponse(BaseModel):
+    user: UserResponse
+    as_of: date
+    habits: list[DashboardHabit]
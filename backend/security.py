@@ -3,7 +3,8 @@
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
+
+import password_hashing
 
 # ★ 認証コード生成に必要なライブラリ
 import random
@@ -16,19 +17,19 @@ SECRET_KEY = "your-very-secret-key-for-snoop-app"  # 必ずランダムで複雑
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# パスワードハッシュ化の設定
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# パスワードハッシュ化の設定（コストやプロセスプールの大きさは password_hashing.py を参照）
+pwd_context = password_hashing.hasher.context
 
 
 # --- 関数 ---
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """平文のパスワードとハッシュ化されたパスワードを比較する"""
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hashing.hasher.verify_sync(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     """パスワードをハッシュ化する"""
-    return pwd_context.hash(password)
+    return password_hashing.hasher.hash_sync(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """アクセストークンを生成する"""
@@ -43,6 +44,16 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def decode_access_token(token: str) -> Optional[dict]:
+    """アクセストークンを検証し、クレーム（sub にメールアドレス、exp に有効期限）を返す。無効なトークンの場合は None"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    if payload.get("sub") is None:
+        return None
+    return payload
+
 # ★★★ この関数が認証コードを生成します ★★★
 def create_verification_code(length: int = 6) -> str:
     """ランダムな数字の認証コードを生成する"""
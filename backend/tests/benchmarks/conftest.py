@@ -0,0 +1,71 @@
+"""
+マイクロベンチマーク（pytest-benchmark）の共通のフィクスチャ。
+seed_data.seed() で作成したデータ（テスト全体で1回だけ作成し、最後に削除する）に対して計測する。
+
+使い方（backend ディレクトリで実行）:
+    python -m pytest tests/benchmarks
+    python -m pytest tests/benchmarks --benchmark-compare --benchmark-autosave
+ベンチマーク以外のテストだけを実行するときは --benchmark-skip を付ける。
+"""
+
+import random
+from dataclasses import dataclass
+from datetime import date
+
+import pytest
+from sqlalchemy import select
+
+import models
+import scheduling
+from benchmarks import seed_data
+from database import SessionLocal
+
+pytest.importorskip("pytest_benchmark")
+
+USERS = 50
+HABITS = 5
+DAYS = 365
+
+
+@dataclass
+class SeededData:
+    habits: list[tuple[int, int]]  # (habit_id, user_id)
+    user_ids: list[int]
+    today: date
+
+
+@pytest.fixture(scope="session")
+def seeded(database):
+    """USERS 人 × HABITS 件 × DAYS 日分の記録・目標・通知"""
+    db = SessionLocal()
+    try:
+        seed_data.cleanup(db)
+        seed_data.seed(db, USERS, HABITS, DAYS, completion_rate=0.7, goals=1)
+        habits = db.execute(
+            select(models.Habit.id, models.Habit.user_id).join(models.User).where(seed_data.seeded_users())
+        ).all()
+        yield SeededData(
+            habits=[tuple(row) for row in habits],
+            user_ids=sorted({user_id for _, user_id in habits}),
+            today=scheduling.local_today(seed_data.TIMEZONE),
+        )
+    finally:
+        db.rollback()
+        seed_data.cleanup(db)
+        db.close()
+
+
+@pytest.fixture
+def bench_db(seeded):
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.rollback()
+        db.close()
+
+
+@pytest.fixture
+def rng():
+    """呼び出すたびに作成済みの習慣・ユーザーから1つ選ぶための乱数（シード固定）"""
+    return random.Random(0)
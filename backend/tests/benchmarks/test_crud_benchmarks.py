@@ -0,0 +1,100 @@
+"""
+よく呼ばれる crud の関数と通知のティックの実行時間を、seed_data で作成したデータに対して計測する。
+呼び出すたびに作成済みの習慣・ユーザーから乱数（シード固定）で1つ選ぶので、毎回同じ行だけを読むことはない。
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import delete, select, update
+
+import crud
+import fcm_dispatcher
+import models
+import notification_sender
+from benchmarks.seed_data import seeded_users
+from notification_dispatcher import drain_outbox
+
+SEEDED_NOTIFICATIONS = select(models.Notification.id).join(models.User).where(seeded_users())
+
+
+def isolated(db, fn, choose):
+    """choose() で選んだ引数で fn を呼び、読み込んだオブジェクトをセッションに溜め込まない関数"""
+    def run():
+        result = fn(*choose())
+        db.rollback()
+        db.expunge_all()
+        return result
+    return run
+
+
+@pytest.mark.parametrize(
+    "case",
+    [
+        lambda db, today, habit_id: crud.get_habit_records_by_date_range(db, habit_id, today - timedelta(days=30), today),
+        lambda db, today, habit_id: crud.get_completed_dates(db, habit_id, today - timedelta(days=365), today),
+        lambda db, today, habit_id: crud.get_goals_for_habit(db, habit_id),
+    ],
+    ids=["get_habit_records_by_date_range", "get_completed_dates_1y", "get_goals_for_habit"],
+)
+def test_habit_queries(benchmark, bench_db, seeded, rng, case):
+    run = isolated(bench_db, lambda habit_id: case(bench_db, seeded.today, habit_id), lambda: (rng.choice(seeded.habits)[0],))
+    benchmark(run)
+
+
+@pytest.mark.parametrize(
+    "case",
+    [
+        lambda db, today, user_id: crud.get_completion_history(db, user_id=user_id),
+        lambda db, today, user_id: crud.get_dashboard(db, user_id=user_id, today=today),
+    ],
+    ids=["get_completion_history", "get_dashboard"],
+)
+def test_user_queries(benchmark, bench_db, seeded, rng, case):
+    run = isolated(bench_db, lambda user_id: case(bench_db, seeded.today, user_id), lambda: (rng.choice(seeded.user_ids),))
+    result = benchmark(run)
+    assert result is not None
+
+
+def make_seeded_notifications_due(db):
+    """作成した通知をすべて期限切れにし、前の回で積んだアウトボックスの行を消す"""
+    db.execute(
+        delete(models.NotificationOutbox)
+        .where(models.NotificationOutbox.notification_id.in_(SEEDED_NOTIFICATIONS))
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(
+        update(models.Notification)
+        .where(models.Notification.id.in_(SEEDED_NOTIFICATIONS))
+        .values(next_fire_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+@pytest.fixture
+def clean_outbox(bench_db):
+    yield
+    make_seeded_notifications_due(bench_db)
+
+
+def test_enqueue_due_reminders(benchmark, bench_db, seeded, clean_outbox):
+    """期限の来た通知（作成した全件）を確保し、アウトボックスに積む1回分"""
+    def run():
+        return crud.enqueue_due_reminders(bench_db, datetime.now(timezone.utc))
+
+    claimed, enqueued = benchmark.pedantic(run, setup=lambda: make_seeded_notifications_due(bench_db), rounds=20)
+    assert claimed >= len(seeded.habits)
+    assert enqueued >= len(seeded.habits)
+
+
+def test_notification_tick(benchmark, bench_db, seeded, clean_outbox):
+    """ティックでアウトボックスに積み、FakeTransport（FCMの代わり。ネットワークは使わない）で送信し切るまで"""
+    transport = fcm_dispatcher.FakeTransport(latency=0)
+
+    def run():
+        notification_sender.enqueue_scheduled_notifications()
+        return drain_outbox(transport=transport)
+
+    benchmark.pedantic(run, setup=lambda: make_seeded_notifications_due(bench_db), rounds=5)
+    assert transport.sent_count >= 5 * len(seeded.habits)
@@ -0,0 +1,51 @@
+"""
+GET /dashboard が習慣の数によらず一定の数のクエリ（認証のユーザーの取得 + crud.DASHBOARD_QUERY_COUNT）で済んでいることを確認する。
+習慣ごとにクエリを発行する変更（N+1）が入ると、習慣を増やしたときにクエリの数が変わって失敗する。
+"""
+
+from datetime import datetime, time, timedelta, timezone
+
+import auth_cache
+import crud
+import models
+import scheduling
+
+HABITS = 3
+
+
+def seed_habits(db, user, n: int):
+    """記録（今日の分）・目標・通知の付いた習慣を n 件作成する"""
+    today = scheduling.local_today(user.timezone)
+    now = datetime.now(timezone.utc)
+    for i in range(n):
+        habit = models.Habit(user_id=user.id, name=f"habit-{i}", created_at=now)
+        db.add(habit)
+        db.flush()
+        db.add_all([
+            models.HabitRecord(habit_id=habit.id, date=today, status=i % 2 == 0),
+            models.Goal(habit_id=habit.id, target_count=10, start_date=today - timedelta(days=7), end_date=today + timedelta(days=7)),
+            models.Notification(user_id=user.id, habit_id=habit.id, time=time(8, 0), enabled=True),
+        ])
+    db.commit()
+
+
+def dashboard_statements(client, count_queries) -> tuple[dict, list[str]]:
+    """認証キャッシュに無い状態で GET /dashboard を実行し、レスポンスと実行したSQL文を返す"""
+    auth_cache.principal_cache.clear()
+    with count_queries() as statements:
+        response = client.get("/dashboard")
+    assert response.status_code == 200, response.text
+    return response.json(), statements
+
+
+def test_dashboard_query_count_is_constant(client, db, user, count_queries):
+    seed_habits(db, user, HABITS)
+    body, statements = dashboard_statements(client, count_queries)
+    assert len(body["habits"]) == HABITS
+    assert len(statements) == 1 + crud.DASHBOARD_QUERY_COUNT, statements
+
+    seed_habits(db, user, HABITS)
+    body, statements = dashboard_statements(client, count_queries)
+    assert len(body["habits"]) == 2 * HABITS
+    assert all(len(h["active_goals"]) == 1 and len(h["notifications"]) == 1 for h in body["habits"])
+    assert len(statements) == 1 + crud.DASHBOARD_QUERY_COUNT, statements
@@ -0,0 +1,269 @@
+"""
+email_sender の SMTP の送信を、ローカルで起動した aiosmtpd（どこにも配送しない）に対して確認する。
+"""
+
+import asyncio
+import dataclasses
+import logging
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+from email import message_from_bytes, policy
+
+import pytest
+from aiosmtpd.controller import Controller
+from sqlalchemy import select
+
+import crud
+import email_sender
+import models
+from email_sender import OutgoingEmail, RateLimiter, SmtpConnectionPool, SmtpTransport
+
+FROM_ADDRESS = "Snoop <no-reply@snoop.local>"
+
+
+class RecordingHandler:
+    """接続の数と受け取ったメールを記録し、replies に指定した宛先には RCPT に指定した応答を返すハンドラー"""
+
+    def __init__(self):
+        self.connections = 0
+        self.messages = []
+        self.replies: dict[str, str] = {}
+        self.servers = []
+        self._lock = threading.Lock()
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        session.host_name = hostname
+        with self._lock:
+            self.connections += 1
+            self.servers.append(server)
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.replies:
+            return self.replies[address]
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        with self._lock:
+            self.messages.append(message_from_bytes(envelope.content, policy=policy.default))
+        return "250 OK"
+
+
+@pytest.fixture
+def smtp_server():
+    # aiosmtpd の Controller は port=0（空いているポートを選ばせる）で起動できないので、先に選んでおく
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    yield controller
+    controller.stop()
+
+
+@pytest.fixture
+def transport(smtp_server):
+    transport = SmtpTransport(
+        SmtpConnectionPool(smtp_server.hostname, smtp_server.port, size=1), from_address=FROM_ADDRESS
+    )
+    yield transport
+    transport.close()
+
+
+def make_emails(*addresses: str) -> list[OutgoingEmail]:
+    return [
+        OutgoingEmail(outbox_id=i, to_address=address, subject="Snoop 認証コード", body=f"コード {i}")
+        for i, address in enumerate(addresses)
+    ]
+
+
+def disconnect_clients(controller):
+    """サーバー側から、開いているすべての接続を切る"""
+    async def _close():
+        for server in controller.handler.servers:
+            server.transport.close()
+
+    asyncio.run_coroutine_threadsafe(_close(), controller.loop).result(timeout=5)
+
+
+def test_batches_reuse_one_pooled_connection(smtp_server, transport):
+    first = transport.send_batch(make_emails("a@example.com", "b@example.com", "c@example.com"))
+    second = transport.send_batch(make_emails("d@example.com", "e@example.com"))
+
+    assert all(result.success for result in first + second)
+    assert smtp_server.handler.connections == 1
+    assert [message["To"] for message in smtp_server.handler.messages] == [
+        "a@example.com", "b@example.com", "c@example.com", "d@example.com", "e@example.com",
+    ]
+    assert smtp_server.handler.messages[0]["Subject"] == "Snoop 認証コード"
+
+
+def test_connection_is_replaced_after_messages_per_connection(smtp_server):
+    transport = SmtpTransport(
+        SmtpConnectionPool(smtp_server.hostname, smtp_server.port, size=1, messages_per_connection=2),
+        from_address=FROM_ADDRESS,
+    )
+    try:
+        for address in ("a@example.com", "b@example.com", "c@example.com"):
+            assert transport.send_batch(make_emails(address))[0].success
+    finally:
+        transport.close()
+
+    assert smtp_server.handler.connections == 2
+
+
+def test_reused_connection_closed_by_server_reconnects_once(smtp_server, transport):
+    assert transport.send_batch(make_emails("a@example.com"))[0].success
+    disconnect_clients(smtp_server)
+
+    results = transport.send_batch(make_emails("b@example.com"))
+
+    assert results[0].success, results[0].error
+    assert smtp_server.handler.connections == 2
+    assert [message["To"] for message in smtp_server.handler.messages] == ["a@example.com", "b@example.com"]
+
+
+def test_recipient_replies_are_classified(smtp_server, transport):
+    smtp_server.handler.replies = {
+        "gone@example.com": "550 5.1.1 No such user",
+        "busy@example.com": "451 4.3.0 Try again later",
+    }
+
+    gone, busy, ok = transport.send_batch(make_emails("gone@example.com", "busy@example.com", "ok@example.com"))
+
+    assert not gone.success and gone.permanent and "550" in gone.error
+    assert not busy.success and not busy.permanent and "451" in busy.error
+    # 宛先を拒否されても、接続はそのまま次のメールに使える
+    assert ok.success
+    assert smtp_server.handler.connections == 1
+
+
+def test_permanent_failure_is_dead_and_transient_failure_backs_off(db, make_user, smtp_server, transport):
+    smtp_server.handler.replies = {
+        "gone@example.com": "550 5.1.1 No such user",
+        "busy@example.com": "451 4.3.0 Try again later",
+    }
+    user = make_user()
+    now = datetime.now(timezone.utc)
+    rows = {
+        address: models.EmailOutbox(
+            user_id=user.id, to_address=address, subject="Snoop 認証コード", body="コード", next_attempt_at=now,
+        )
+        for address in ("gone@example.com", "busy@example.com", "ok@example.com")
+    }
+    db.add_all(rows.values())
+    db.commit()
+    ids = {address: row.id for address, row in rows.items()}
+
+    assert email_sender.send_email_batch(transport=transport) == 3
+
+    db.expire_all()
+    outbox = {row.id: row for row in db.scalars(select(models.EmailOutbox).where(models.EmailOutbox.user_id == user.id))}
+    assert ids["ok@example.com"] not in outbox
+    assert outbox[ids["gone@example.com"]].status == crud.OUTBOX_STATUS_DEAD
+    busy = outbox[ids["busy@example.com"]]
+    assert busy.status == crud.OUTBOX_STATUS_PENDING
+    assert busy.attempts == 1
+    assert busy.next_attempt_at > datetime.now(timezone.utc)
+    assert "451" in busy.last_error
+
+
+class FakeClock:
+    """RateLimiter の time の代わり。sleep は待たずに時刻を進め、待った秒数を記録する"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_rate_limiter_paces_after_burst(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(email_sender, "time", clock)
+    limiter = RateLimiter(rate_per_second=10, burst=2)
+
+    for _ in range(5):
+        limiter.acquire()
+
+    # 最初の2通はバーストの分で待たず、その後は1通ごとに 1/10 秒待つ
+    assert clock.sleeps == pytest.approx([0.1, 0.1, 0.1])
+    assert clock.now == pytest.approx(0.3)
+
+
+def test_rate_limiter_refills_while_idle(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(email_sender, "time", clock)
+    limiter = RateLimiter(rate_per_second=10, burst=2)
+
+    limiter.acquire()
+    limiter.acquire()
+    clock.now += 1.0
+    limiter.acquire()
+    limiter.acquire()
+
+    assert clock.sleeps == []
+
+
+def test_rate_limiter_without_rate_does_not_wait(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(email_sender, "time", clock)
+    limiter = RateLimiter(rate_per_second=0)
+
+    for _ in range(100):
+        limiter.acquire()
+
+    assert clock.sleeps == []
+
+
+def test_log_transport_keeps_the_body_out_of_info_logs(caplog):
+    transport = email_sender.LogTransport()
+
+    with caplog.at_level(logging.INFO, logger="email_sender"):
+        results = transport.send_batch(make_emails("a@example.com"))
+
+    assert results[0].success
+    assert [record.to for record in caplog.records] == ["a@example.com"]
+    assert not any(hasattr(record, "body") for record in caplog.records)
+
+
+def test_log_backend_warns(caplog, monkeypatch):
+    monkeypatch.setattr(email_sender, "settings", dataclasses.replace(email_sender.settings, email_backend="log"))
+
+    with caplog.at_level(logging.WARNING, logger="email_sender"):
+        email_sender.warn_if_not_sending()
+
+    assert "EMAIL_BACKEND=log" in caplog.text
+
+
+def test_resending_the_code_keeps_emails_leased_by_the_sender(db, make_user):
+    user = make_user()
+    now = datetime.now(timezone.utc)
+    rows = {
+        "queued": models.EmailOutbox(next_attempt_at=now),
+        "leased": models.EmailOutbox(attempts=1, next_attempt_at=now + timedelta(minutes=5)),
+        "lease-expired": models.EmailOutbox(attempts=1, next_attempt_at=now - timedelta(seconds=1)),
+        "dead": models.EmailOutbox(status=crud.OUTBOX_STATUS_DEAD, attempts=8, next_attempt_at=now),
+    }
+    for row in rows.values():
+        row.user_id = user.id
+        row.to_address = user.email
+        row.subject = "Snoop 認証コード"
+        row.body = "古いコード"
+    db.add_all(rows.values())
+    db.commit()
+    ids = {name: row.id for name, row in rows.items()}
+
+    db.execute(crud.pending_emails_delete_stmt(user.id))
+    db.commit()
+
+    remaining = set(db.scalars(select(models.EmailOutbox.id).where(models.EmailOutbox.user_id == user.id)))
+    assert remaining == {ids["leased"], ids["dead"]}
@@ -0,0 +1,202 @@
+"""
+目標の達成数（goals.current_count / is_achieved）が、記録の作成・更新のたびに正しく増減することを確認する。
+目標の作成と記録の書き込みが同時に行われても、記録が数え漏らされないことも確認する。
+"""
+
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import crud
+import models
+import scheduling
+import schemas
+from database import SessionLocal
+
+
+@pytest.fixture
+def habit(db, user):
+    habit = models.Habit(user_id=user.id, name="ランニング", created_at=datetime.now(timezone.utc))
+    db.add(habit)
+    db.commit()
+    return habit
+
+
+def goal_counts(client, habit) -> dict:
+    """開始日ごとの (current_count, is_achieved)"""
+    response = client.get(f"/habits/{habit.id}/goals")
+    assert response.status_code == 200, response.text
+    return {goal["start_date"]: (goal["current_count"], goal["is_achieved"]) for goal in response.json()}
+
+
+def assert_matches_rebuild(db, habit):
+    """増減で保っている達成数が、記録から数え直した値と同じであること"""
+    before = {goal.id: goal.current_count for goal in crud.get_goals_for_habit(db, habit.id)}
+    db.expire_all()
+    crud.rebuild_goal_counters(db, habit_ids=[habit.id])
+    db.expire_all()
+    assert {goal.id: goal.current_count for goal in crud.get_goals_for_habit(db, habit.id)} == before
+
+
+@pytest.mark.parametrize("prefix", ["", "/async"], ids=["sync", "async"])
+def test_goal_created_after_records_counts_them(client, db, user, habit, prefix):
+    today = scheduling.local_today(user.timezone)
+    db.add_all([
+        models.HabitRecord(habit_id=habit.id, date=today - timedelta(days=1), status=True),
+        models.HabitRecord(habit_id=habit.id, date=today - timedelta(days=2), status=False),
+        models.HabitRecord(habit_id=habit.id, date=today - timedelta(days=20), status=True),
+    ])
+    db.commit()
+
+    response = client.post(f"{prefix}/habits/{habit.id}/goals", json={
+        "target_count": 2, "start_date": (today - timedelta(days=6)).isoformat(), "end_date": today.isoformat(),
+    })
+    assert response.status_code == 201, response.text
+    assert (response.json()["current_count"], response.json()["is_achieved"]) == (1, False)
+
+    response = client.post(f"{prefix}/habit_records", json={"habit_id": habit.id, "date": today.isoformat(), "status": True})
+    assert response.status_code == 201, response.text
+    assert goal_counts(client, habit) == {(today - timedelta(days=6)).isoformat(): (2, True)}
+    assert_matches_rebuild(db, habit)
+
+
+def test_record_changes_adjust_goal_counters(client, db, user, habit):
+    today = scheduling.local_today(user.timezone)
+    recent, older = (today - timedelta(days=6)).isoformat(), (today - timedelta(days=40)).isoformat()
+    for start, end in ((recent, today), (older, today - timedelta(days=20))):
+        response = client.post(f"/habits/{habit.id}/goals", json={
+            "target_count": 2, "start_date": start, "end_date": str(end),
+        })
+        assert response.status_code == 201, response.text
+
+    def post(days_ago: int, status: bool) -> int:
+        response = client.post("/habit_records", json={
+            "habit_id": habit.id, "date": (today - timedelta(days=days_ago)).isoformat(), "status": status,
+        })
+        assert response.status_code == 201, response.text
+        return response.json()["id"]
+
+    def put(record_id: int, **values):
+        response = client.put(f"/habit_records/{record_id}", json=values)
+        assert response.status_code == 200, response.text
+
+    today_id = post(0, True)
+    assert goal_counts(client, habit) == {recent: (1, False), older: (0, False)}
+
+    # 未達成の記録は数えない
+    yesterday_id = post(1, False)
+    assert goal_counts(client, habit) == {recent: (1, False), older: (0, False)}
+
+    # 未達成 → 達成で +1（目標を達成する）
+    put(yesterday_id, status=True)
+    assert goal_counts(client, habit) == {recent: (2, True), older: (0, False)}
+
+    # 別の目標の期間への日付の移動で、元の目標は -1、移動先の目標は +1
+    put(today_id, date=(today - timedelta(days=30)).isoformat())
+    assert goal_counts(client, habit) == {recent: (1, False), older: (1, False)}
+
+    # どの目標の期間でもない日付への移動は -1 だけ
+    put(yesterday_id, date=(today - timedelta(days=10)).isoformat())
+    assert goal_counts(client, habit) == {recent: (0, False), older: (1, False)}
+
+    # 達成 → 未達成で -1
+    put(today_id, status=False)
+    assert goal_counts(client, habit) == {recent: (0, False), older: (0, False)}
+
+    assert_matches_rebuild(db, habit)
+
+
+def run_in_thread(fn) -> threading.Thread:
+    errors = []
+
+    def _run():
+        try:
+            fn()
+        except BaseException as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=_run, daemon=True)
+    thread.errors = errors
+    thread.start()
+    return thread
+
+
+def join(thread: threading.Thread):
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    if thread.errors:
+        raise thread.errors[0]
+
+
+def test_record_written_while_goal_is_counting_is_counted(db, user, habit, monkeypatch):
+    """目標が期間内の記録を数えた後・コミットする前に、記録が書き込まれた場合"""
+    today = scheduling.local_today(user.timezone)
+    goal_db, record_db = SessionLocal(), SessionLocal()
+    counted, resume = threading.Event(), threading.Event()
+    scalar = goal_db.scalar
+
+    def scalar_then_pause(*args, **kwargs):
+        result = scalar(*args, **kwargs)
+        counted.set()
+        resume.wait(timeout=10)
+        return result
+
+    monkeypatch.setattr(goal_db, "scalar", scalar_then_pause)
+    try:
+        goal_thread = run_in_thread(lambda: crud.create_goal_for_habit(
+            goal_db, schemas.GoalCreate(target_count=1, start_date=today, end_date=today), habit_id=habit.id,
+        ))
+        assert counted.wait(timeout=10)
+        record_thread = run_in_thread(lambda: crud.create_habit_record(
+            record_db, schemas.HabitRecordCreate(habit_id=habit.id, date=today, status=True),
+        ))
+        # 習慣の行のロックで、記録の書き込みは目標のコミットを待つ
+        record_thread.join(timeout=0.5)
+        resume.set()
+        join(goal_thread)
+        join(record_thread)
+    finally:
+        resume.set()
+        goal_db.close()
+        record_db.close()
+
+    db.expire_all()
+    [goal] = crud.get_goals_for_habit(db, habit.id)
+    assert (goal.current_count, goal.is_achieved) == (1, True)
+
+
+def test_goal_created_while_record_is_uncommitted_counts_it(db, user, habit, monkeypatch):
+    """記録が目標の達成数を更新した後・コミットする前に、目標が作成された場合"""
+    today = scheduling.local_today(user.timezone)
+    goal_db, record_db = SessionLocal(), SessionLocal()
+    adjusted, resume = threading.Event(), threading.Event()
+    record_completion = crud._record_habit_completion
+
+    def pause_then_record_completion(*args, **kwargs):
+        adjusted.set()
+        resume.wait(timeout=10)
+        return record_completion(*args, **kwargs)
+
+    monkeypatch.setattr(crud, "_record_habit_completion", pause_then_record_completion)
+    try:
+        record_thread = run_in_thread(lambda: crud.create_habit_record(
+            record_db, schemas.HabitRecordCreate(habit_id=habit.id, date=today, status=True),
+        ))
+        assert adjusted.wait(timeout=10)
+        goal_thread = run_in_thread(lambda: crud.create_goal_for_habit(
+            goal_db, schemas.GoalCreate(target_count=1, start_date=today, end_date=today), habit_id=habit.id,
+        ))
+        # 習慣の行のロックで、目標の作成は記録のコミットを待ってから数える
+        goal_thread.join(timeout=0.5)
+        resume.set()
+        join(record_thread)
+        join(goal_thread)
+    finally:
+        resume.set()
+        goal_db.close()
+        record_db.close()
+
+    db.expire_all()
+    [goal] = crud.get_goals_for_habit(db, habit.id)
+    assert (goal.current_count, goal.is_achieved) == (1, True)
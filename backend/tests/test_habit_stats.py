@@ -0,0 +1,85 @@
+"""
+GET /habits/{habit_id}/stats の連続達成日数・直近7/30/90日の達成率・曜日ごとの達成数を確認する。
+日付はすべてユーザーのタイムゾーンで数える（習慣の開始日も、作成日時をそのタイムゾーンの日付にしたもの）。
+"""
+
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import models
+import scheduling
+
+
+def add_habit(db, user, created_at: datetime, completed_days_ago, missed_days_ago=()):
+    """作成日時と、今日（ユーザーのタイムゾーン）から何日前に達成した・しなかったかを指定して習慣を作る"""
+    today = scheduling.local_today(user.timezone)
+    # created_at の列はタイムゾーンのないUTCの日時
+    habit = models.Habit(user_id=user.id, name="ランニング", created_at=created_at.astimezone(timezone.utc).replace(tzinfo=None))
+    db.add(habit)
+    db.flush()
+    db.add_all(
+        [models.HabitRecord(habit_id=habit.id, date=today - timedelta(days=n), status=True) for n in completed_days_ago]
+        + [models.HabitRecord(habit_id=habit.id, date=today - timedelta(days=n), status=False) for n in missed_days_ago]
+    )
+    db.commit()
+    return habit
+
+
+def get_stats(client, habit) -> dict:
+    response = client.get(f"/habits/{habit.id}/stats")
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.mark.parametrize(
+    "tz_name, created_local_time, created_days_ago, completed_days_ago, expected_rate",
+    [
+        # 作成日時のUTCの日付は前日だが、開始日は今日なので、今日の達成で 1/1
+        ("Asia/Tokyo", time(8, 30), 0, [0], 1.0),
+        # 作成日時のUTCの日付は翌日だが、開始日は昨日なので、昨日だけの達成は 1/2
+        ("America/Los_Angeles", time(20, 0), 1, [1], 0.5),
+    ],
+    ids=["early-morning-jst", "evening-pst"],
+)
+def test_rates_start_on_the_local_creation_date(
+    db, make_user, make_client, tz_name, created_local_time, created_days_ago, completed_days_ago, expected_rate
+):
+    user = make_user(timezone=tz_name)
+    today = scheduling.local_today(tz_name)
+    created_at = datetime.combine(today - timedelta(days=created_days_ago), created_local_time, ZoneInfo(tz_name))
+    habit = add_habit(db, user, created_at, completed_days_ago)
+
+    stats = get_stats(make_client(user), habit)
+
+    assert stats["as_of"] == today.isoformat()
+    assert [stats["completion_rate_7d"], stats["completion_rate_30d"], stats["completion_rate_90d"]] == [expected_rate] * 3
+
+
+@pytest.mark.parametrize(
+    "completed_days_ago, expected_current, expected_longest, expected_rates",
+    [
+        # 最後の達成が2日前なので途切れている（今日の未達成の記録は数えない）
+        ([2, 3, 4, *range(10, 20), *range(50, 60)], 0, 10, [3 / 7, 13 / 30, 23 / 90]),
+        # 今日の記録がなくても、昨日まで続いていれば途切れていない
+        ([1, 2, 3, *range(5, 10)], 3, 5, [5 / 7, 8 / 30, 8 / 90]),
+    ],
+    ids=["broken-streak", "streak-until-yesterday"],
+)
+def test_streaks_rates_and_weekdays(
+    client, db, user, completed_days_ago, expected_current, expected_longest, expected_rates
+):
+    today = scheduling.local_today(user.timezone)
+    habit = add_habit(db, user, datetime.now(timezone.utc) - timedelta(days=120), completed_days_ago, missed_days_ago=[0])
+
+    stats = get_stats(client, habit)
+
+    assert (stats["current_streak"], stats["longest_streak"]) == (expected_current, expected_longest)
+    assert [stats["completion_rate_7d"], stats["completion_rate_30d"], stats["completion_rate_90d"]] == [
+        round(rate, 4) for rate in expected_rates
+    ]
+    expected_weekdays = [0] * 7
+    for n in completed_days_ago:
+        expected_weekdays[(today - timedelta(days=n)).weekday()] += 1
+    assert stats["weekday_counts"] == expected_weekdays
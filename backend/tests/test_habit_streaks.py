@@ -0,0 +1,58 @@
+"""
+習慣のレスポンスの current_streak が、今日（ユーザーのタイムゾーン）の時点の値になっていることを確認する。
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import models
+import scheduling
+
+
+@pytest.mark.parametrize(
+    "days_since_completed, expected_streak",
+    [(0, 30), (1, 30), (2, 0), (7, 0)],
+    ids=["today", "yesterday", "missed-one-day", "missed-a-week"],
+)
+@pytest.mark.parametrize("path", ["/habits", "/habits/{habit_id}", "/dashboard", "/async/habits"])
+def test_broken_streak_is_reported_as_zero(client, db, user, path, days_since_completed, expected_streak):
+    today = scheduling.local_today(user.timezone)
+    habit = models.Habit(
+        user_id=user.id,
+        name="ランニング",
+        created_at=datetime.now(timezone.utc),
+        current_streak=30,
+        longest_streak=40,
+        last_completed_date=today - timedelta(days=days_since_completed),
+    )
+    db.add(habit)
+    db.commit()
+
+    response = client.get(path.format(habit_id=habit.id))
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    habits = body["habits"] if path == "/dashboard" else body if isinstance(body, list) else [body]
+    assert [(h["current_streak"], h["longest_streak"]) for h in habits] == [(expected_streak, 40)]
+
+
+def test_completing_today_continues_streak(client, db, user):
+    today = scheduling.local_today(user.timezone)
+    habit = models.Habit(
+        user_id=user.id,
+        name="ランニング",
+        created_at=datetime.now(timezone.utc),
+        current_streak=3,
+        longest_streak=3,
+        last_completed_date=today - timedelta(days=1),
+    )
+    db.add(habit)
+    db.commit()
+
+    response = client.post("/habit_records", json={"habit_id": habit.id, "date": today.isoformat(), "status": True})
+    assert response.status_code == 201, response.text
+
+    habit_response = client.get(f"/habits/{habit.id}").json()
+    assert habit_response["current_streak"] == 4
+    assert habit_response["last_completed_date"] == today.isoformat()
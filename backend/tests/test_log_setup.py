@@ -0,0 +1,72 @@
+"""
+log_setup.sample_rate（件数の多いログを、LogRecord を作る前に間引くための割合）を確認する。
+"""
+
+import logging
+from datetime import datetime, time, timedelta, timezone
+
+import pytest
+
+import fcm_dispatcher
+import log_setup
+import models
+import notification_dispatcher
+
+ROWS = 3
+
+
+@pytest.fixture
+def sample_rates(monkeypatch):
+    rates = {}
+    monkeypatch.setattr(log_setup, "_sample_rates", rates)
+    return rates
+
+
+@pytest.fixture
+def info_enabled():
+    logger = logging.getLogger("notification_dispatcher")
+    level = logger.level
+    logger.setLevel(logging.INFO)
+    yield
+    logger.setLevel(level)
+
+
+def test_sample_rate_uses_nearest_configured_logger(sample_rates, info_enabled):
+    sample_rates["notification_dispatcher"] = 0.5
+    sample_rates["notification_dispatcher.delivery"] = 0.01
+
+    assert log_setup.sample_rate(logging.getLogger("notification_dispatcher.delivery")) == 0.01
+    assert log_setup.sample_rate(logging.getLogger("notification_dispatcher.delivery.batch")) == 0.01
+    assert log_setup.sample_rate(logging.getLogger("notification_dispatcher")) == 0.5
+    assert log_setup.sample_rate(logging.getLogger("notification_dispatcher.delivery"), logging.WARNING) == 1.0
+    assert log_setup.sample_rate(logging.getLogger("notification_dispatcher.delivery"), logging.DEBUG) == 0.0
+
+
+def test_sample_rate_defaults_to_one(sample_rates, info_enabled):
+    assert log_setup.sample_rate(logging.getLogger("notification_dispatcher.delivery")) == 1.0
+
+
+@pytest.mark.parametrize("rate, expected_logs", [(0.0, 0), (1.0, ROWS)])
+def test_delivery_logs_are_sampled_before_logging(db, make_user, sample_rates, info_enabled, monkeypatch, rate, expected_logs):
+    sample_rates["notification_dispatcher.delivery"] = rate
+    logged = []
+    monkeypatch.setattr(notification_dispatcher.delivery_logger, "info", lambda *args, **kwargs: logged.append(args))
+
+    now = datetime.now(timezone.utc)
+    for i in range(ROWS):
+        user = make_user(fcm_token=f"test-token-{i}")
+        habit = models.Habit(user_id=user.id, name="habit", created_at=now)
+        db.add(habit)
+        db.flush()
+        notification = models.Notification(user_id=user.id, habit_id=habit.id, time=time(8, 0), enabled=True)
+        db.add(notification)
+        db.flush()
+        db.add(models.NotificationOutbox(
+            notification_id=notification.id, user_id=user.id, scheduled_for=now, next_attempt_at=now - timedelta(seconds=1),
+        ))
+    db.commit()
+
+    claimed = notification_dispatcher.dispatch_outbox_batch(transport=fcm_dispatcher.FakeTransport(latency=0))
+
+    assert claimed == ROWS
+    assert len(logged) == expected_logs
@@ -0,0 +1,45 @@
+"""
+claim_outbox_batch の partition / partitions（user_id % K）による絞り込みを確認する。
+"""
+
+from datetime import datetime, time, timedelta, timezone
+
+import crud
+import models
+
+PARTITIONS = 3
+
+
+def test_partitions_claim_disjoint_rows_covering_the_outbox(db, make_user):
+    now = datetime.now(timezone.utc)
+    outbox_users = {}
+    for i in range(7):
+        user = make_user(fcm_token=f"test-token-{i}")
+        habit = models.Habit(user_id=user.id, name="habit", created_at=now)
+        db.add(habit)
+        db.flush()
+        notification = models.Notification(user_id=user.id, habit_id=habit.id, time=time(8, 0), enabled=True)
+        db.add(notification)
+        db.flush()
+        outbox = models.NotificationOutbox(
+            notification_id=notification.id,
+            user_id=user.id,
+            scheduled_for=now,
+            next_attempt_at=now - timedelta(seconds=1),
+        )
+        db.add(outbox)
+        db.flush()
+        outbox_users[outbox.id] = user.id
+    db.commit()
+
+    claimed = {}
+    for partition in range(PARTITIONS):
+        rows = crud.claim_outbox_batch(
+            db, now=now, batch_size=100, lease_seconds=60, max_attempts=5,
+            partition=partition, partitions=PARTITIONS,
+        )
+        rows = [row for row in rows if row.outbox_id in outbox_users]
+        assert all(row.user_id % PARTITIONS == partition for row in rows)
+        claimed.update((row.outbox_id, partition) for row in rows)
+
+    assert set(claimed) == set(outbox_users)
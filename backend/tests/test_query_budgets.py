@@ -0,0 +1,60 @@
+"""
+主な読み取り系のエンドポイントが、決められた数（クエリの予算）以下のSQL文で応答していることを確認する。
+同じ形のSQL文が繰り返された場合（N+1 の疑い）も失敗させる。
+予算には get_current_user によるユーザーの取得（認証キャッシュに無い場合の1件）を含めている。
+"""
+
+from datetime import datetime, time, timedelta, timezone
+
+import pytest
+
+import auth_cache
+import crud
+import models
+import scheduling
+
+# (パス, 予算)。{habit_id}・{start_date}・{end_date} はテストのデータで埋める
+QUERY_BUDGETS = [
+    ("/users/me", 1),
+    ("/dashboard", 1 + crud.DASHBOARD_QUERY_COUNT),
+    ("/habits", 2),
+    ("/habits/{habit_id}", 2),
+    ("/habits/{habit_id}/records?start_date={start_date}&end_date={end_date}", 3),
+    ("/habits/{habit_id}/calendar?start_date={start_date}&end_date={end_date}", 3),
+    ("/records?start_date={start_date}&end_date={end_date}", 2),
+    ("/habits/{habit_id}/stats", 2),
+    ("/users/me/stats", 2),
+    ("/habits/{habit_id}/goals", 3),
+    ("/habits/{habit_id}/notifications", 3),
+]
+HABITS = 3
+DAYS = 30
+
+
+@pytest.fixture
+def params(db, user):
+    """記録・目標・通知の付いた習慣を作成し、パスに埋める値を返す（N+1 があれば同じ形の文が習慣の数だけ繰り返される）"""
+    today = scheduling.local_today(user.timezone)
+    now = datetime.now(timezone.utc)
+    habit_ids = []
+    for i in range(HABITS):
+        habit = models.Habit(user_id=user.id, name=f"habit-{i}", created_at=now)
+        db.add(habit)
+        db.flush()
+        habit_ids.append(habit.id)
+        db.add_all(models.HabitRecord(habit_id=habit.id, date=today - timedelta(days=d), status=d % 3 != 0) for d in range(DAYS))
+        db.add_all(
+            models.Goal(habit_id=habit.id, target_count=10, start_date=today - timedelta(days=7 * k), end_date=today + timedelta(days=7))
+            for k in range(2)
+        )
+        db.add(models.Notification(user_id=user.id, habit_id=habit.id, time=time(8, 0), enabled=True))
+    db.commit()
+    return dict(habit_id=habit_ids[0], start_date=today - timedelta(days=DAYS), end_date=today)
+
+
+@pytest.mark.parametrize("path, budget", QUERY_BUDGETS, ids=[path.split("?")[0] for path, _ in QUERY_BUDGETS])
+def test_endpoint_stays_within_query_budget(client, params, query_budget, path, budget):
+    auth_cache.principal_cache.clear()
+    with query_budget(budget, max_repeats=1):
+        response = client.get(path.format(**params))
+    assert response.status_code == 200, response.text
@@ -0,0 +1,21 @@
+"""
+RequestMiddleware がレスポンスヘッダー（相関ID・SQL文の数）を返すことを確認する。
+"""
+
+
+def test_response_headers_report_correlation_id_and_queries(client, count_queries):
+    with count_queries() as statements:
+        response = client.get("/habits", headers={"X-Request-ID": "test-request-1"})
+
+    assert response.status_code == 200, response.text
+    assert response.headers["X-Request-ID"] == "test-request-1"
+    assert int(response.headers["X-DB-Query-Count"]) == len(statements)
+    assert float(response.headers["X-DB-Query-Time-Ms"]) >= 0
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+
+
+def test_correlation_id_is_generated_when_missing(client):
+    response = client.get("/habits")
+
+    assert response.status_code == 200, response.text
+    assert response.headers["X-Request-ID"]
@@ -0,0 +1,78 @@
+"""
+習慣と通知の作成・更新・削除が、所有権の確認を含めて1つのSQL文で済んでいることを確認する。
+認証キャッシュに無い場合は、get_current_user によるユーザーの取得が1文加わる。
+"""
+
+from datetime import datetime, time, timezone
+
+import pytest
+
+import auth_cache
+import models
+
+WRITE_QUERIES = 1
+
+
+@pytest.fixture
+def habit(db, user):
+    habit = models.Habit(user_id=user.id, name="ランニング", created_at=datetime.now(timezone.utc))
+    db.add(habit)
+    db.commit()
+    return habit
+
+
+@pytest.fixture
+def notification(db, user, habit):
+    notification = models.Notification(user_id=user.id, habit_id=habit.id, time=time(8, 0), enabled=True)
+    db.add(notification)
+    db.commit()
+    return notification
+
+
+WRITE_REQUESTS = [
+    ("POST", "/habits", lambda ids: {"json": {"name": "読書"}}, 201),
+    ("PUT", "/habits/{habit_id}", lambda ids: {"json": {"name": "筋トレ"}}, 200),
+    ("DELETE", "/habits/{habit_id}", lambda ids: {}, 204),
+    ("POST", "/notifications", lambda ids: {"json": {"habit_id": ids["habit_id"], "time": "07:30:00"}}, 201),
+    ("PUT", "/notifications/{notification_id}", lambda ids: {"json": {"time": "21:00:00", "enabled": True}}, 200),
+    ("DELETE", "/notifications/{notification_id}", lambda ids: {}, 204),
+]
+
+
+@pytest.mark.parametrize("cached", [True, False], ids=["auth-cached", "auth-miss"])
+@pytest.mark.parametrize("method, path, make_kwargs, expected_status", WRITE_REQUESTS, ids=[f"{m} {p}" for m, p, _, _ in WRITE_REQUESTS])
+def test_write_runs_one_statement(client, notification, count_queries, cached, method, path, make_kwargs, expected_status):
+    ids = {"habit_id": notification.habit_id, "notification_id": notification.id}
+    auth_cache.principal_cache.clear()
+    if cached:
+        assert client.get("/users/me").status_code == 200
+
+    with count_queries() as statements:
+        response = client.request(method, path.format(**ids), **make_kwargs(ids))
+
+    assert response.status_code == expected_status, response.text
+    assert len(statements) == WRITE_QUERIES + (0 if cached else 1), statements
+
+
+# 習慣の作成は所有権を確認する対象がない
+OWNED_WRITE_REQUESTS = [request for request in WRITE_REQUESTS if request[:2] != ("POST", "/habits")]
+
+
+@pytest.mark.parametrize("method, path, make_kwargs, expected_status", OWNED_WRITE_REQUESTS, ids=[f"{m} {p}" for m, p, _, _ in OWNED_WRITE_REQUESTS])
+def test_write_to_other_users_rows_is_not_found(client, make_user, db, count_queries, method, path, make_kwargs, expected_status):
+    """他のユーザーの習慣・通知は、同じ1文の中で対象外になる（404）"""
+    other = make_user()
+    habit = models.Habit(user_id=other.id, name="他人の習慣", created_at=datetime.now(timezone.utc))
+    db.add(habit)
+    db.flush()
+    notification = models.Notification(user_id=other.id, habit_id=habit.id, time=time(8, 0), enabled=True)
+    db.add(notification)
+    db.commit()
+    ids = {"habit_id": habit.id, "notification_id": notification.id}
+    assert client.get("/users/me").status_code == 200
+
+    with count_queries() as statements:
+        response = client.request(method, path.format(**ids), **make_kwargs(ids))
+
+    assert response.status_code == 404, response.text
+    assert len(statements) == WRITE_QUERIES, statements
@@ -75,6 +75,11 @@ const apiClient = {
     if (!response.ok) { throw new Error('習慣リストの取得に失敗しました。'); }
     return response.json();
   },
+  async getDashboard(token) {
+    const response = await fetch(`${API_URL}/dashboard`, { headers: { 'Authorization': `Bearer ${token}` } });
+    if (!response.ok) { throw new Error('ダッシュボードの取得に失敗しました。'); }
+    return response.json();
+  },
   async createHabit(token, name, description) {
     const response = await fetch(`${API_URL}/habits`, {
         method: 'POST',
@@ -108,6 +113,11 @@ const apiClient = {
     if (!response.ok) { throw new Error('習慣記録の取得に失敗しました。'); }
     return response.json();
   },
+  async getCompletedDates(token, startDate, endDate) {
+    const response = await fetch(`${API_URL}/records?start_date=${startDate}&end_date=${endDate}`, { headers: { 'Authorization': `Bearer ${token}` } });
+    if (!response.ok) { throw new Error('習慣記録の取得に失敗しました。'); }
+    return response.json();
+  },
   async createNotification(token, habitId, time) {
     const response = await fetch(`${API_URL}/notifications`, {
         method: 'POST',
@@ -322,14 +332,21 @@ function Header({ user, onLogout }) {
 // --- ダッシュボードコンポーネント ---
 function Dashboard({ token, onHabitSelect }) {
   const [habits, setHabits] = useState([]);
+  const [completedDates, setCompletedDates] = useState({});
   const [isLoadingHabits, setIsLoadingHabits] = useState(true);
   const [isModalOpen, setIsModalOpen] = useState(false);
 
   const fetchHabits = useCallback(async () => {
     setIsLoadingHabits(true);
+    const year = new Date().getFullYear();
     try {
-      const habitsData = await apiClient.getHabits(token);
-      setHabits(habitsData);
+      // 習慣の一覧（今日の達成状況・目標・通知を含む）と、すべての習慣の1月の達成日をまとめて取得する
+      const [dashboardData, recordsData] = await Promise.all([
+        apiClient.getDashboard(token),
+        apiClient.getCompletedDates(token, `${year}-01-01`, `${year}-01-31`),
+      ]);
+      setHabits(dashboardData.habits);
+      setCompletedDates(Object.fromEntries(recordsData.habits.map(h => [h.habit_id, h.dates])));
     } catch (error) {
       console.error("Failed to fetch habits:", error);
     } finally {
@@ -359,7 +376,7 @@ function Dashboard({ token, onHabitSelect }) {
       (
         <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
           {habits.map(habit => (
-            <HabitProgressCard key={habit.id} habit={habit} token={token} onSelect={() => onHabitSelect(habit)} />
+            <HabitProgressCard key={habit.id} habit={habit} completedDates={completedDates[habit.id] || []} onSelect={() => onHabitSelect(habit)} />
           ))}
         </div>
       )}
@@ -369,31 +386,9 @@ function Dashboard({ token, onHabitSelect }) {
 }
 
 // --- 習慣プログレスカードコンポーネント ---
-function HabitProgressCard({ habit, token, onSelect }) {
-  const [progress, setProgress] = useState({ completed: 0, total: 31 });
-  const [isLoading, setIsLoading] = useState(true);
-
-  useEffect(() => {
-    const fetchJanuaryProgress = async () => {
-      setIsLoading(true);
-      const year = new Date().getFullYear();
-      const startDate = `${year}-01-01`;
-      const endDate = `${year}-01-31`;
-
-      try {
-        const records = await apiClient.getHabitRecords(token, habit.id, startDate, endDate);
-        const completedCount = records.filter(r => r.status).length;
-        setProgress({ completed: completedCount, total: 31 });
-      } catch (error) {
-        console.error(`Failed to fetch records for habit ${habit.id}:`, error);
-      } finally {
-        setIsLoading(false);
-      }
-    };
-    fetchJanuaryProgress();
-  }, [habit.id, token]);
-  
-  const percentage = isLoading ? 0 : Math.round((progress.completed / progress.total) * 100);
+function HabitProgressCard({ habit, completedDates, onSelect }) {
+  const progress = { completed: completedDates.length, total: 31 };
+  const percentage = Math.round((progress.completed / progress.total) * 100);
 
   return (
     <div onClick={onSelect} className="bg-gray-800 p-6 rounded-lg transition-all duration-200 hover:bg-gray-700/80 cursor-pointer transform hover:scale-105">
@@ -405,7 +400,7 @@ function HabitProgressCard({ habit, token, onSelect }) {
         <div className="mt-4">
             <div className="flex justify-between items-center text-sm mb-1">
                 <span className="font-semibold text-indigo-400">1月の進捗</span>
-                {isLoading ? <span className="text-gray-500">...</span> : <span className="text-white font-bold">{progress.completed} / {progress.total} 日</span>}
+                <span className="text-white font-bold">{progress.completed} / {progress.total} 日</span>
             </div>
             <div className="w-full bg-gray-700 rounded-full h-2.5">
                 <div className="bg-indigo-600 h-2.5 rounded-full" style={{ width: `${percentage}%`, transition: 'width 0.5s ease-in-out' }}></div>